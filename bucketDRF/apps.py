@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
 
 
 class BucketdrfConfig(AppConfig):
     name = 'bucketDRF'
+
+    def ready(self):
+        from bucketDRF.db import check_connections, mark_idle
+        # registers the bucketDRF.jobs tasks it defines, run_jobs workers never import the views
+        from bucketDRF import importer  # noqa: F401
+        from bucketDRF.metrics import install_query_recorder
+        from bucketDRF import profiling
+        request_started.connect(check_connections, dispatch_uid='bucketDRF.db.check_connections')
+        request_finished.connect(mark_idle, dispatch_uid='bucketDRF.db.mark_idle')
+        connection_created.connect(install_query_recorder, dispatch_uid='bucketDRF.metrics.install_query_recorder')
+        connection_created.connect(profiling.install_query_recorder,
+                                   dispatch_uid='bucketDRF.profiling.install_query_recorder')
@@ -0,0 +1,183 @@
+"""
+Async variants of the note views, routed by bucket_list.urls_async when served thru bucket_list.asgi.
+
+The event loop holds the slow client connections, only the ORM calls (sync_to_async) take a thread,
+and bodies are rendered with the JSONRenderer of the sync views so the JSON matches bucketDRF.views.
+"""
+
+# Django imports
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.status import HTTP_201_CREATED, HTTP_200_OK, HTTP_400_BAD_REQUEST
+
+# Models import
+from bucketDRF.models import Note
+
+# Views import
+from bucketDRF import views
+
+# Renderers imports
+from bucketDRF.renderers import JSONRenderer
+
+# Pagination imports
+from bucketDRF.pagination import (PaginationError, as_columns, is_paginated, paginate_notes, parse_fields,
+                                  parse_layout)
+
+# Cache imports
+from bucketDRF import notes_cache
+from bucketDRF.conditional import NOTE_LISTS, conditional_response
+
+# Events imports
+from bucketDRF import events
+
+# DB imports
+from bucketDRF.db.replicas import use_replicas
+
+# Misc. imports
+import datetime
+import functools
+
+renderer = JSONRenderer()
+
+
+def json_response(data, status):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+def async_api_view(sync_view, *methods):
+    """
+    Method check and csrf exemption (as APIView gives the sync views) for an async view,
+    Django's own decorators wrap it into a sync function and break the async dispatch.
+    HEAD runs a GET view. Other methods (OPTIONS, not allowed ones) go to the APIView <sync_view>
+    it mirrors, so the metadata and 405 bodies are those of the WSGI deployment.
+    """
+    allowed = methods + ('HEAD',) if 'GET' in methods else methods
+
+    def decorator(view):
+        fallback = sync_to_async(sync_view.as_view())
+
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                return await fallback(request, *args, **kwargs)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+@use_replicas('user')
+def _list_notes(request, kind, note_id=None):
+    """
+    Sync part of GetNotes / ViewArchivedNotes: conditional GET, cache and query.
+    Returns (data or 304 response, status, set_validators).
+    """
+    user_id = request.requested_by
+    dynamic_filter = dict(NOTE_LISTS[kind], user_id=user_id)
+    if note_id:
+        dynamic_filter['id'] = note_id
+    queryset = Note.objects.filter(**dynamic_filter)
+    not_modified, set_validators = conditional_response(request, kind)
+    if not_modified is not None:
+        return not_modified, None, None
+
+    try:
+        fields = parse_fields(request)
+        columns = parse_layout(request)
+        if not note_id and is_paginated(request):
+            params = (request.GET.get('limit'), request.GET.get('cursor')) + fields
+            notes_data, next_cursor = notes_cache.get_or_load(user_id, kind, params,
+                                                              lambda: paginate_notes(queryset, request, fields))
+            return ({'result': as_columns(notes_data, fields) if columns else notes_data, 'next_cursor': next_cursor},
+                    HTTP_200_OK, set_validators)
+    except PaginationError as e:
+        return {'message': str(e)}, HTTP_400_BAD_REQUEST, None
+
+    if note_id:
+        notes_data = queryset.values(*fields).first()
+    else:
+        notes_data = notes_cache.get_or_load(user_id, kind, fields, lambda: list(queryset.values(*fields)))
+    if not notes_data:
+        return {'message': 'No notes found.'}, HTTP_200_OK, set_validators
+    if columns and not note_id:
+        notes_data = as_columns(notes_data, fields)
+    return {'result': notes_data}, HTTP_200_OK, set_validators
+
+
+async def _list_response(request, kind, note_id=None):
+    data, status, set_validators = await sync_to_async(_list_notes)(request, kind, note_id)
+    if isinstance(data, HttpResponse):
+        return data
+    response = json_response(data, status)
+    return set_validators(response) if set_validators else response
+
+
+@async_api_view(views.GetNotes, 'GET')
+async def get_notes(request):
+    """ Async GetNotes, same parameters and responses, url pattern -> notes/view """
+    return await _list_response(request, 'active', request.GET.get('note_id', None))
+
+
+@async_api_view(views.ViewArchivedNotes, 'GET')
+async def view_archived_notes(request):
+    """ Async ViewArchivedNotes, same parameters and responses, url pattern -> notes/getarchived """
+    return await _list_response(request, 'archived')
+
+
+def _create_note(user_id, title, details):
+    now = datetime.datetime.now()
+    note = Note.objects.create(user_id=user_id, title=title, details=details, created_at=now, updated_at=now,
+                               flag=True)
+    notes_cache.invalidate(user_id)
+    events.publish(user_id, 'created', note.id, now)
+
+
+@async_api_view(views.CreateNote, 'POST')
+async def create_note(request):
+    """ Async CreateNote, same parameters and responses, url pattern -> notes/create/ """
+    await sync_to_async(_create_note)(request.requested_by, request.POST.get('title', None),
+                                      request.POST.get('details', None))
+    return json_response({'result': 'Note created!'}, HTTP_201_CREATED)
+
+
+def _update_note(user_id, note_id, event_type, **changes):
+    # a single conditional UPDATE, ownership and existence checked by its WHERE clause
+    updated = Note.objects.filter(id=note_id, user_id=user_id, flag=True).update(**changes)
+    if updated:
+        notes_cache.invalidate(user_id)
+        events.publish(user_id, event_type, int(note_id), changes['updated_at'])
+    return updated
+
+
+@async_api_view(views.EditNote, 'POST')
+async def edit_note(request):
+    """ Async EditNote, same parameters and responses, url pattern -> notes/edit/ """
+    note_id = request.POST.get('note_id', None)
+    mode = request.POST.get('mode', None)
+    now = datetime.datetime.now()
+    if not note_id:
+        return json_response({'message': 'No note_id'}, HTTP_400_BAD_REQUEST)
+    if mode == 'edit':
+        changes = {'details': request.POST.get('details', None), 'title': request.POST.get('title', None),
+                   'updated_at': now}
+        result, event_type = 'Note edited', 'edited'
+    elif mode == 'delete':
+        changes = {'flag': False, 'updated_at': now}
+        result, event_type = 'Note deleted.', 'deleted'
+    else:
+        return json_response({'message': 'Please provide a mode, edit or delete'}, HTTP_400_BAD_REQUEST)
+
+    if not note_id.isdigit() or not await sync_to_async(_update_note)(request.requested_by, note_id, event_type,
+                                                                      **changes):
+        return json_response({'message': 'Note not found'}, HTTP_400_BAD_REQUEST)
+    return json_response({'result': result}, HTTP_200_OK)
+
+
+@async_api_view(views.ArchiveNote, 'GET')
+async def archive_note(request):
+    """ Async ArchiveNote, same parameters and responses, url pattern -> notes/archive """
+    note_id = request.GET.get('note_id', '')
+    if not note_id.isdigit() or not await sync_to_async(_update_note)(
+            request.requested_by, note_id, 'archived', archived=True, updated_at=datetime.datetime.now()):
+        return json_response({'message': 'Note not found.'}, HTTP_400_BAD_REQUEST)
+    return json_response({'result': 'Note archived!'}, HTTP_200_OK)
@@ -0,0 +1,127 @@
+# Django imports
+from django.conf import settings
+from django.db import connections, router, transaction
+
+# Models import
+from bucketDRF.models import Note
+
+# Cache imports
+from bucketDRF import notes_cache
+
+# Events imports
+from bucketDRF import events
+
+# Misc. imports
+import datetime
+
+MAX_OPERATIONS = getattr(settings, 'NOTES_BATCH_MAX_OPERATIONS', 500)
+TITLE_MAX_LENGTH = Note._meta.get_field('title').max_length
+DETAILS_MAX_LENGTH = Note._meta.get_field('details').max_length
+
+
+class BatchError(ValueError):
+    """ Raised when the batch as a whole is malformed, views turn it into a 400 """
+
+
+def note_text_error(title, details):
+    if not title or not isinstance(title, str):
+        return 'title is required.'
+    if len(title) > TITLE_MAX_LENGTH:
+        return 'title is longer than {} characters.'.format(TITLE_MAX_LENGTH)
+    if details is not None and not isinstance(details, str):
+        return 'details must be a string.'
+    if details and len(details) > DETAILS_MAX_LENGTH:
+        return 'details is longer than {} characters.'.format(DETAILS_MAX_LENGTH)
+    return None
+
+
+def _note_id(operation):
+    try:
+        return int(operation.get('note_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_batch(user_id, operations):
+    """
+    Applies create/edit/archive/delete operations for one user in a single transaction:
+    one bulk INSERT (one per note on sqlite), one UPDATE for all edits, one for all archives and one for all deletes.
+    Operations on notes the user does not own (or which are deleted) fail on their own,
+    the rest of the batch still goes thru. Returns one result per operation, in order,
+    created notes with their new id.
+    """
+    if not isinstance(operations, list):
+        raise BatchError('Expected a JSON array of operations.')
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError('At most {} operations per batch.'.format(MAX_OPERATIONS))
+
+    results = [None] * len(operations)
+    creates, edits, archives, deletes = [], {}, {}, {}
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op == 'create':
+            error = note_text_error(operation.get('title'), operation.get('details'))
+            if error:
+                results[index] = {'status': 400, 'message': error}
+            else:
+                creates.append((index, operation))
+        elif op in ('edit', 'archive', 'delete'):
+            note_id = _note_id(operation)
+            error = None if note_id else 'No note_id'
+            if op == 'edit' and not error:
+                error = note_text_error(operation.get('title'), operation.get('details'))
+            if error:
+                results[index] = {'status': 400, 'message': error}
+            else:
+                {'edit': edits, 'archive': archives, 'delete': deletes}[op].setdefault(note_id, []).append(
+                    (index, operation))
+        else:
+            results[index] = {'status': 400, 'message': 'Please provide an op, create, edit, archive or delete'}
+
+    now = datetime.datetime.now()
+    with transaction.atomic():
+        # one ownership check for every note referenced by the batch
+        owned = set(Note.objects.filter(user_id=user_id, flag=True, id__in=set(edits) | set(archives) | set(deletes))
+                    .values_list('id', flat=True))
+        for pending in (edits, archives, deletes):
+            for note_id in [note_id for note_id in pending if note_id not in owned]:
+                for index, _ in pending.pop(note_id):
+                    results[index] = {'status': 400, 'message': 'Note not found', 'id': note_id}
+
+        if creates:
+            notes = [Note(user_id=user_id, title=operation['title'], details=operation.get('details'), created_at=now,
+                          updated_at=now, flag=True) for _, operation in creates]
+            if connections[router.db_for_write(Note)].features.can_return_rows_from_bulk_insert:
+                Note.objects.bulk_create(notes)
+            else:
+                # sqlite with Django 3.2 returns no ids from a bulk INSERT, one INSERT per note there
+                for note in notes:
+                    note.save(force_insert=True)
+            for (index, _), note in zip(creates, notes):
+                results[index] = {'status': 201, 'id': note.id}
+
+        if edits:
+            # the last edit of a note in the batch wins
+            Note.objects.bulk_update([Note(id=note_id, title=indexed[-1][1]['title'],
+                                           details=indexed[-1][1].get('details'), updated_at=now)
+                                      for note_id, indexed in edits.items()], ['title', 'details', 'updated_at'])
+
+        if archives:
+            Note.objects.filter(user_id=user_id, id__in=archives).update(archived=True, updated_at=now)
+
+        if deletes:
+            Note.objects.filter(user_id=user_id, id__in=deletes).update(flag=False, updated_at=now)
+
+        for pending in (edits, archives, deletes):
+            for note_id, indexed in pending.items():
+                for index, _ in indexed:
+                    results[index] = {'status': 200, 'id': note_id}
+
+    if creates or edits or archives or deletes:
+        notes_cache.invalidate(user_id)
+    for note in (notes if creates else ()):
+        events.publish(user_id, 'created', note.id, now)
+    for event_type, pending in (('edited', edits), ('archived', archives), ('deleted', deletes)):
+        for note_id in pending:
+            events.publish(user_id, event_type, note_id, now)
+    return results
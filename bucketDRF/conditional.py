@@ -0,0 +1,76 @@
+# Django imports
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+# Models import
+from bucketDRF.models import Note
+
+# Cache imports
+from bucketDRF import notes_cache
+
+# Misc. imports
+from calendar import timegm
+import hashlib
+
+NOTE_LISTS = {
+    'active': {'archived': False, 'flag': True},
+    'archived': {'archived': True, 'flag': True},
+}
+
+
+def list_validator(user_id, kind):
+    """
+    Row count of a user's note list and max(updated_at) of all the user's notes, one aggregate query,
+    cached with the list. Archived and deleted notes count for the latter, taking a note out of the list
+    moves its updated_at forward while the max of the rows left in the list would stay or go back.
+    """
+    return notes_cache.get_or_load(
+        user_id, kind, ('validator',),
+        lambda: Note.objects.filter(user_id=user_id).aggregate(count=Count('id', filter=Q(**NOTE_LISTS[kind])),
+                                                               last_modified=Max('updated_at')))
+
+
+def _request_validator(request, kind):
+    # condition() asks for the etag and last modified separately, compute once per request
+    if not hasattr(request, 'notes_validator'):
+        request.notes_validator = list_validator(request.requested_by, kind)
+    return request.notes_validator
+
+
+def list_etag(request, kind):
+    """ The query string is part of the ETag since fields/limit/cursor/note_id change the body """
+    validator = _request_validator(request, kind)
+    last_modified = validator['last_modified'].isoformat() if validator['last_modified'] else ''
+    params = hashlib.md5(request.META.get('QUERY_STRING', '').encode()).hexdigest()[:8]
+    return '{}-{}-{}-{}'.format(kind, validator['count'], last_modified, params)
+
+
+def list_last_modified(request, kind):
+    return _request_validator(request, kind)['last_modified']
+
+
+def notes_condition(kind):
+    """ Conditional GET for a note list view, answers 304 from the validator alone """
+    return condition(etag_func=lambda request, *args, **kwargs: list_etag(request, kind),
+                     last_modified_func=lambda request, *args, **kwargs: list_last_modified(request, kind))
+
+
+def conditional_response(request, kind):
+    """
+    What notes_condition does, for views condition() cannot wrap (async views).
+    Returns (304 response or None, callable setting ETag/Last-Modified on the 200 response).
+    """
+    etag = quote_etag(list_etag(request, kind))
+    last_modified = list_last_modified(request, kind)
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+    def set_validators(response):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    return not_modified, set_validators
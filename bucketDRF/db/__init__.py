@@ -0,0 +1,75 @@
+# Django imports
+from django.db import connections
+
+# Misc. imports
+import threading
+import time
+
+# seconds a connection may sit unused before the next request pings it
+HEALTH_CHECK_IDLE = 30
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _alias_stats(alias):
+    return _stats.setdefault(alias, {
+        'connects': 0,
+        'connect_seconds': 0.0,
+        'checkouts': 0,
+        'checkout_wait_seconds': 0.0,
+        'checkout_wait_max_seconds': 0.0,
+        'pool_timeouts': 0,
+        'health_check_failures': 0,
+    })
+
+
+def record(alias, counter, amount=1):
+    with _lock:
+        _alias_stats(alias)[counter] += amount
+
+
+def record_checkout(alias, wait):
+    with _lock:
+        stats = _alias_stats(alias)
+        stats['checkouts'] += 1
+        stats['checkout_wait_seconds'] += wait
+        stats['checkout_wait_max_seconds'] = max(stats['checkout_wait_max_seconds'], wait)
+
+
+def stats():
+    """ Per process connection counters for each database alias """
+    with _lock:
+        return {alias: dict(counters) for alias, counters in _stats.items()}
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+def check_connections(**kwargs):
+    """
+    request_started receiver, drops persistent connections which went stale between requests
+    (server restart, idle timeout on a proxy) before a view trips over them. Only connections idle
+    for HEALTH_CHECK_IDLE seconds are pinged, those of a busy worker go straight to the view.
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict.get('HEALTH_CHECKS', False):
+            continue
+        idle_since = getattr(connection, 'idle_since', None)
+        if idle_since is not None and now - idle_since < connection.settings_dict.get('HEALTH_CHECK_IDLE',
+                                                                                       HEALTH_CHECK_IDLE):
+            continue
+        if not connection.is_usable():
+            record(connection.alias, 'health_check_failures')
+            connection.close()
+
+
+def mark_idle(**kwargs):
+    """ request_finished receiver, the connections left open are idle from now on """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.idle_since = now
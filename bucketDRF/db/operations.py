@@ -0,0 +1,24 @@
+"""
+Migration operations which keep the note and user tables writable during the release phase.
+"""
+
+# Django imports
+from django.contrib.postgres import operations
+from django.db.migrations import AddIndex
+
+
+class AddIndexConcurrently(operations.AddIndexConcurrently):
+    """
+    CREATE INDEX CONCURRENTLY on postgres, a plain AddIndex elsewhere (the sqlite test database).
+    Its migration needs atomic = False, postgres cannot build an index concurrently inside a transaction.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+        return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+        return super().database_backwards(app_label, schema_editor, from_state, to_state)
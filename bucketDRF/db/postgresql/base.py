@@ -0,0 +1,130 @@
+"""
+PostgreSQL backend which times every connect and, when the database sets POOL_SIZE,
+hands out connections from a bounded in-process pool instead of opening a new one.
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'bucketDRF.db.postgresql',
+        'POOL_SIZE': 4,           # 0 disables the pool, size it to the threads of one worker process
+        'POOL_TIMEOUT': 10,       # seconds a request waits for a free connection
+        'HEALTH_CHECKS': True,    # ping reused connections before handing them out...
+        'HEALTH_CHECK_IDLE': 30,  # ...once they sat unused for that many seconds
+        ...
+    }
+}
+"""
+
+# Django imports
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+
+# DB stats imports
+from bucketDRF.db import HEALTH_CHECK_IDLE, record, record_checkout
+
+# Misc. imports
+from psycopg2 import extensions, extras, pool
+import threading
+import time
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool(object):
+    """ psycopg2's ThreadedConnectionPool raises when exhausted, this one makes callers wait up to timeout """
+
+    def __init__(self, alias, size, timeout, conn_params, health_check_idle=HEALTH_CHECK_IDLE):
+        self.alias = alias
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        self._slots = threading.BoundedSemaphore(size)
+        self._pool = pool.ThreadedConnectionPool(0, size, **conn_params)
+        # when each pooled connection was checked in, by id(), new connections are not in it
+        self._idle_since = {}
+
+    def _needs_check(self, connection):
+        idle_since = self._idle_since.pop(id(connection), None)
+        return idle_since is not None and time.monotonic() - idle_since >= self.health_check_idle
+
+    def checkout(self, health_checks):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            record(self.alias, 'pool_timeouts')
+            raise OperationalError('No free connection in the pool for {} after {}s.'.format(self.alias,
+                                                                                          self.timeout))
+        try:
+            connection = self._pool.getconn()
+            stale = self._needs_check(connection) and health_checks and not self._is_usable(connection)
+            if connection.closed or stale:
+                record(self.alias, 'health_check_failures')
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+                self._idle_since.pop(id(connection), None)
+        except Exception:
+            self._slots.release()
+            raise
+        record_checkout(self.alias, time.perf_counter() - start)
+        return connection
+
+    def checkin(self, connection):
+        try:
+            discard = bool(connection.closed)
+            if not discard and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                # never hand the next request somebody else's open transaction
+                connection.rollback()
+            if not discard:
+                self._idle_since[id(connection)] = time.monotonic()
+            self._pool.putconn(connection, close=discard)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _is_usable(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+
+def get_pool(alias, settings_dict, conn_params):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(alias, settings_dict['POOL_SIZE'], settings_dict.get('POOL_TIMEOUT', 10),
+                                           conn_params, settings_dict.get('HEALTH_CHECK_IDLE', HEALTH_CHECK_IDLE))
+        return _pools[alias]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def _pooled(self):
+        return bool(self.settings_dict.get('POOL_SIZE'))
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        if not self._pooled:
+            start = time.perf_counter()
+            connection = super().get_new_connection(conn_params)
+            record(self.alias, 'connects')
+            record(self.alias, 'connect_seconds', time.perf_counter() - start)
+            return connection
+
+        connection = get_pool(self.alias, self.settings_dict, conn_params).checkout(
+            self.settings_dict.get('HEALTH_CHECKS', False))
+        # same session setup as base.DatabaseWrapper.get_new_connection, minus the connect
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    @async_unsafe
+    def _close(self):
+        if self.connection is not None and self._pooled:
+            with self.wrap_database_errors:
+                return _pools[self.alias].checkin(self.connection)
+        return super()._close()
@@ -0,0 +1,149 @@
+"""
+Read replicas for GetNotes, ViewArchivedNotes and SignIn.
+
+Views decorated with use_replicas() read from one of settings.DB_REPLICAS, everything else (and every
+write) stays on 'default'. A user who just wrote reads from the primary for REPLICA_STICKY_SECONDS
+(read your writes), a sign-up does the same for its username. Replicas are health checked every
+REPLICA_CHECK_INTERVAL seconds, one that fails, lags more than REPLICA_MAX_LAG seconds or errors in
+the middle of a view is left out until it passes again, and the view runs again on the primary.
+"""
+
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+
+# DB stats imports
+from bucketDRF import db
+
+# Misc. imports
+import contextvars
+import functools
+import hashlib
+import itertools
+import threading
+import time
+
+REPLICAS = getattr(settings, 'DB_REPLICAS', [])
+STICKY_SECONDS = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+CHECK_INTERVAL = getattr(settings, 'REPLICA_CHECK_INTERVAL', 5)
+MAX_LAG = getattr(settings, 'REPLICA_MAX_LAG', 5)
+STICKY_CACHE = getattr(settings, 'REPLICA_STICKY_CACHE', 'users')
+# replay lag of a postgres standby, 0 when it has replayed everything it received
+LAG_SQL = ('SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+           'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+_health = {}
+_lock = threading.Lock()
+_turn = itertools.count()
+
+
+class ReplicaRouter(object):
+    """ settings.DATABASE_ROUTERS entry, reads inside use_replicas() go to its replica, writes to the primary """
+
+    @staticmethod
+    def db_for_read(model, **hints):
+        return _read_alias.get()
+
+    @staticmethod
+    def db_for_write(model, **hints):
+        # also for rows read from a replica, saving them would otherwise follow them there
+        return DEFAULT_DB_ALIAS
+
+    @staticmethod
+    def allow_relation(obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+def _check(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            if connections[alias].vendor == 'postgresql':
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+                return lag is None or lag <= MAX_LAG
+            cursor.execute('SELECT 1')
+            return True
+    except DatabaseError:
+        connections[alias].close()
+        return False
+
+
+def healthy(alias):
+    now = time.monotonic()
+    with _lock:
+        state = _health.get(alias)
+    if state is not None and now - state[1] < CHECK_INTERVAL:
+        return state[0]
+    is_healthy = _check(alias)
+    if not is_healthy:
+        db.record(alias, 'health_check_failures')
+    with _lock:
+        _health[alias] = (is_healthy, now)
+    return is_healthy
+
+
+def mark_down(alias):
+    with _lock:
+        _health[alias] = (False, time.monotonic())
+
+
+def _sticky_key(kind, value):
+    # usernames come straight from the request, keep them out of the key
+    return 'replica:sticky:{}:{}'.format(kind, hashlib.sha256(str(value).encode()).hexdigest())
+
+
+def mark_written(kind, value):
+    """ Reads for ('user', user_id) or ('username', username) stay on the primary for STICKY_SECONDS """
+    if REPLICAS and value is not None:
+        caches[STICKY_CACHE].set(_sticky_key(kind, value), True, STICKY_SECONDS)
+
+
+def read_alias(kind, value):
+    """ A healthy replica to read from for this user, None for the primary """
+    if value is not None and caches[STICKY_CACHE].get(_sticky_key(kind, value)):
+        return None
+    candidates = [alias for alias in REPLICAS if healthy(alias)]
+    if not candidates:
+        return None
+    return candidates[next(_turn) % len(candidates)]
+
+
+STICKY_VALUES = {
+    'user': lambda request: getattr(request, 'requested_by', None),
+    'username': lambda request: request.POST.get('username'),
+}
+
+
+def use_replicas(kind):
+    """
+    Runs a read only view (or the sync part of one, first argument the request) on a replica, unless
+    the user of <kind> ('user' or 'username') wrote within STICKY_SECONDS.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not REPLICAS:
+                return view(request, *args, **kwargs)
+            alias = read_alias(kind, STICKY_VALUES[kind](request))
+            if alias is None:
+                return view(request, *args, **kwargs)
+            token = _read_alias.set(alias)
+            try:
+                return view(request, *args, **kwargs)
+            except (OperationalError, InterfaceError):
+                # the replica went away mid request, the primary answers this one
+                mark_down(alias)
+                connections[alias].close()
+            finally:
+                _read_alias.reset(token)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    with _lock:
+        _health.clear()
@@ -0,0 +1,189 @@
+"""
+notes/events, the change stream of bucketDRF.events, for clients that would otherwise poll notes/view.
+
+Django 3.2 iterates streaming bodies synchronously and has no WebSockets, so bucket_list.asgi wraps
+its application in EventStreamRouter, which serves the streaming paths itself on the event loop,
+this one and notes/export (see ExportNotes, the rows are read on a thread of their own):
+
+GET notes/events (Server-Sent Events) or a WebSocket on the same path, with the usual
+key and Authorization: Bearer <jwt> headers, rate limited as any other route.
+Every change of one of the user's notes is sent as
+    {'type': 'created' | 'edited' | 'archived' | 'deleted', 'note_id': <note_id>, 'updated_at': <iso>}
+and {'type': 'resync'} when events were lost or notes were imported, the client then catches up with notes/sync.
+A stream holds no database connection and no thread while idle.
+"""
+
+# Django imports
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework.status import (HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED,
+                                   HTTP_429_TOO_MANY_REQUESTS)
+
+# Middleware imports
+from bucketDRF.middleware import TokenHandler
+
+# Events imports
+from bucketDRF import events
+
+# Export imports
+from bucketDRF import export
+
+# Rate limit imports
+from bucketDRF import ratelimit
+
+# Renderers imports
+from bucketDRF.renderers import dumps
+
+# Misc. imports
+import asyncio
+import io
+import math
+
+EVENTS_PATH = '/notes/events'
+EXPORT_PATH = '/notes/export'
+# comment lines keep idle connections open thru proxies (Heroku's router drops them after 55s)
+HEARTBEAT = getattr(settings, 'EVENTS_HEARTBEAT', 25)
+MAX_STREAMS_PER_USER = getattr(settings, 'EVENTS_MAX_STREAMS_PER_USER', 5)
+TOO_MANY_STREAMS = dumps({'message': 'Too many open streams.'})
+# close codes of a refused WebSocket, 4000 + the HTTP status
+WEBSOCKET_CLOSE_OFFSET = 4000
+
+
+def authenticate(scope, events_stream=True):
+    """ (user_id, None) for an allowed stream, (None, (status, body, headers)) otherwise, as ApiTokenCheckMiddleware """
+    request = ASGIRequest(dict(scope, method='GET'), io.BytesIO())
+    api_key = request.META.get('HTTP_KEY', None)
+    if not api_key or api_key != TokenHandler.API_KEY:
+        return None, (HTTP_400_BAD_REQUEST, TokenHandler.API_KEY_INVALID, [])
+    user_id = TokenHandler.verify_token(request.META.get('HTTP_AUTHORIZATION', ''))
+    if user_id is None:
+        return None, (HTTP_401_UNAUTHORIZED, TokenHandler.TOKEN_INVALID, [])
+    retry_after = ratelimit.check(request, api_key, user_id)
+    if retry_after:
+        return None, (HTTP_429_TOO_MANY_REQUESTS, TokenHandler.TOO_MANY_REQUESTS,
+                      [(b'retry-after', str(math.ceil(retry_after)).encode())])
+    if events_stream and events.broker.count(user_id) >= MAX_STREAMS_PER_USER:
+        return None, (HTTP_429_TOO_MANY_REQUESTS, TOO_MANY_STREAMS, [])
+    return user_id, None
+
+
+async def _next(subscription, closed):
+    """ Waits for the next event, None after HEARTBEAT idle seconds, raises EOFError once the client is gone """
+    waiting = asyncio.ensure_future(subscription.get())
+    done, _ = await asyncio.wait({waiting, closed}, timeout=HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+    if waiting not in done:
+        waiting.cancel()
+        if closed in done:
+            raise EOFError
+        return None
+    return waiting.result()
+
+
+async def _until_closed(receive, closing_types):
+    while (await receive())['type'] not in closing_types:
+        pass
+
+
+async def _refuse(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def server_sent_events(scope, receive, send):
+    user_id, refusal = authenticate(scope)
+    if refusal:
+        return await _refuse(send, *refusal)
+
+    await send({'type': 'http.response.start', 'status': HTTP_200_OK, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    subscription = events.broker.subscribe(user_id)
+    closed = asyncio.ensure_future(_until_closed(receive, ('http.disconnect',)))
+    try:
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while True:
+            try:
+                event = await _next(subscription, closed)
+            except EOFError:
+                return
+            if event is None:
+                body = b': ping\n\n'
+            else:
+                body = b'event: ' + event['type'].encode() + b'\ndata: ' + dumps(event) + b'\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        closed.cancel()
+        events.broker.unsubscribe(subscription)
+
+
+async def websocket(scope, receive, send):
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    user_id, refusal = authenticate(scope)
+    if refusal:
+        await send({'type': 'websocket.close', 'code': WEBSOCKET_CLOSE_OFFSET + refusal[0]})
+        return
+
+    await send({'type': 'websocket.accept'})
+    subscription = events.broker.subscribe(user_id)
+    # the client has nothing to say, its messages are read and dropped until it leaves
+    closed = asyncio.ensure_future(_until_closed(receive, ('websocket.disconnect',)))
+    try:
+        while True:
+            try:
+                event = await _next(subscription, closed)
+            except EOFError:
+                return
+            if event is not None:
+                await send({'type': 'websocket.send', 'text': dumps(event).decode()})
+    finally:
+        closed.cancel()
+        events.broker.unsubscribe(subscription)
+
+
+async def export_notes(scope, receive, send):
+    user_id, refusal = authenticate(scope, events_stream=False)
+    if refusal:
+        return await _refuse(send, *refusal)
+    try:
+        headers, chunks = export.prepare_export(ASGIRequest(scope, io.BytesIO()), user_id)
+    except export.ExportError as e:
+        return await _refuse(send, HTTP_400_BAD_REQUEST, dumps({'message': str(e)}))
+
+    await send({'type': 'http.response.start', 'status': HTTP_200_OK,
+                'headers': [(name.lower().encode(), value.encode()) for name, value in headers]})
+    closed = asyncio.ensure_future(_until_closed(receive, ('http.disconnect',)))
+    stream = export.in_thread_async(chunks)
+    try:
+        async for chunk in stream:
+            if closed.done():
+                return
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        closed.cancel()
+        # stops the reading thread when the client left early
+        await stream.aclose()
+
+
+class EventStreamRouter(object):
+    """ ASGI application serving notes/events and notes/export, handing every other request to Django """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            if scope['path'] == EVENTS_PATH:
+                return await server_sent_events(scope, receive, send)
+            if scope['path'] == EXPORT_PATH:
+                return await export_notes(scope, receive, send)
+        if scope['type'] == 'websocket':
+            if scope['path'] == EVENTS_PATH:
+                return await websocket(scope, receive, send)
+            await send({'type': 'websocket.close', 'code': WEBSOCKET_CLOSE_OFFSET + 404})
+            return
+        return await self.application(scope, receive, send)
@@ -0,0 +1,185 @@
+"""
+Per user note change events for the notes/events stream (bucketDRF.event_stream).
+
+Writes call publish() once their change is committed, the broker hands the event to every stream
+the user has open in this process. settings.EVENTS_BACKEND picks how events get to the broker:
+'local' delivers in the writing process (one ASGI process serving writes and streams), 'postgres'
+sends them thru NOTIFY on the writer's transaction and every process LISTENs, so streams on any
+worker (or a separate ASGI deployment next to gunicorn) see writes made anywhere.
+"""
+
+# Django imports
+from django.conf import settings
+from django.db import connections, transaction
+
+# Renderers imports
+from bucketDRF.renderers import dumps, loads
+
+# Misc. imports
+import asyncio
+import logging
+import select
+import threading
+import time
+
+QUEUE_SIZE = getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+CHANNEL = 'note_events'
+EVENT_TYPES = ('created', 'edited', 'archived', 'deleted')
+# sent instead of what a stream missed (its queue overflowed or the LISTEN connection dropped),
+# the client catches up with notes/sync
+RESYNC = {'type': 'resync'}
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """ One open stream, fed on its event loop thru a bounded queue """
+
+    def __init__(self, user_id, loop, size=QUEUE_SIZE):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def put(self, event):
+        # runs on self.loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return RESYNC
+        return await self.queue.get()
+
+
+class Broker(object):
+    """ Streams of this process by user, deliver() may be called from any thread """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """ Called on the event loop serving the stream """
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        backend.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # the loop is closed, its stream is gone
+                self.unsubscribe(subscription)
+
+    def deliver_all(self, event):
+        with self._lock:
+            user_ids = list(self._subscriptions)
+        for user_id in user_ids:
+            self.deliver(user_id, event)
+
+    def clear(self):
+        with self._lock:
+            self._subscriptions.clear()
+
+
+class LocalBackend(object):
+    """ Delivers to this process' broker when the writer's transaction commits """
+
+    @staticmethod
+    def publish(user_id, event):
+        transaction.on_commit(lambda: broker.deliver(user_id, event))
+
+    def start(self):
+        pass
+
+
+class PostgresBackend(object):
+    """
+    NOTIFY on the writer's connection (postgres sends it on commit, and not at all on rollback),
+    a LISTEN connection per process, opened with the first stream, feeds the broker.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, event):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, dumps({'user_id': user_id, 'event': event}).decode()])
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='note-events', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        reconnecting = False
+        while True:
+            listener = None
+            try:
+                listener = psycopg2.connect(**connections[self.alias].get_connection_params())
+                listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with listener.cursor() as cursor:
+                    cursor.execute('LISTEN {}'.format(CHANNEL))
+                if reconnecting:
+                    # whatever was published while not listening is lost
+                    broker.deliver_all(RESYNC)
+                reconnecting = True
+                while True:
+                    if select.select([listener], [], [], 30) == ([], [], []):
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        message = loads(listener.notifies.pop(0).payload)
+                        broker.deliver(message['user_id'], message['event'])
+            except psycopg2.Error as e:
+                logger.warning('Note events LISTEN connection failed: %s', e)
+                time.sleep(1)
+            finally:
+                if listener is not None:
+                    listener.close()
+
+
+broker = Broker()
+if getattr(settings, 'EVENTS_BACKEND', 'local') == 'postgres':
+    backend = PostgresBackend(getattr(settings, 'EVENTS_DATABASE', 'default'))
+else:
+    backend = LocalBackend()
+
+
+def publish(user_id, event_type, note_id, updated_at):
+    """ Tells the user's open streams that a note changed, call it right after the write """
+    backend.publish(user_id, {'type': event_type, 'note_id': note_id, 'updated_at': updated_at.isoformat()})
+
+
+def publish_resync(user_id):
+    """ For writes without note ids to report (imports), the user's streams catch up thru notes/sync """
+    backend.publish(user_id, RESYNC)
@@ -0,0 +1,213 @@
+# Django imports
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.utils.text import compress_sequence
+
+# Models import
+from bucketDRF.models import Note
+
+# Renderers imports
+from bucketDRF.renderers import dumps
+
+# Middleware imports
+from bucketDRF.middleware import Compression
+
+# Misc. imports
+from concurrent import futures
+import asyncio
+import csv
+import datetime
+import queue
+import threading
+
+EXPORT_FIELDS = ('id', 'title', 'details', 'archived', 'created_at', 'updated_at')
+CHUNK_SIZE = getattr(settings, 'NOTES_EXPORT_CHUNK_SIZE', 2000)
+# rows are sent in pieces of about this many bytes instead of one write per row
+BUFFER_SIZE = 64 * 1024
+
+
+class ExportError(ValueError):
+    pass
+
+
+def note_rows(user_id):
+    """
+    A user's notes (archived ones included, deleted ones not) oldest change first, along note_user_updated_idx.
+    Nothing runs until the first row is pulled, on postgres the rows come thru a server side cursor
+    CHUNK_SIZE at a time.
+    """
+    return (Note.objects.filter(user_id=user_id, flag=True).order_by('updated_at', 'id')
+            .values_list(*EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE))
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield dumps(dict(zip(EXPORT_FIELDS, row))) + b'\n'
+
+
+class _Echo(object):
+    """ csv.writer target handing the formatted line back instead of storing it """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS).encode()
+    for row in rows:
+        yield writer.writerow([value.isoformat() if isinstance(value, datetime.datetime) else value
+                               for value in row]).encode()
+
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+    'csv': ('text/csv', csv_lines),
+}
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    buffer, length = [], 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _produce(chunks, put, done):
+    try:
+        for chunk in chunks:
+            if not put(chunk):
+                return
+        put(done)
+    except Exception as e:
+        put(e)
+    finally:
+        connections.close_all()
+
+
+def in_thread(chunks, depth=4):
+    """
+    Pulls chunks on a thread of their own and hands them over thru a bounded queue, for a sync consumer
+    which may not run the ORM itself. Only the WSGI deployment should get here: Django 3.2's ASGI handler
+    iterates a streaming body on the event loop, which then waits in handoff.get() for every chunk.
+    Under bucket_list.asgi notes/export is served by bucketDRF.event_stream thru in_thread_async().
+    """
+    handoff = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        # gives up once the consumer is gone (client disconnected)
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    threading.Thread(target=_produce, args=(chunks, put, done), name='notes-export', daemon=True).start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+async def in_thread_async(chunks, depth=4):
+    """ in_thread() for an async consumer, waiting for the next chunk leaves the event loop free """
+    loop = asyncio.get_running_loop()
+    handoff = asyncio.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        pending = asyncio.run_coroutine_threadsafe(handoff.put(item), loop)
+        while True:
+            try:
+                pending.result(timeout=1)
+                return True
+            except futures.TimeoutError:
+                if stopped.is_set():
+                    pending.cancel()
+                    return False
+
+    threading.Thread(target=_produce, args=(chunks, put, done), name='notes-export', daemon=True).start()
+    try:
+        while True:
+            item = await handoff.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        # a producer waiting for room sees stopped once its put went thru
+        while not handoff.empty():
+            handoff.get_nowait()
+
+
+def _stream(chunks):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # WSGI, the server thread iterates the body after the view returned
+        yield from chunks
+        return
+    yield from in_thread(chunks)
+
+
+def brotli_sequence(chunks):
+    """ compress_sequence() for brotli, each chunk is flushed so the client gets it right away """
+    compressor = Compression.brotli.Compressor(quality=Compression.BROTLI_QUALITY)
+    for chunk in chunks:
+        yield compressor.process(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+ENCODERS = {
+    'gzip': compress_sequence,
+    'br': brotli_sequence,
+}
+
+
+def prepare_export(request, user_id):
+    """
+    (headers, chunks) of the user's notes as ?type=ndjson (default) or csv, brotli or gzip compressed as
+    the Accept-Encoding header prefers. Nothing is read from the database before the first chunk is pulled.
+    """
+    export_type = request.GET.get('type', 'ndjson')
+    if export_type not in FORMATS:
+        raise ExportError('type must be one of {}.'.format(', '.join(FORMATS)))
+    content_type, encode = FORMATS[export_type]
+    chunks = buffered(encode(note_rows(user_id)))
+    headers = [('Content-Type', content_type)]
+    encoding = Compression.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding:
+        chunks = ENCODERS[encoding](chunks)
+        headers.append(('Content-Encoding', encoding))
+    headers += [('Vary', 'Accept-Encoding'),
+                ('Content-Disposition', 'attachment; filename="notes.{}"'.format(export_type))]
+    return headers, chunks
+
+
+def export_response(request, user_id):
+    """ StreamingHttpResponse of prepare_export() """
+    headers, chunks = prepare_export(request, user_id)
+    response = StreamingHttpResponse(_stream(chunks))
+    for name, value in headers:
+        response[name] = value
+    return response
@@ -0,0 +1,66 @@
+# Django imports
+from django.conf import settings
+from django.contrib.auth import hashers
+
+# Misc. imports
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+HASH_OFFLOAD = getattr(settings, 'PASSWORD_HASH_OFFLOAD', True)
+HASH_WORKERS = getattr(settings, 'PASSWORD_HASH_WORKERS', 1)
+HASH_SLOTS = getattr(settings, 'PASSWORD_HASH_SLOTS', HASH_WORKERS + 1)
+
+
+class BCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    """ Work factor from settings.PASSWORD_BCRYPT_ROUNDS, hashes with another cost are rehashed on sign in """
+    rounds = getattr(settings, 'PASSWORD_BCRYPT_ROUNDS', hashers.BCryptSHA256PasswordHasher.rounds)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """ Costs from settings.PASSWORD_ARGON2_*, needs argon2-cffi installed """
+    time_cost = getattr(settings, 'PASSWORD_ARGON2_TIME_COST', hashers.Argon2PasswordHasher.time_cost)
+    memory_cost = getattr(settings, 'PASSWORD_ARGON2_MEMORY_COST', hashers.Argon2PasswordHasher.memory_cost)
+    parallelism = getattr(settings, 'PASSWORD_ARGON2_PARALLELISM', hashers.Argon2PasswordHasher.parallelism)
+
+
+class HasherBusy(Exception):
+    """ Every hashing slot of this process is taken, views answer 503 at once """
+
+
+_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hasher')
+_slots = threading.BoundedSemaphore(HASH_SLOTS)
+
+
+def offload(func, *args):
+    """
+    Runs a hashing call on this process' hasher pool, so sign ins use at most PASSWORD_HASH_WORKERS
+    cores per process. The request thread waits for its hash, at most PASSWORD_HASH_SLOTS threads of
+    a process do (fewer than gunicorn's threads, the others keep serving note reads), one more sign
+    in gets HasherBusy without waiting.
+    """
+    if not HASH_OFFLOAD:
+        return func(*args)
+    if not _slots.acquire(blocking=False):
+        raise HasherBusy()
+    try:
+        return _pool.submit(func, *args).result()
+    finally:
+        _slots.release()
+
+
+def _check(password, encoded):
+    rehashed = []
+    is_correct = hashers.check_password(password, encoded, setter=lambda raw: rehashed.append(hashers.make_password(raw)))
+    return is_correct, rehashed[0] if rehashed else None
+
+
+def hash_password(password):
+    return offload(hashers.make_password, password)
+
+
+def verify_password(password, encoded):
+    """
+    Returns (is_correct, new_hash), new_hash is set when the stored hash used another hasher
+    or work factor than the preferred one and should replace it.
+    """
+    return offload(_check, password, encoded)
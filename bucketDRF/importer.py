@@ -0,0 +1,237 @@
+"""
+Bulk import of notes from NDJSON or CSV, behind notes/import/ and manage.py import_notes.
+
+The upload is read line by line and inserted batch by batch (COPY on postgres, bulk_create elsewhere).
+Each batch commits together with the NoteImport checkpoint, so an interrupted import sent again with
+the same import_id carries on after the last committed row. Uploads imported in the background are
+kept in the database (NoteImportChunk) until a run_jobs worker, on whichever dyno, read all of them.
+"""
+
+# Django imports
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+# Models import
+from bucketDRF.models import Note, NoteImport, NoteImportChunk
+
+# Batch imports
+from bucketDRF.batch import note_text_error
+
+# Cache imports
+from bucketDRF import notes_cache
+
+# Events imports
+from bucketDRF import events
+
+# Renderers imports
+from bucketDRF.renderers import loads
+
+# Jobs imports
+from bucketDRF import jobs
+
+# Misc. imports
+import csv
+import datetime
+import io
+import re
+
+BATCH_SIZE = getattr(settings, 'NOTES_IMPORT_BATCH_SIZE', 1000)
+# bytes per stored piece of an upload imported in the background, the memory a worker reads it with
+UPLOAD_CHUNK_SIZE = getattr(settings, 'NOTES_IMPORT_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+# per row errors kept for the response, the counters cover all of them
+MAX_REPORTED_ERRORS = 100
+IMPORT_ID_PATTERN = re.compile(r'^[\w.:-]{1,64}$')
+FORMATS = ('ndjson', 'csv')
+TRUE_VALUES = ('1', 'true', 'yes')
+FALSE_VALUES = ('', '0', 'false', 'no')
+
+
+class ImportFailed(ValueError):
+    """ The upload as a whole cannot be imported, views turn it into a 400 """
+
+
+def _archived(value):
+    if isinstance(value, bool) or value is None:
+        return bool(value), None
+    if isinstance(value, str) and value.strip().lower() in TRUE_VALUES + FALSE_VALUES:
+        return value.strip().lower() in TRUE_VALUES, None
+    return None, 'archived must be true or false.'
+
+
+def _note_fields(fields):
+    """ (title, details, archived) of a parsed row, or the reason it is rejected """
+    if not isinstance(fields, dict):
+        return None, 'Expected a JSON object.'
+    title, details = fields.get('title'), fields.get('details')
+    error = note_text_error(title, details)
+    archived, archived_error = _archived(fields.get('archived'))
+    if error or archived_error:
+        return None, error or archived_error
+    return (title, details, archived), None
+
+
+def ndjson_rows(lines, skip=0):
+    """ (row number, fields or None, error) per line after <skip>, blank lines are numbered but skipped """
+    for number, line in enumerate(lines, 1):
+        if number <= skip or not line.strip():
+            continue
+        try:
+            yield number, loads(line), None
+        except ValueError:
+            yield number, None, 'Invalid JSON.'
+
+
+def csv_rows(lines, skip=0):
+    """ Same for CSV with a header row naming title and optionally details and archived, rows numbered after it """
+    reader = csv.DictReader(line.decode('utf-8-sig' if number == 0 else 'utf-8', errors='replace')
+                            for number, line in enumerate(lines))
+    if not reader.fieldnames or 'title' not in reader.fieldnames:
+        raise ImportFailed('The CSV header must name a title column.')
+    for number, fields in enumerate(reader, 1):
+        if number <= skip:
+            continue
+        if None in fields:
+            yield number, None, 'Too many columns.'
+        else:
+            yield number, fields, None
+
+
+def _copy(notes):
+    """ One COPY for the batch, the search_vector trigger still fills in every row """
+    def text(value):
+        if value is None:
+            return '\\N'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    columns = ('user_id', 'title', 'details', 'archived', 'created_at', 'updated_at', 'flag')
+    data = io.StringIO()
+    for note in notes:
+        data.write('\t'.join(text(getattr(note, column)) for column in columns) + '\n')
+    data.seek(0)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(
+            connection.ops.quote_name(Note._meta.db_table),
+            ', '.join(connection.ops.quote_name(column) for column in columns)), data)
+
+
+def insert_notes(notes):
+    if connection.vendor == 'postgresql':
+        _copy(notes)
+    else:
+        Note.objects.bulk_create(notes)
+
+
+def import_progress(job):
+    return {'import_id': job.import_id, 'rows_done': job.rows_done, 'imported': job.imported, 'failed': job.failed}
+
+
+def _import_job(user_id, import_id, import_type):
+    if import_type not in FORMATS:
+        raise ImportFailed('type must be one of {}.'.format(', '.join(FORMATS)))
+    if not IMPORT_ID_PATTERN.match(import_id or ''):
+        raise ImportFailed('import_id must be 1 to 64 letters, digits or ._:- characters.')
+    now = datetime.datetime.now()
+    job, _ = NoteImport.objects.get_or_create(user_id=user_id, import_id=import_id,
+                                              defaults={'created_at': now, 'updated_at': now})
+    return job
+
+
+def import_notes(user_id, import_id, lines, import_type='ndjson', batch_size=BATCH_SIZE, progress=None):
+    """
+    Imports the rows of <lines> (an iterable of bytes lines: a request, an uploaded or an open binary file)
+    for the user. Rows up to the checkpoint of <import_id> are skipped. Returns (NoteImport, errors),
+    errors being the first MAX_REPORTED_ERRORS {'row', 'error'} of this run. progress(job) is called
+    after each committed batch, which also sends the user's notes/events streams a resync.
+    """
+    job = _import_job(user_id, import_id, import_type)
+    rows = (ndjson_rows if import_type == 'ndjson' else csv_rows)(lines, skip=job.rows_done)
+    errors, notes, failed, last_row = [], [], 0, job.rows_done
+
+    def commit():
+        now = datetime.datetime.now()
+        for note in notes:
+            note.created_at = note.updated_at = now
+        with transaction.atomic():
+            # the checkpoint only moves from where this run read it, a second run of the same
+            # import_id fails here instead of inserting the same rows twice
+            if not NoteImport.objects.filter(id=job.id, rows_done=job.rows_done).update(
+                    rows_done=last_row, imported=F('imported') + len(notes), failed=F('failed') + failed,
+                    updated_at=now):
+                raise ImportFailed('import_id {} is being imported by another request.'.format(import_id))
+            if notes:
+                insert_notes(notes)
+                # COPY returns no ids, open streams are told to catch up once the batch commits
+                events.publish_resync(user_id)
+        if notes:
+            notes_cache.invalidate(user_id)
+        job.refresh_from_db()
+        if progress:
+            progress(job)
+
+    for number, fields, error in rows:
+        if error is None:
+            values, error = _note_fields(fields)
+        if error is None:
+            title, details, archived = values
+            notes.append(Note(user_id=user_id, title=title, details=details, archived=archived, flag=True))
+        else:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': number, 'error': error})
+        last_row = number
+        if len(notes) + failed >= batch_size:
+            commit()
+            notes, failed = [], 0
+    if notes or failed or last_row != job.rows_done:
+        commit()
+    return job, errors
+
+
+def import_in_background(user_id, import_id, upload, import_type='ndjson'):
+    """
+    Stores the upload in NoteImportChunk rows and queues its import, returns the NoteImport the
+    notes/import/ GET reports on. A retried job carries on from the checkpoint as a resent upload would.
+    """
+    job = _import_job(user_id, import_id, import_type)
+    with transaction.atomic():
+        # a resent upload replaces the stored one, the job only shows up together with it
+        NoteImport.objects.filter(id=job.id).update(finished_at=None)
+        NoteImportChunk.objects.filter(note_import=job).delete()
+        number = 0
+        data = upload.read(UPLOAD_CHUNK_SIZE)
+        while data:
+            NoteImportChunk.objects.create(note_import=job, number=number, data=data)
+            number += 1
+            data = upload.read(UPLOAD_CHUNK_SIZE)
+        jobs.enqueue('notes.import', {'user_id': user_id, 'import_id': import_id, 'type': import_type})
+    return job
+
+
+def stored_lines(job):
+    """ The lines of the upload stored for <job>, read back one chunk at a time """
+    rest = b''
+    chunks = NoteImportChunk.objects.filter(note_import=job)
+    for chunk_id in list(chunks.order_by('number').values_list('id', flat=True)):
+        lines = (rest + bytes(chunks.values_list('data', flat=True).get(id=chunk_id))).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if rest:
+        yield rest
+
+
+@jobs.task('notes.import')
+def run_spooled_import(background_job, data):
+    job = NoteImport.objects.get(user_id=data['user_id'], import_id=data['import_id'])
+    if job.finished_at is not None:
+        # already imported by an earlier job for the same upload
+        return
+    if not NoteImportChunk.objects.filter(note_import=job).exists():
+        # retried, then left as failed where it shows, rather than reported as done
+        raise ImportFailed('The upload of import_id {} is missing.'.format(data['import_id']))
+    import_notes(data['user_id'], data['import_id'], stored_lines(job), data['type'],
+                 progress=lambda _: jobs.extend(background_job))
+    with transaction.atomic():
+        NoteImport.objects.filter(id=job.id).update(finished_at=datetime.datetime.now())
+        NoteImportChunk.objects.filter(note_import=job).delete()
@@ -0,0 +1,139 @@
+"""
+Background jobs in the database, for work a view can hand off and answer before it is done.
+
+enqueue() inserts a BackgroundJob row (in the view's transaction when there is one), manage.py run_jobs
+workers claim due rows with a conditional UPDATE, which works the same on postgres and SQLite and
+needs no broker. A claim holds the job for its task's timeout (the visibility timeout): a worker that
+dies leaves the job to be claimed again once it passes, long tasks call extend(job) to keep it.
+Failed attempts are retried with exponential backoff, after max_attempts the row stays as 'failed'.
+"""
+
+# Django imports
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+# Models import
+from bucketDRF.models import BackgroundJob
+
+# Renderers imports
+from bucketDRF.renderers import dumps, loads
+
+# Misc. imports
+from collections import namedtuple
+import datetime
+import logging
+import os
+import socket
+import time
+import traceback
+
+MAX_ATTEMPTS = getattr(settings, 'JOBS_MAX_ATTEMPTS', 5)
+TIMEOUT = getattr(settings, 'JOBS_TIMEOUT', 300)
+RETRY_DELAY = getattr(settings, 'JOBS_RETRY_DELAY', 10)
+POLL_INTERVAL = getattr(settings, 'JOBS_POLL_INTERVAL', 1.0)
+# due jobs looked at per claim, a worker losing the race for one tries the next
+CLAIM_CANDIDATES = 10
+logger = logging.getLogger(__name__)
+
+Task = namedtuple('Task', 'name function max_attempts timeout')
+TASKS = {}
+
+
+class UnknownTask(KeyError):
+    pass
+
+
+def task(name, max_attempts=MAX_ATTEMPTS, timeout=TIMEOUT):
+    """ Registers function(job, data) as <name>, data being the payload given to enqueue() """
+    def decorator(function):
+        TASKS[name] = Task(name, function, max_attempts, timeout)
+        return function
+    return decorator
+
+
+def enqueue(name, data=None, delay=0):
+    """ Queues task <name> with a JSON serializable payload, to run after <delay> seconds """
+    if name not in TASKS:
+        raise UnknownTask(name)
+    now = datetime.datetime.now()
+    return BackgroundJob.objects.create(name=name, payload=dumps(data).decode(), max_attempts=TASKS[name].max_attempts,
+                                        run_at=now + datetime.timedelta(seconds=delay), created_at=now, updated_at=now)
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())[:100]
+
+
+def extend(job, seconds=None):
+    """ Pushes the visibility timeout of a job this worker holds, False when it lost it """
+    now = datetime.datetime.now()
+    job.locked_until = now + datetime.timedelta(seconds=seconds or TASKS[job.name].timeout)
+    return bool(BackgroundJob.objects.filter(id=job.id, locked_by=job.locked_by, attempts=job.attempts).update(
+        locked_until=job.locked_until, updated_at=now))
+
+
+def claim(worker):
+    """ The next due job, now running for <worker>, or None """
+    now = datetime.datetime.now()
+    candidates = (BackgroundJob.objects
+                  .filter(Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now))
+                  .order_by('run_at', 'id').values_list('id', 'name', 'status', 'attempts', 'max_attempts')
+                  [:CLAIM_CANDIDATES])
+    for job_id, name, status, attempts, max_attempts in candidates:
+        # the attempts counter moves with every claim, only one worker wins this UPDATE
+        current = BackgroundJob.objects.filter(id=job_id, status=status, attempts=attempts)
+        if attempts >= max_attempts:
+            # its worker died (or hung) on the last attempt
+            current.update(status='failed', last_error='Visibility timeout expired.', locked_until=None,
+                           updated_at=now)
+            continue
+        timeout = TASKS[name].timeout if name in TASKS else TIMEOUT
+        if current.update(status='running', attempts=attempts + 1, locked_by=worker, updated_at=now,
+                          locked_until=now + datetime.timedelta(seconds=timeout)):
+            return BackgroundJob.objects.get(id=job_id)
+    return None
+
+
+def run(job):
+    """ Runs a claimed job, deletes it when done, schedules its retry or fails it otherwise. True on success """
+    held = BackgroundJob.objects.filter(id=job.id, locked_by=job.locked_by, attempts=job.attempts)
+    try:
+        if job.name not in TASKS:
+            raise UnknownTask(job.name)
+        TASKS[job.name].function(job, loads(job.payload))
+    except Exception as e:
+        now = datetime.datetime.now()
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        logger.warning('Job %s (%s) attempt %s failed: %s', job.id, job.name, job.attempts, error)
+        if job.attempts >= job.max_attempts:
+            held.update(status='failed', last_error=error, locked_until=None, updated_at=now)
+        else:
+            backoff = RETRY_DELAY * 2 ** (job.attempts - 1)
+            held.update(status='queued', last_error=error, locked_until=None, updated_at=now,
+                        run_at=now + datetime.timedelta(seconds=backoff))
+        return False
+    held.delete()
+    return True
+
+
+def work(worker=None, once=False, max_jobs=None, stopping=lambda: False, poll_interval=POLL_INTERVAL):
+    """
+    Claims and runs jobs until stopping() or, with <once>, until none is due. Returns the number run.
+    The database connection is closed between polls when idle, as a request would.
+    """
+    worker = worker or worker_name()
+    done = 0
+    while not stopping() and (max_jobs is None or done < max_jobs):
+        job = claim(worker)
+        if job is None:
+            if once:
+                break
+            for connection in connections.all():
+                connection.close_if_unusable_or_obsolete()
+            time.sleep(poll_interval)
+            continue
+        run(job)
+        done += 1
+    return done
+
@@ -0,0 +1,337 @@
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection
+from django.test import Client
+from rest_framework_jwt.utils import jwt_encode_handler
+
+# Hashers import
+from bucketDRF.hashers import hash_password
+
+# Middleware imports
+from bucketDRF.middleware import TokenHandler
+
+# Models import
+from bucketDRF.models import User, Note
+
+# Rate limit imports
+from bucketDRF import ratelimit
+
+# Misc. imports
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlencode, urlsplit
+import datetime
+import http.client
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+
+# seeded and signed up users are recognised by name, usernames only have 10 characters
+BENCH_NAME = 'Benchmark'
+PASSWORD = 'benchmark-password'
+WORDS = ('groceries', 'travel', 'books', 'gym', 'family', 'work', 'ideas', 'movies', 'garden', 'music')
+
+
+def _note_id(ctx, rng, user):
+    note_ids = ctx['notes'].get(user.id)
+    return rng.choice(note_ids) if note_ids else 0
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+# route -> (rng, ctx, user) -> (method, path, params, authenticated)
+ROUTES = OrderedDict([
+    ('signup', lambda rng, ctx, user: ('POST', '/auth/signup/', {
+        'username': '~bs' + uuid.uuid4().hex[:7], 'name': BENCH_NAME, 'password': PASSWORD,
+        'confirm_password': PASSWORD}, False)),
+    ('signin', lambda rng, ctx, user: ('POST', '/auth/signin/', {
+        'username': user.username, 'password': PASSWORD}, False)),
+    ('view', lambda rng, ctx, user: ('GET', '/notes/view', {}, True)),
+    ('getarchived', lambda rng, ctx, user: ('GET', '/notes/getarchived', {}, True)),
+    ('create', lambda rng, ctx, user: ('POST', '/notes/create/', {
+        'title': _text(rng, 3), 'details': _text(rng, 20)}, True)),
+    ('edit', lambda rng, ctx, user: ('POST', '/notes/edit/', {
+        'note_id': _note_id(ctx, rng, user), 'mode': 'edit', 'title': _text(rng, 3), 'details': _text(rng, 20)},
+        True)),
+    ('archive', lambda rng, ctx, user: ('GET', '/notes/archive', {'note_id': _note_id(ctx, rng, user)}, True)),
+    ('sync', lambda rng, ctx, user: ('GET', '/notes/sync', {'limit': 100}, True)),
+    ('search', lambda rng, ctx, user: ('GET', '/notes/search', {'q': rng.choice(WORDS)}, True)),
+])
+
+
+def percentile(ordered, p):
+    """ Nearest rank percentile of an ascending list """
+    return ordered[max(0, min(len(ordered) - 1, int(math.ceil(p / 100.0 * len(ordered))) - 1))]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return OrderedDict([
+        ('requests', len(ordered)),
+        ('errors', errors),
+        ('p50_ms', round(percentile(ordered, 50) * 1000, 3)),
+        ('p95_ms', round(percentile(ordered, 95) * 1000, 3)),
+        ('p99_ms', round(percentile(ordered, 99) * 1000, 3)),
+        ('rps', round(len(ordered) / elapsed, 2) if elapsed else 0.0),
+    ])
+
+
+class TestClientTransport(object):
+    """ Requests thru the WSGI handler in process, what the views and middleware cost without HTTP """
+
+    def __init__(self, api_key):
+        self.client = Client()
+        self.api_key = api_key
+
+    def request(self, method, path, params, token):
+        headers = {'HTTP_KEY': self.api_key}
+        if token:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer ' + token
+        send = self.client.post if method == 'POST' else self.client.get
+        return send(path, params, **headers).status_code
+
+
+class HttpTransport(object):
+    """ One keep-alive connection per worker, reopened whenever the server closes it """
+
+    def __init__(self, url, api_key):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.api_key = api_key
+        self.connection = None
+
+    def request(self, method, path, params, token):
+        headers = {'Key': self.api_key}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        body = None
+        if method == 'POST':
+            body = urlencode(params)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif params:
+            path = '{}?{}'.format(path, urlencode(params))
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc, timeout=60)
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return response.status
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # headers and body leave in separate writes, without TCP_NODELAY every keep-alive
+    # response waits out the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Seeds users x notes, drives every API route thru the Django test client and a real HTTP server '
+            'with concurrent workers, reports p50/p95/p99 latency and req/s as JSON and compares against a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--notes', type=int, default=100, help='notes per seeded user')
+        parser.add_argument('--requests', type=int, default=200, help='requests per route')
+        parser.add_argument('--routes', default=','.join(ROUTES), help='comma separated, from ' + ', '.join(ROUTES))
+        parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+        parser.add_argument('--concurrency', type=int, default=8, help='workers driving the server')
+        parser.add_argument('--url', help='benchmark a running server (gunicorn) instead of starting one in process')
+        parser.add_argument('--api-key', default=os.environ.get('API_KEY') or 'benchmark')
+        parser.add_argument('--sample-users', type=int, default=100, help='seeded users the requests are spread over')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='write the JSON report here instead of stdout')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed p95 increase / req/s drop against the baseline, as a fraction')
+        parser.add_argument('--keep', action='store_true', help='keep the seeded rows, the next run reuses them')
+
+    def handle(self, *args, **options):
+        routes = [route.strip() for route in options['routes'].split(',') if route.strip()]
+        unknown = [route for route in routes if route not in ROUTES]
+        if unknown:
+            raise CommandError('Unknown routes: {}'.format(', '.join(unknown)))
+        rng = random.Random(options['seed'])
+
+        # the in process runs check against the key this command sends
+        saved_api_key, TokenHandler.API_KEY = TokenHandler.API_KEY, options['api_key']
+        # budgets the runs never run out of, on a backend of their own, or signup / signin would time 429s
+        # (a server given with --url keeps its own limits)
+        saved_limits = ratelimit.LIMITS, ratelimit.backend
+        ratelimit.LIMITS = ratelimit.parse_limits({'default': {scope: '1000000000/s' for scope in ratelimit.SCOPES}})
+        ratelimit.backend = ratelimit.MemoryBackend(100000)
+        try:
+            seeded = self.seed(options['users'], options['notes'])
+            ctx = self.context(rng, options['sample_users'])
+            report = OrderedDict([('meta', OrderedDict([
+                ('database', connection.vendor),
+                ('users', options['users']),
+                ('sampled_users', len(ctx['users'])),
+                ('notes_per_user', options['notes']),
+                ('requests_per_route', options['requests']),
+                ('concurrency', options['concurrency']),
+                ('started_at', datetime.datetime.now().isoformat()),
+            ]))])
+            if options['mode'] in ('client', 'both'):
+                report['client'] = self.run(routes, ctx, options['requests'], 1, options['seed'],
+                                            lambda: TestClientTransport(options['api_key']))
+            if options['mode'] in ('server', 'both'):
+                report['server'] = self.run_server(routes, ctx, options)
+        finally:
+            TokenHandler.API_KEY = saved_api_key
+            ratelimit.LIMITS, ratelimit.backend = saved_limits
+            if not options['keep']:
+                self.cleanup()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if seeded:
+            self.stderr.write('seeded {} users x {} notes'.format(options['users'], options['notes']))
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def seed(self, users, notes):
+        """ Reuses the users a --keep run left behind, seeds them otherwise """
+        if User.objects.filter(name=BENCH_NAME, username__startswith='~bn').exists():
+            return False
+        now = datetime.datetime.now()
+        # one hash for everybody, hashing 10k passwords would take minutes
+        password = hash_password(PASSWORD)
+        for start in range(0, users, 1000):
+            User.objects.bulk_create([
+                User(username='~bn{}'.format(i), name=BENCH_NAME, password=password, created_at=now, updated_at=now)
+                for i in range(start, min(start + 1000, users))
+            ])
+        rng = random.Random(users)
+        batch = []
+        user_ids = User.objects.filter(name=BENCH_NAME, username__startswith='~bn').values_list('id', flat=True).iterator()
+        for done, user_id in enumerate(user_ids, 1):
+            batch.extend(Note(user_id=user_id, title=_text(rng, 3), details=_text(rng, 20), archived=i % 10 == 0,
+                              created_at=now, updated_at=now - datetime.timedelta(seconds=i), flag=True)
+                         for i in range(notes))
+            if len(batch) >= 5000:
+                Note.objects.bulk_create(batch)
+                batch = []
+            if done % 1000 == 0:
+                self.stderr.write('seeded {} users'.format(done))
+        Note.objects.bulk_create(batch)
+        return True
+
+    @staticmethod
+    def context(rng, sample_size):
+        """ Users the requests are spread over, with a token and their note ids """
+        seeded = list(User.objects.filter(name=BENCH_NAME, username__startswith='~bn').only('id', 'username'))
+        sample = rng.sample(seeded, min(sample_size, len(seeded)))
+        notes = defaultdict(list)
+        for user_id, note_id in Note.objects.filter(user__in=sample, flag=True).values_list('user_id', 'id'):
+            notes[user_id].append(note_id)
+        return {
+            'users': sample,
+            'tokens': {user.id: jwt_encode_handler(TokenHandler.jwt_payload_handler(user)) for user in sample},
+            'notes': notes,
+        }
+
+    def run_server(self, routes, ctx, options):
+        url, server = options['url'], None
+        if not url:
+            # sharing the GIL with the load generator, point --url at gunicorn for absolute numbers
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+            server.set_app(get_internal_wsgi_application())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            return self.run(routes, ctx, options['requests'], options['concurrency'], options['seed'],
+                            lambda: HttpTransport(url, options['api_key']))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def run(self, routes, ctx, requests, concurrency, seed, transport_factory):
+        results = OrderedDict()
+        for route in routes:
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+            shares = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+            def worker(index, count):
+                rng = random.Random('{}-{}-{}'.format(seed, route, index))
+                transport = transport_factory()
+                measured, failed = [], 0
+                for _ in range(count):
+                    user = rng.choice(ctx['users'])
+                    method, path, params, authenticated = ROUTES[route](rng, ctx, user)
+                    start = time.perf_counter()
+                    try:
+                        status = transport.request(method, path, params, ctx['tokens'][user.id] if authenticated
+                                                   else None)
+                    except (http.client.HTTPException, OSError):
+                        status = None
+                    measured.append(time.perf_counter() - start)
+                    failed += status is None or status >= 400
+                if hasattr(transport, 'close'):
+                    transport.close()
+                with lock:
+                    latencies.extend(measured)
+                    errors[0] += failed
+
+            start = time.perf_counter()
+            if concurrency == 1:
+                worker(0, requests)
+            else:
+                threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(shares) if count]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            results[route] = summarize(latencies, errors[0], time.perf_counter() - start)
+            self.stderr.write('{:12} {}'.format(route, json.dumps(results[route])))
+        return results
+
+    @staticmethod
+    def cleanup():
+        Note.objects.filter(user__name=BENCH_NAME, user__username__startswith='~b').delete()
+        User.objects.filter(name=BENCH_NAME, username__startswith='~b').delete()
+
+    def compare(self, report, baseline_path, tolerance):
+        """ Fails the command when a route's p95 grew or its req/s dropped by more than the tolerance """
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for mode in ('client', 'server'):
+            for route, current in report.get(mode, {}).items():
+                before = baseline.get(mode, {}).get(route)
+                if not before:
+                    continue
+                p95_change = current['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+                rps_change = current['rps'] / before['rps'] - 1 if before['rps'] else 0.0
+                self.stderr.write('{:6} {:12} p95 {:+7.1%}  req/s {:+7.1%}'.format(mode, route, p95_change,
+                                                                                   rps_change))
+                if p95_change > tolerance or rps_change < -tolerance:
+                    regressions.append('{} {}'.format(mode, route))
+        if regressions:
+            raise CommandError('Slower than {}: {}'.format(baseline_path, ', '.join(regressions)))
@@ -0,0 +1,63 @@
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Hashers import
+from bucketDRF.hashers import Argon2PasswordHasher, BCryptSHA256PasswordHasher
+
+# Misc. imports
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+
+def configurations(bcrypt_rounds):
+    """ (label, hasher) for each bcrypt work factor asked for, plus argon2 from settings when installed """
+    result = []
+    for rounds in bcrypt_rounds:
+        hasher = type('BCryptSHA256PasswordHasher', (BCryptSHA256PasswordHasher,), {'rounds': rounds})()
+        result.append(('bcrypt_sha256 rounds={}'.format(rounds), hasher))
+    hasher = Argon2PasswordHasher()
+    try:
+        hasher._load_library()
+        result.append(('argon2 t={} m={} p={}'.format(hasher.time_cost, hasher.memory_cost, hasher.parallelism),
+                       hasher))
+    except ValueError:
+        result.append(('argon2 (argon2-cffi not installed)', None))
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Reports password hashes per second per core for each hasher configuration.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bcrypt-rounds', default='10,12,14',
+                            help='Comma separated bcrypt work factors to measure.')
+        parser.add_argument('--seconds', type=float, default=2.0, help='Time spent on each configuration.')
+        parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        rounds = [int(r) for r in options['bcrypt_rounds'].split(',') if r.strip()]
+        for label, hasher in configurations(rounds):
+            if hasher is None:
+                self.stdout.write(label)
+                continue
+            single = self.hashes_per_second(hasher, options['seconds'], 1)
+            parallel = self.hashes_per_second(hasher, options['seconds'], options['threads'])
+            self.stdout.write('{:32} {:9.2f} hashes/s on 1 core, {:9.2f} hashes/s per core on {} threads, '
+                              '{:8.2f} ms/hash'.format(label, single, parallel / options['threads'],
+                                                       options['threads'], 1000 / single))
+
+    @staticmethod
+    def hashes_per_second(hasher, seconds, threads):
+        def work():
+            count = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                hasher.encode('benchmark-password', hasher.salt())
+                count += 1
+            return count
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            total = sum(pool.map(lambda _: work(), range(threads)))
+        return total / (time.perf_counter() - start)
@@ -0,0 +1,69 @@
+# Django imports
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework_jwt.utils import jwt_encode_handler
+
+# Middleware imports
+from bucketDRF.middleware import TokenHandler
+
+# Rate limit imports
+from bucketDRF import ratelimit
+
+# Models import
+from bucketDRF.models import User
+
+# Misc. imports
+import time
+
+
+class Command(BaseCommand):
+    help = ('Times ApiTokenCheckMiddleware.process_request per request, with a full JWT decode and from the token cache, '
+            'and the rate limit check it makes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        api_key = TokenHandler.API_KEY or 'benchmark'
+        token = jwt_encode_handler(TokenHandler.jwt_payload_handler(User(id=1)))
+        request = RequestFactory().get('/notes/view', HTTP_KEY=api_key, HTTP_AUTHORIZATION='Bearer ' + token)
+        middleware = TokenHandler.ApiTokenCheckMiddleware
+
+        saved_api_key, TokenHandler.API_KEY = TokenHandler.API_KEY, api_key
+        # budgets the loops never run out of, on a backend of their own
+        saved_limits = ratelimit.LIMITS, ratelimit.backend
+        ratelimit.LIMITS = ratelimit.parse_limits({'default': {'user': '1000000000/s', 'ip': '1000000000/s'}})
+        ratelimit.backend = ratelimit.MemoryBackend(1000)
+        try:
+            cold = self.time_requests(middleware, request, options['requests'], clear_cache=True)
+            warm = self.time_requests(middleware, request, options['requests'], clear_cache=False)
+            limit = self.time_rate_limit(request, api_key, options['requests'])
+        finally:
+            TokenHandler.API_KEY = saved_api_key
+            TokenHandler.token_cache.clear()
+            ratelimit.LIMITS, ratelimit.backend = saved_limits
+
+        self.stdout.write('full decode:  {:8.2f} us/request'.format(cold))
+        self.stdout.write('token cache:  {:8.2f} us/request'.format(warm))
+        self.stdout.write('speedup:      {:8.2f}x'.format(cold / warm))
+        self.stdout.write('rate limit:   {:8.2f} us/request'.format(limit))
+
+    @staticmethod
+    def time_requests(middleware, request, count, clear_cache):
+        TokenHandler.token_cache.clear()
+        elapsed = 0.0
+        for _ in range(count):
+            if clear_cache:
+                TokenHandler.token_cache.clear()
+            start = time.perf_counter()
+            response = middleware.process_request(request)
+            elapsed += time.perf_counter() - start
+            assert response is None, response.content
+        return elapsed / count * 1e6
+
+    @staticmethod
+    def time_rate_limit(request, api_key, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            assert not ratelimit.check(request, api_key, 1)
+        return (time.perf_counter() - start) / count * 1e6
@@ -0,0 +1,46 @@
+# Django imports
+from django.core.management.base import BaseCommand
+from rest_framework import renderers as drf_renderers
+
+# Renderers imports
+from bucketDRF import renderers
+
+# Misc. imports
+import datetime
+import time
+
+
+class Command(BaseCommand):
+    help = 'Renders a note list like GetNotes returns it with DRF\'s JSONRenderer and with each bucketDRF.renderers backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        now = datetime.datetime.now()
+        data = {'result': [
+            {'id': i, 'title': 'note {}'.format(i), 'details': 'details of note {} '.format(i) * 5, 'archived': False,
+             'created_at': now - datetime.timedelta(days=i), 'updated_at': now - datetime.timedelta(minutes=i)}
+            for i in range(options['notes'])
+        ]}
+        drf = drf_renderers.JSONRenderer().render
+        expected = drf(data)
+        baseline = self.time_render(drf, data, options['repeat'])
+        self.stdout.write('{} notes, {} bytes'.format(options['notes'], len(expected)))
+        self.stdout.write('DRF JSONRenderer:  {:8.3f} ms/render'.format(baseline))
+        for name in renderers.BACKENDS:
+            if name == 'orjson' and renderers.orjson is None:
+                self.stdout.write('{:18} not installed'.format(name + ':'))
+                continue
+            dumps, _ = renderers.get_backend(name)
+            assert dumps(data) == expected, name
+            elapsed = self.time_render(dumps, data, options['repeat'])
+            self.stdout.write('{:18} {:8.3f} ms/render ({:.1f}x)'.format(name + ':', elapsed, baseline / elapsed))
+
+    @staticmethod
+    def time_render(render, data, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            render(data)
+        return (time.perf_counter() - start) / repeat * 1000
@@ -0,0 +1,77 @@
+# Django imports
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+# Models import
+from bucketDRF.models import User, Note
+
+# Search imports
+from bucketDRF.search import search_notes
+
+# Misc. imports
+import datetime
+import random
+import time
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def vocabulary(rng, size):
+    """ Made up words with zipf weights, a few very common ones and a long tail like real notes """
+    words = sorted({''.join(rng.choices(LETTERS, k=rng.randint(4, 9))) for _ in range(size)})
+    rng.shuffle(words)
+    return words, [1.0 / rank for rank in range(1, len(words) + 1)]
+
+
+class Command(BaseCommand):
+    help = 'Seeds a throwaway user with notes and compares notes/search against an icontains scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=10000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--vocabulary', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words, weights = vocabulary(rng, options['vocabulary'])
+        queries = [' '.join(rng.choices(words, weights, k=rng.choice((1, 2)))) for _ in range(options['queries'])]
+
+        # everything is rolled back, the benchmark leaves no rows behind
+        with transaction.atomic():
+            user_id = self.seed(rng, options['notes'], words, weights)
+            first = self.time_queries(queries[:1], lambda q: search_notes(user_id, q, 50, 0))
+            search = self.time_queries(queries, lambda q: search_notes(user_id, q, 50, 0))
+            # ranking needs every match, so the scan fetches them all too
+            scan = self.time_queries(queries, lambda q: list(
+                Note.objects.filter(user_id=user_id, flag=True)
+                .filter(*[Q(title__icontains=word) | Q(details__icontains=word) for word in q.split()])
+                .values('id', 'title', 'details', 'archived', 'created_at', 'updated_at')))
+            transaction.set_rollback(True)
+
+        backend = 'tsvector + GIN' if connection.vendor == 'postgresql' else 'inverted index'
+        self.stdout.write('{} notes, {} queries on {}'.format(options['notes'], len(queries), connection.vendor))
+        self.stdout.write('first search ({}):  {:8.3f} ms'.format(backend, first))
+        self.stdout.write('search ({}):        {:8.3f} ms/query'.format(backend, search))
+        self.stdout.write('icontains scan:                {:8.3f} ms/query'.format(scan))
+
+    @staticmethod
+    def seed(rng, count, words, weights):
+        now = datetime.datetime.now()
+        user = User.objects.create(username='bench{}'.format(rng.randint(0, 10 ** 5)), name='Benchmark',
+                                   password='!', created_at=now, updated_at=now)
+        Note.objects.bulk_create([
+            Note(user_id=user.id, title=' '.join(rng.choices(words, weights, k=3))[:50],
+                 details=' '.join(rng.choices(words, weights, k=40))[:500], created_at=now, updated_at=now,
+                 flag=True)
+            for _ in range(count)
+        ], batch_size=1000)
+        return user.id
+
+    @staticmethod
+    def time_queries(queries, run):
+        start = time.perf_counter()
+        for q in queries:
+            run(q)
+        return (time.perf_counter() - start) / len(queries) * 1000
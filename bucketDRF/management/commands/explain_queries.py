@@ -0,0 +1,59 @@
+# Django imports
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+# Models import
+from bucketDRF.models import User, Note
+
+# Misc. imports
+import datetime
+
+# Plan fragments meaning the planner picked an index, postgres and sqlite wording
+INDEX_MARKERS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan', 'USING INDEX', 'USING COVERING INDEX',
+                 'USING INTEGER PRIMARY KEY', 'USING PRIMARY KEY')
+
+
+def view_queries(user_id, note_id, username):
+    """ The hot queries of bucketDRF.views, built the same way the views build them """
+    return [
+        ('GetNotes', Note.objects.filter(user_id=user_id, archived=False, flag=True)
+         .order_by('-updated_at', '-id').values('id', 'title', 'details', 'created_at', 'updated_at')),
+        ('GetNotes (note_id)', Note.objects.filter(user_id=user_id, archived=False, flag=True, id=note_id)
+         .values('id', 'title', 'details', 'created_at', 'updated_at')),
+        ('ViewArchivedNotes', Note.objects.filter(user_id=user_id, archived=True, flag=True)
+         .order_by('-updated_at', '-id').values('id', 'title', 'details', 'created_at', 'updated_at')),
+        ('SyncNotes', Note.objects.filter(user_id=user_id, updated_at__gt=datetime.datetime(2019, 1, 1))
+         .order_by('updated_at', 'id')),
+        ('ArchiveNote', Note.objects.filter(id=note_id, user_id=user_id)),
+        ('EditNote', Note.objects.filter(id=note_id, user_id=user_id)),
+        ('SignIn', User.objects.filter(username=username, flag=1)),
+        ('SignUp', User.objects.filter(username=username)),
+    ]
+
+
+def uses_index(plan):
+    return any(marker in plan for marker in INDEX_MARKERS)
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the query of every view and reports whether it is served by an index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--user-id', type=int, default=1)
+        parser.add_argument('--note-id', type=int, default=1)
+        parser.add_argument('--username', default='username')
+
+    def handle(self, *args, **options):
+        queries = view_queries(options['user_id'], options['note_id'], options['username'])
+        missing = 0
+        for label, queryset in queries:
+            plan = queryset.using(options['database']).explain()
+            if uses_index(plan):
+                self.stdout.write('{}: index'.format(label))
+            else:
+                missing += 1
+                self.stdout.write(self.style.WARNING('{}: NO INDEX'.format(label)))
+            if options['verbosity'] > 1:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+        self.stdout.write('{} of {} queries use an index.'.format(len(queries) - missing, len(queries)))
@@ -0,0 +1,51 @@
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+
+# Models import
+from bucketDRF.models import User
+
+# Import imports
+from bucketDRF.importer import ImportFailed, import_notes
+
+# Misc. imports
+import os
+import sys
+
+
+class Command(BaseCommand):
+    help = ('Imports notes for a user from an NDJSON or CSV file in batches. Run it again with the same '
+            '--import-id to resume after the last committed batch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON or CSV file, '-' for stdin")
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--type', choices=('ndjson', 'csv'),
+                            help='defaults to csv for .csv files and ndjson otherwise')
+        parser.add_argument('--import-id', help='checkpoint name, defaults to the file name')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username'], flag=True).first()
+        if user is None:
+            raise CommandError('No user {}.'.format(options['username']))
+        path = options['path']
+        import_type = options['type'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        import_id = options['import_id'] or os.path.basename(path)[:64]
+        kwargs = {'batch_size': options['batch_size']} if options['batch_size'] else {}
+
+        def progress(job):
+            self.stderr.write('{}: {} rows, {} imported, {} failed'.format(job.import_id, job.rows_done, job.imported,
+                                                                           job.failed))
+
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            job, errors = import_notes(user.id, import_id, stream, import_type, progress=progress, **kwargs)
+        except ImportFailed as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        for error in errors:
+            self.stderr.write('row {}: {}'.format(error['row'], error['error']))
+        self.stdout.write('{}: {} imported, {} failed, checkpoint at row {}'.format(job.import_id, job.imported,
+                                                                                   job.failed, job.rows_done))
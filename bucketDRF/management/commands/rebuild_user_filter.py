@@ -0,0 +1,17 @@
+# Django imports
+from django.core.management.base import BaseCommand
+
+# User cache imports
+from bucketDRF import user_cache
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the Bloom filter of usernames behind SignIn and SignUp from the user table and stores it in '
+            'the users cache, every process switches to it on its next lookup. Run it after users are deleted or '
+            'renamed outside the API. With a local memory cache each process rebuilds its own filter instead.')
+
+    def handle(self, *args, **options):
+        count = user_cache.user_filter.rebuild()
+        bloom = user_cache.user_filter.bloom
+        self.stdout.write('{} usernames, {} bytes, {} hashes, capacity {}'.format(
+            count, len(bloom.bits), bloom.hashes, bloom.capacity))
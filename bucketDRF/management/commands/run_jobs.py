@@ -0,0 +1,33 @@
+# Django imports
+from django.core.management.base import BaseCommand
+
+# Jobs imports
+from bucketDRF import jobs
+
+# Misc. imports
+import signal
+
+
+class Command(BaseCommand):
+    help = ('Runs queued background jobs (bucketDRF.jobs) until stopped, SIGTERM/SIGINT let the current job finish '
+            'first. Start as many as needed, each claims jobs of its own.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit once no job is due')
+        parser.add_argument('--max-jobs', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=jobs.POLL_INTERVAL,
+                            help='seconds between looks at an empty queue')
+
+    def handle(self, *args, **options):
+        stopped = []
+
+        def stop(signum, frame):
+            stopped.append(signum)
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, stop)
+        worker = jobs.worker_name()
+        self.stderr.write('{} waiting for jobs ({})'.format(worker, ', '.join(sorted(jobs.TASKS))))
+        done = jobs.work(worker, once=options['once'], max_jobs=options['max_jobs'], stopping=lambda: stopped,
+                         poll_interval=options['poll_interval'])
+        self.stderr.write('{} ran {} jobs'.format(worker, done))
@@ -0,0 +1,195 @@
+"""
+In-process request metrics: latency histograms per route, DB queries and DB time per request,
+response sizes and status codes, rendered in the Prometheus text format by the Metrics view.
+
+Every gunicorn worker keeps its own counters, a scrape reads the worker that answers it.
+"""
+
+# Django imports
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+# DB stats imports
+from bucketDRF import db
+
+# Cache imports
+from bucketDRF import notes_cache
+
+# Misc. imports
+from bisect import bisect_left
+import contextvars
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'bucket_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+UNMATCHED = 'unmatched'
+
+
+class Histogram(object):
+    """ Prometheus style histogram, counts per bucket are made cumulative when rendered """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+class RouteMetrics(object):
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.db_queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = Histogram(LATENCY_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.statuses = {}
+
+
+class RequestTimer(object):
+    """ What one request spent in the database, filled in by record_query """
+    __slots__ = ('queries', 'db_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_lock = threading.Lock()
+_routes = {}
+# a context variable follows the request into sync_to_async threads, a thread local would not
+_current_timer = contextvars.ContextVar('bucketDRF_metrics_timer', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """ Execute wrapper installed on every connection, times queries run while a request is measured """
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.queries += 1
+        timer.db_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """ connection_created receiver """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def route_of(request):
+    """ The URL pattern, not the path, so ids in the path do not blow up the label set """
+    match = request.resolver_match
+    if match is None:
+        # answered by a middleware (bad API key, invalid token) before URL resolution
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return UNMATCHED
+    return match.route or UNMATCHED
+
+
+def start_request(request):
+    request.start_time = time.perf_counter()
+    timer = RequestTimer()
+    return timer, _current_timer.set(timer)
+
+
+def finish_request(request, response, timer, token):
+    """ Records the request and adds the Server-Timing header """
+    _current_timer.reset(token)
+    duration = time.perf_counter() - request.start_time
+    size = None if response.streaming else len(response.content)
+    observe(route_of(request), request.method, response.status_code, duration, timer.queries, timer.db_seconds,
+            size)
+    if getattr(settings, 'METRICS_SERVER_TIMING', True):
+        response['Server-Timing'] = 'db;dur={:.3f};desc="{} queries", app;dur={:.3f}'.format(
+            timer.db_seconds * 1000, timer.queries, duration * 1000)
+    return response
+
+
+def observe(route, method, status, duration, queries, db_seconds, size):
+    with _lock:
+        metrics = _routes.get((route, method))
+        if metrics is None:
+            metrics = _routes[(route, method)] = RouteMetrics()
+        metrics.latency.observe(duration)
+        metrics.db_queries.observe(queries)
+        metrics.db_seconds.observe(db_seconds)
+        if size is not None:
+            metrics.response_bytes.observe(size)
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels.items()) + '}'
+
+
+def _render_histograms(lines, name, help_text, attribute, routes):
+    lines.append('# HELP {}{} {}'.format(PREFIX, name, help_text))
+    lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+    for (route, method), metrics in routes:
+        histogram = getattr(metrics, attribute)
+        for bound, count in histogram.samples():
+            lines.append('{}{}_bucket{} {}'.format(PREFIX, name, _labels(route=route, method=method, le=bound), count))
+        labels = _labels(route=route, method=method)
+        lines.append('{}{}_sum{} {}'.format(PREFIX, name, labels, histogram.sum))
+        lines.append('{}{}_count{} {}'.format(PREFIX, name, labels, histogram.count))
+
+
+def render():
+    """ Everything in the Prometheus text exposition format """
+    with _lock:
+        routes = sorted(_routes.items())
+        lines = []
+        _render_histograms(lines, 'request_duration_seconds', 'Request latency by route.', 'latency', routes)
+        _render_histograms(lines, 'request_db_queries', 'Database queries per request.', 'db_queries', routes)
+        _render_histograms(lines, 'request_db_duration_seconds', 'Time spent in the database per request.',
+                           'db_seconds', routes)
+        _render_histograms(lines, 'response_size_bytes', 'Response body size, streamed responses excluded.',
+                           'response_bytes', routes)
+        lines.append('# HELP {}requests_total Responses by route and status code.'.format(PREFIX))
+        lines.append('# TYPE {}requests_total counter'.format(PREFIX))
+        for (route, method), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append('{}requests_total{} {}'.format(
+                    PREFIX, _labels(route=route, method=method, status=status), count))
+
+    db_stats = sorted(db.stats().items())
+    for counter in sorted({counter for _, counters in db_stats for counter in counters}):
+        lines.append('# TYPE {}db_{} {}'.format(PREFIX, counter, 'gauge' if counter.endswith('_max_seconds')
+                                                else 'counter'))
+        for alias, counters in db_stats:
+            lines.append('{}db_{}{} {}'.format(PREFIX, counter, _labels(alias=alias), counters[counter]))
+    for counter, value in sorted(notes_cache.stats().items()):
+        if counter != 'hit_ratio':
+            lines.append('# TYPE {}notes_cache_{}_total counter'.format(PREFIX, counter))
+            lines.append('{}notes_cache_{}_total {}'.format(PREFIX, counter, value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,98 @@
+# Django Imports
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# General Imports
+import asyncio
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = getattr(settings, 'COMPRESS_MIN_SIZE', 1024)
+BROTLI_QUALITY = getattr(settings, 'COMPRESS_BROTLI_QUALITY', 5)
+GZIP_LEVEL = getattr(settings, 'COMPRESS_GZIP_LEVEL', 6)
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+
+def accepted_encodings(header):
+    """ {coding: q} of an Accept-Encoding header, 'gzip;q=0.5, br' -> {'gzip': 0.5, 'br': 1.0} """
+    accepted = {}
+    for item in header.lower().split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """ 'br' (when brotli is installed) or 'gzip', the one with the higher q and br on a tie, or None """
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Right after MetricsMiddleware, compresses response bodies of at least COMPRESS_MIN_SIZE bytes with brotli
+    or gzip as negotiated by Accept-Encoding. Small bodies (tokens, messages) go out as they are, which also keeps
+    them out of reach of compression oracles (BREACH). Streaming responses compress themselves (notes/export).
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        # no thread hop for process_response, it does not touch the database
+        return self.process_response(request, await self.get_response(request))
+
+    @staticmethod
+    def process_response(request, response):
+        if response.streaming or response.has_header('Content-Encoding') or response.status_code != 200:
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        # the body varies with Accept-Encoding from here on, whether or not this one is compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < MIN_SIZE:
+            return response
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        # the compressed bytes are not the ones the ETag was computed on, as in GZipMiddleware
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
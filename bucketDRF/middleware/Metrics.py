@@ -0,0 +1,27 @@
+# Django Imports
+from django.utils.deprecation import MiddlewareMixin
+
+# Metrics imports
+from bucketDRF import metrics
+
+# General Imports
+import asyncio
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    First in MIDDLEWARE so request.start_time covers every other middleware, records each request
+    in bucketDRF.metrics and answers with a Server-Timing header.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timer, token = metrics.start_request(request)
+        response = self.get_response(request)
+        return metrics.finish_request(request, response, timer, token)
+
+    async def __acall__(self, request):
+        timer, token = metrics.start_request(request)
+        response = await self.get_response(request)
+        return metrics.finish_request(request, response, timer, token)
@@ -0,0 +1,50 @@
+# Django Imports
+from django.utils.deprecation import MiddlewareMixin
+
+# Metrics imports
+from bucketDRF import metrics
+
+# Profiling imports
+from bucketDRF import profiling
+
+# General Imports
+import asyncio
+import time
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Right after MetricsMiddleware, profiles the requests bucketDRF.profiling.wants_profile() picks and
+    answers them with the report's file name in X-Profile-Id.
+    """
+
+    @staticmethod
+    def _finish(request, response, profile, started):
+        duration = time.perf_counter() - started
+        response['X-Profile-Id'] = profiling.write(request, response, profile, duration, metrics.route_of(request))
+        return response
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not profiling.wants_profile(request):
+            return self.get_response(request)
+        started = time.perf_counter()
+        profile, token = profiling.start()
+        try:
+            response = profile.call_tree.runcall(self.get_response, request)
+        finally:
+            profiling.stop(token)
+        return self._finish(request, response, profile, started)
+
+    async def __acall__(self, request):
+        if not profiling.wants_profile(request):
+            return await self.get_response(request)
+        started = time.perf_counter()
+        # a trace would mix in every other request running on the event loop, queries only
+        profile, token = profiling.start(with_call_tree=False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.stop(token)
+        return self._finish(request, response, profile, started)
@@ -1,19 +1,37 @@
 # Django Imports
-from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_429_TOO_MANY_REQUESTS
 from rest_framework_jwt.authentication import api_settings
+from django.conf import settings
 from django.http import HttpResponse
 from django.utils.deprecation import MiddlewareMixin
 from django.shortcuts import render
 
+# Renderers imports
+from bucketDRF.renderers import dumps
+
+# Rate limit imports
+from bucketDRF import ratelimit
+
 # General Imports
+from collections import OrderedDict
 import time
 import datetime
-import json
+import hashlib
+import hmac
+import logging
+import math
 import os
+import threading
 import jwt
 
 API_KEY = os.environ.get('API_KEY')
+METRICS_PATH = '/metrics'
 jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
+# the rejections never change, render them once
+API_KEY_INVALID = dumps({'message': 'Api Key Invalid.'})
+TOKEN_INVALID = dumps({'message': 'Token invalid.'})
+TOO_MANY_REQUESTS = dumps({'message': 'Too many requests.'})
+logger = logging.getLogger(__name__)
 
 
 def jwt_payload_handler(user):
@@ -32,31 +50,98 @@ def jwt_payload_handler(user):
     }
 
 
+class TokenCache(object):
+    """ Bounded LRU of verified tokens, token digest -> (sub, expires at), so repeat requests skip the JWT decode """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest, now):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            sub, expires_at = entry
+            if expires_at <= now:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return sub
+
+    def set(self, digest, sub, exp, now):
+        # never outlive the token itself
+        expires_at = min(exp, now + self.ttl) if exp else now + self.ttl
+        with self._lock:
+            self._entries[digest] = (sub, expires_at)
+            self._entries.move_to_end(digest)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(getattr(settings, 'JWT_CACHE_SIZE', 10000), getattr(settings, 'JWT_CACHE_TTL', 300))
+
+
+def verify_token(authorization):
+    """ Returns the user id (sub) of a valid 'Bearer <jwt>' header, None otherwise """
+    parts = authorization.split()
+    if len(parts) != 2:
+        return None
+    token = parts[1]
+    digest = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    sub = token_cache.get(digest, now)
+    if sub is not None:
+        return sub
+    try:
+        payload = jwt_decode_handler(token)
+    except jwt.InvalidTokenError as e:
+        logger.debug('Rejected token: %s', e)
+        return None
+    sub = payload.get('sub', None)
+    if sub is not None:
+        token_cache.set(digest, sub, payload.get('exp', None), now)
+    return sub
+
+
 class ApiTokenCheckMiddleware(MiddlewareMixin):
     @staticmethod
     def process_request(request):
         if request.path == '/':
             return render(request, 'fallback.html', {})
 
-        res = {'message': 'Api Key Invalid.'}
-        request.start_time = time.time()
-        try:
-            if request.META['HTTP_KEY']:
-                api_key = request.META['HTTP_KEY']
-                if not api_key == API_KEY:
-                    return HttpResponse(json.dumps(res), status=HTTP_400_BAD_REQUEST)
-        except:
-            return HttpResponse(json.dumps(res), status=HTTP_400_BAD_REQUEST)
+        metrics_token = getattr(settings, 'METRICS_TOKEN', None)
+        if metrics_token and request.path == METRICS_PATH:
+            # scrapers cannot get a JWT, they send the metrics token instead
+            if hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + metrics_token):
+                return None
+            return HttpResponse(TOKEN_INVALID, status=HTTP_401_UNAUTHORIZED, content_type='application/json')
+
+        api_key = request.META.get('HTTP_KEY', None)
+        if not api_key or api_key != API_KEY:
+            return HttpResponse(API_KEY_INVALID, status=HTTP_400_BAD_REQUEST, content_type='application/json')
 
         if not request.path.startswith('/auth/'):
-            try:
-                auth = request.META['HTTP_AUTHORIZATION'].split()[1]
-                try:
-                    payload = jwt_decode_handler(auth)
-                    request.requested_by = payload.get('sub', None)
-                except (jwt.InvalidTokenError, jwt.DecodeError, jwt.ExpiredSignature):
-                    pass
-            except Exception as e:
-                print(e)
-                pass
+            request.requested_by = verify_token(request.META.get('HTTP_AUTHORIZATION', ''))
+            if request.requested_by is None:
+                return HttpResponse(TOKEN_INVALID, status=HTTP_401_UNAUTHORIZED, content_type='application/json')
+
+        retry_after = ratelimit.check(request, api_key, getattr(request, 'requested_by', None))
+        if retry_after:
+            response = HttpResponse(TOO_MANY_REQUESTS, status=HTTP_429_TOO_MANY_REQUESTS,
+                                    content_type='application/json')
+            response['Retry-After'] = str(math.ceil(retry_after))
+            return response
         return None
+
+    async def __acall__(self, request):
+        # the checks above never block, so under ASGI they run on the event loop
+        # instead of the thread hop MiddlewareMixin makes for process_request
+        response = self.process_request(request)
+        return response or await self.get_response(request)
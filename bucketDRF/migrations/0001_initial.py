@@ -0,0 +1,46 @@
+# Generated by Django 2.1.5 on 2026-10-18 15:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=25)),
+                ('username', models.CharField(max_length=10, unique=True)),
+                ('password', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('flag', models.BooleanField(default=True)),
+            ],
+            options={
+                'db_table': 'user',
+            },
+        ),
+        migrations.CreateModel(
+            name='Note',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=50)),
+                ('details', models.CharField(blank=True, max_length=500, null=True)),
+                ('archived', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('flag', models.BooleanField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='bucketDRF.User')),
+            ],
+            options={
+                'db_table': 'note',
+            },
+        ),
+    ]
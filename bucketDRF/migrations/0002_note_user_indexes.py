@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+from bucketDRF.db.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without blocking writes to the tables, see AddIndexConcurrently
+    atomic = False
+
+    dependencies = [
+        ('bucketDRF', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='note',
+            index=models.Index(fields=['user', 'archived', 'flag', '-updated_at', '-id'], name='note_user_archived_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['username', 'flag'], name='user_username_flag_idx'),
+        ),
+    ]
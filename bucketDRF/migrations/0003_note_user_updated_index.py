@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+from bucketDRF.db.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # the index is built without blocking writes to note, see AddIndexConcurrently
+    atomic = False
+
+    dependencies = [
+        ('bucketDRF', '0002_note_user_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='note',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='note_user_updated_idx'),
+        ),
+    ]
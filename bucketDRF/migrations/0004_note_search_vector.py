@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:05
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# tsvector_update_trigger keeps search_vector in step with title and details on every insert/update,
+# it goes in before the backfill so rows written meanwhile are covered
+POSTGRES_TRIGGER = (
+    "CREATE TRIGGER note_search_vector_update BEFORE INSERT OR UPDATE OF title, details ON note "
+    "FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.english', title, details)"
+)
+# one id range per statement, each commits on its own so no lock is held on the whole table
+BACKFILL_SQL = (
+    "UPDATE note SET search_vector = to_tsvector('pg_catalog.english', coalesce(title, '') || ' ' || "
+    "coalesce(details, '')) WHERE id >= %s AND id < %s AND search_vector IS NULL"
+)
+BACKFILL_BATCH_SIZE = 5000
+# built after the backfill, CONCURRENTLY lets writes thru while it runs
+POSTGRES_INDEX = "CREATE INDEX CONCURRENTLY IF NOT EXISTS note_search_vector_idx ON note USING gin (search_vector)"
+POSTGRES_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS note_search_vector_update ON note",
+    "DROP INDEX CONCURRENTLY IF EXISTS note_search_vector_idx",
+]
+
+
+def forwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # a release interrupted during the backfill runs this again
+    schema_editor.execute(POSTGRES_BACKWARDS[0])
+    schema_editor.execute(POSTGRES_TRIGGER)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(id), max(id) FROM note')
+        low, high = cursor.fetchone()
+        for start in range(low or 0, (high or -1) + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL_SQL, [start, start + BACKFILL_BATCH_SIZE])
+    schema_editor.execute(POSTGRES_INDEX)
+
+
+def backwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in POSTGRES_BACKWARDS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    # outside a transaction: the backfill commits per batch and CREATE INDEX CONCURRENTLY cannot run in one
+    atomic = False
+
+    dependencies = [
+        ('bucketDRF', '0003_note_user_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bucketDRF', '0004_note_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('import_id', models.CharField(max_length=64)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('imported', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='bucketDRF.user')),
+            ],
+            options={
+                'db_table': 'note_import',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='noteimport',
+            constraint=models.UniqueConstraint(fields=('user', 'import_id'), name='note_import_user_import_id_uniq'),
+        ),
+    ]
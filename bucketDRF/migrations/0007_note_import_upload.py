@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bucketDRF', '0006_background_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='noteimport',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='NoteImportChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('note_import', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='bucketDRF.noteimport')),
+            ],
+            options={
+                'db_table': 'note_import_chunk',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='noteimportchunk',
+            constraint=models.UniqueConstraint(fields=('note_import', 'number'), name='note_import_chunk_number_uniq'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+from bucketDRF.db.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # the index is built without blocking writes to note, see AddIndexConcurrently
+    atomic = False
+
+    dependencies = [
+        ('bucketDRF', '0007_note_import_upload'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='note',
+            index=models.Index(condition=models.Q(('archived', False), ('flag', True)),
+                               fields=['user', '-updated_at', '-id'], name='note_user_active_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 # Create your models here.
@@ -12,8 +13,11 @@ class User(models.Model):
     flag = models.BooleanField(default=True)
 
     class Meta:
-        managed = False
         db_table = 'user'
+        indexes = [
+            # SignIn looks up active users by username
+            models.Index(fields=['username', 'flag'], name='user_username_flag_idx'),
+        ]
 
 
 class Note(models.Model):
@@ -24,7 +28,72 @@ class Note(models.Model):
     created_at = models.DateTimeField()
     updated_at = models.DateTimeField()
     flag = models.BooleanField(blank=True, null=True)
+    # title + details, kept up to date by a postgres trigger (migration 0004), unused on other databases
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
 
     class Meta:
-        managed = False
         db_table = 'note'
+        indexes = [
+            # GetNotes / ViewArchivedNotes filter on these and page newest first on (updated_at, id)
+            models.Index(fields=['user', 'archived', 'flag', '-updated_at', '-id'], name='note_user_archived_idx'),
+            # GetNotes only, a partial index of the active notes leaves archived and deleted ones out
+            models.Index(fields=['user', '-updated_at', '-id'], condition=models.Q(archived=False, flag=True),
+                         name='note_user_active_idx'),
+            # notes/sync scans a user's changes after (updated_at, id)
+            models.Index(fields=['user', 'updated_at', 'id'], name='note_user_updated_idx'),
+        ]
+
+
+class NoteImport(models.Model):
+    """ Checkpoint of a bulk import, moved forward in the same transaction as each inserted batch """
+    user = models.ForeignKey(User, models.DO_NOTHING)
+    import_id = models.CharField(max_length=64)
+    rows_done = models.IntegerField(default=0)
+    imported = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    # set once a background import read its whole upload, cleared when the upload is queued again
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'note_import'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'import_id'], name='note_import_user_import_id_uniq'),
+        ]
+
+
+class NoteImportChunk(models.Model):
+    """ A piece of an upload queued for a background import, in the database every dyno can read """
+    note_import = models.ForeignKey(NoteImport, models.DO_NOTHING)
+    number = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        db_table = 'note_import_chunk'
+        constraints = [
+            models.UniqueConstraint(fields=['note_import', 'number'], name='note_import_chunk_number_uniq'),
+        ]
+
+
+class BackgroundJob(models.Model):
+    """ A queued call of a bucketDRF.jobs task, deleted once it ran, kept as failed after its last attempt """
+    name = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(max_length=10, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField()
+    run_at = models.DateTimeField()
+    # a running job whose worker died is claimed again once this passes (visibility timeout)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'background_job'
+        indexes = [
+            # workers look for due queued jobs and expired running ones
+            models.Index(fields=['status', 'run_at'], name='background_job_status_idx'),
+        ]
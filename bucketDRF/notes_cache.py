@@ -0,0 +1,96 @@
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# DB imports
+from bucketDRF.db.replicas import mark_written
+
+# Misc. imports
+import threading
+import time
+
+CACHE_ALIAS = getattr(settings, 'NOTES_CACHE_ALIAS', 'notes')
+CACHE_TIMEOUT = getattr(settings, 'NOTES_CACHE_TIMEOUT', 300)
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+
+def _count(counter, amount=1):
+    with _lock:
+        _stats[counter] += amount
+
+
+def stats():
+    """ Per process counters, evictions are only known for CountingLocMemCache """
+    with _lock:
+        result = dict(_stats)
+    lookups = result['hits'] + result['misses']
+    result['hit_ratio'] = round(result['hits'] / lookups, 4) if lookups else 0.0
+    return result
+
+
+def reset_stats():
+    with _lock:
+        for counter in _stats:
+            _stats[counter] = 0
+
+
+class CountingLocMemCache(LocMemCache):
+    """ LocMemCache (LRU culling at MAX_ENTRIES) which counts the entries it culls """
+
+    def _cull(self):
+        before = len(self._cache)
+        super()._cull()
+        _count('evictions', before - len(self._cache))
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return 'notes:version:{}'.format(user_id)
+
+
+def _user_version(user_id):
+    version = _cache().get(_version_key(user_id))
+    if version is None:
+        # seeded from the clock so an evicted version never falls back onto stale entries
+        version = int(time.time() * 1000000)
+        _cache().add(_version_key(user_id), version, None)
+        version = _cache().get(_version_key(user_id), version)
+    return version
+
+
+def current_version(user_id):
+    """ Changes on every invalidate(), for in-process structures which follow the user's notes """
+    return _user_version(user_id)
+
+
+def get_or_load(user_id, kind, params, loader):
+    """
+    Returns the cached result of loader() for this user, list kind (active/archived) and request params.
+    Entries are keyed by the user's current version, so invalidate() makes all of them unreachable at once.
+    """
+    key = 'notes:{}:{}:{}:{}'.format(user_id, _user_version(user_id), kind, ':'.join(str(p) for p in params))
+    result = _cache().get(key)
+    if result is not None:
+        _count('hits')
+        return result
+    _count('misses')
+    result = loader()
+    _cache().set(key, result, CACHE_TIMEOUT)
+    return result
+
+
+def invalidate(user_id):
+    """ Called by every write to a user's notes """
+    _count('invalidations')
+    # their next reads see the write even when the replicas lag behind
+    mark_written('user', user_id)
+    try:
+        _cache().incr(_version_key(user_id))
+    except ValueError:
+        _user_version(user_id)
@@ -0,0 +1,155 @@
+# Django imports
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+# Misc. imports
+import base64
+import binascii
+import datetime
+
+NOTE_FIELDS = ('id', 'title', 'details', 'created_at', 'updated_at')
+SYNC_FIELDS = ('id', 'title', 'details', 'archived', 'flag', 'created_at', 'updated_at')
+DEFAULT_PAGE_SIZE = getattr(settings, 'NOTES_DEFAULT_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = getattr(settings, 'NOTES_MAX_PAGE_SIZE', 200)
+LAYOUTS = ('rows', 'columns')
+
+
+class PaginationError(ValueError):
+    """ Raised for a malformed cursor, limit, fields or layout parameter, views turn it into a 400 """
+
+
+def encode_cursor(row):
+    """ Opaque cursor for the keyset position (updated_at, id) of the given row """
+    raw = '{}|{}'.format(row['updated_at'].isoformat(), row['id'])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, note_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(updated_at), int(note_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise PaginationError('Invalid cursor.')
+
+
+def decode_since(since):
+    """ notes/sync takes either a plain ISO timestamp or the <next_since> cursor of the previous call """
+    try:
+        since = datetime.datetime.fromisoformat(since)
+    except ValueError:
+        return decode_cursor(since)
+    if timezone.is_aware(since):
+        # updated_at is stored naive in TIME_ZONE (USE_TZ is off)
+        since = timezone.make_naive(since)
+    return since, None
+
+
+def parse_fields(request):
+    """ Columns requested thru ?fields=id,title,... , defaults to every note field """
+    fields = request.GET.get('fields', '')
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    if not fields:
+        return NOTE_FIELDS
+    unknown = [field for field in fields if field not in NOTE_FIELDS]
+    if unknown:
+        raise PaginationError('Unknown fields: {}'.format(', '.join(unknown)))
+    return fields
+
+
+def parse_layout(request):
+    """ ?layout=columns asks for a list as {'keys': [...], 'rows': [[...], ...]}, the keys are not repeated per note """
+    layout = request.GET.get('layout', 'rows')
+    if layout not in LAYOUTS:
+        raise PaginationError('layout must be one of {}.'.format(', '.join(LAYOUTS)))
+    return layout == 'columns'
+
+
+def as_columns(rows, fields):
+    return {'keys': list(fields), 'rows': [[row[field] for field in fields] for row in rows]}
+
+
+def parse_limit(request):
+    limit = request.GET.get('limit', None)
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError('Invalid limit.')
+    if limit < 1:
+        raise PaginationError('Invalid limit.')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_offset(request):
+    try:
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        raise PaginationError('Invalid offset.')
+    if offset < 0:
+        raise PaginationError('Invalid offset.')
+    return offset
+
+
+def is_paginated(request):
+    """ Pagination kicks in only when asked for, so existing clients keep the full list """
+    return 'limit' in request.GET or 'cursor' in request.GET
+
+
+def project(rows, fields):
+    """ Drop the keyset columns which were fetched only to build the cursor """
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def paginate_notes(queryset, request, fields):
+    """
+    Keyset pagination over (updated_at, id), newest first.
+    Returns (rows, next_cursor), next_cursor is None on the last page.
+    """
+    limit = parse_limit(request)
+    cursor = request.GET.get('cursor', None)
+    queryset = queryset.order_by('-updated_at', '-id')
+    if cursor:
+        updated_at, note_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=note_id))
+
+    columns = tuple(fields) + tuple(field for field in ('id', 'updated_at') if field not in fields)
+    rows = list(queryset.values(*columns)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return project(rows, fields), next_cursor
+
+
+def as_change(row):
+    """ Soft deleted notes (flag off) go out as tombstones without their content """
+    if not row['flag']:
+        return {'id': row['id'], 'deleted': True, 'updated_at': row['updated_at']}
+    change = {field: row[field] for field in SYNC_FIELDS if field != 'flag'}
+    change['deleted'] = False
+    return change
+
+
+def paginate_changes(queryset, request):
+    """
+    Keyset pagination over (updated_at, id), oldest first, starting after ?since=.
+    Returns (changes, next_since, has_more).
+    """
+    limit = parse_limit(request)
+    since = request.GET.get('since', None)
+    queryset = queryset.order_by('updated_at', 'id')
+    if since:
+        updated_at, note_id = decode_since(since)
+        if note_id is None:
+            queryset = queryset.filter(updated_at__gt=updated_at)
+        else:
+            queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=note_id))
+
+    rows = list(queryset.values(*SYNC_FIELDS)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_since = encode_cursor(rows[-1]) if rows else since
+    return [as_change(row) for row in rows], next_since, has_more
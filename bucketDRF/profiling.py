@@ -0,0 +1,228 @@
+"""
+Opt-in request profiling and slow query logging.
+
+A request is profiled when it carries 'X-Profile: $PROFILE_TOKEN' or is picked by PROFILE_SAMPLE_RATE.
+ProfilingMiddleware then traces its calls (as cProfile, but keeping every call path apart, as the
+tree of pyinstrument), keeps every query with its duration and writes a plain text report to
+PROFILE_DIR/<release>/: the queries in order, then the call tree, times rounded and paths relative
+to the project or site-packages so reports of two releases diff cleanly. Tracing slows the request
+down a few times, compare reports with each other rather than with production timings. Under ASGI
+the view's ORM work runs on other threads, such reports hold the queries but no call tree.
+
+Independently of profiling, when SLOW_QUERY_MS is set (off by default) every query slower than that is
+logged with its EXPLAIN plan. Failed queries are not explained, that would run the failing SQL again.
+"""
+
+# Django imports
+from django.conf import settings
+
+# Misc. imports
+import contextvars
+import datetime
+import hmac
+import logging
+import os
+import random
+import re
+import site
+import sys
+import time
+
+PROFILE_DIR = getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+PROFILE_TOKEN = getattr(settings, 'PROFILE_TOKEN', None)
+SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+RELEASE = getattr(settings, 'RELEASE', None) or 'unreleased'
+SLOW_QUERY_MS = getattr(settings, 'SLOW_QUERY_MS', 0)
+# branches of the call tree under this share of the request are left out of the report
+TREE_MIN_SHARE = 0.01
+EXPLAINABLE = ('select', 'update', 'delete', 'with')
+logger = logging.getLogger(__name__)
+
+# path prefixes cut from file names, longest first so site-packages wins over the interpreter prefix
+_PATH_PREFIXES = sorted({os.path.join(path, '') for path in site.getsitepackages() + [site.getusersitepackages(),
+                         settings.BASE_DIR, sys.prefix] if path}, key=len, reverse=True)
+
+
+class _Node(object):
+    __slots__ = ('children', 'calls', 'total', 'started')
+
+    def __init__(self):
+        self.children = {}
+        self.calls = 0
+        self.total = 0.0
+        self.started = 0.0
+
+
+class CallTree(object):
+    """ Calls made by runcall(), per call path, with their count and time (sys.setprofile, this thread only) """
+
+    def __init__(self):
+        self.root = _Node()
+        self._stack = [self.root]
+
+    def _trace(self, frame, event, arg):
+        if event == 'call' or event == 'c_call':
+            # functions by code object, builtins by name, bound builtins are new objects on every call
+            key = frame.f_code if event == 'call' else '<{}>'.format(getattr(arg, '__qualname__', arg))
+            node = self._stack[-1].children.get(key)
+            if node is None:
+                node = self._stack[-1].children[key] = _Node()
+            node.calls += 1
+            node.started = time.perf_counter()
+            self._stack.append(node)
+        elif len(self._stack) > 1:
+            # return, c_return, c_exception
+            node = self._stack.pop()
+            node.total += time.perf_counter() - node.started
+
+    def runcall(self, function, *args, **kwargs):
+        previous = sys.getprofile()
+        started = time.perf_counter()
+        sys.setprofile(self._trace)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sys.setprofile(previous)
+            del self._stack[1:]
+            self.root.total += time.perf_counter() - started
+
+
+class Profile(object):
+    """ What a profiled request collects, queries as (alias, sql, milliseconds) """
+    __slots__ = ('queries', 'call_tree')
+
+    def __init__(self):
+        self.queries = []
+        self.call_tree = None
+
+
+_current_profile = contextvars.ContextVar('bucketDRF_profile', default=None)
+_explaining = contextvars.ContextVar('bucketDRF_explaining', default=False)
+
+
+def wants_profile(request):
+    token = request.META.get('HTTP_X_PROFILE')
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return bool(SAMPLE_RATE) and random.random() < SAMPLE_RATE
+
+
+def start(with_call_tree=True):
+    """ Queries are collected from here on, with <with_call_tree> run the request thru profile.call_tree.runcall() """
+    profile = Profile()
+    if with_call_tree:
+        profile.call_tree = CallTree()
+    return profile, _current_profile.set(profile)
+
+
+def stop(token):
+    _current_profile.reset(token)
+
+
+def _explain(connection, sql, params):
+    token = _explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('{} {}'.format(connection.ops.explain_query_prefix(), sql), params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except Exception as e:
+        return 'EXPLAIN failed: {}'.format(e)
+    finally:
+        _explaining.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """ Execute wrapper installed on every connection, next to bucketDRF.metrics.record_query """
+    if _explaining.get():
+        return execute(sql, params, many, context)
+    start_time = time.perf_counter()
+    succeeded = False
+    try:
+        result = execute(sql, params, many, context)
+        succeeded = True
+        return result
+    finally:
+        elapsed = (time.perf_counter() - start_time) * 1000
+        connection = context['connection']
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.queries.append((connection.alias, sql, elapsed))
+        if SLOW_QUERY_MS and succeeded and elapsed >= SLOW_QUERY_MS and not many \
+                and sql.lstrip().lower().startswith(EXPLAINABLE) and not connection.needs_rollback:
+            logger.warning('Slow query (%.1f ms) on %s: %s params=%s\n%s', elapsed, connection.alias,
+                           _normalize_sql(sql), _param_types(params), _explain(connection, sql, params))
+
+
+def _param_types(params):
+    """ Types of the parameters only, their values can be password hashes or note text """
+    if isinstance(params, dict):
+        return '{{{}}}'.format(', '.join('{}: {}'.format(key, type(value).__name__) for key, value in params.items()))
+    return '[{}]'.format(', '.join(type(value).__name__ for value in params or ()))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """ connection_created receiver """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _label(key):
+    if isinstance(key, str):
+        return key
+    filename = key.co_filename
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+            break
+    return '{}:{}({})'.format(filename, key.co_firstlineno, key.co_name)
+
+
+def tree_lines(call_tree):
+    """ Lines of the call tree, milliseconds and calls per call path, slowest first """
+    minimum = call_tree.root.total * TREE_MIN_SHARE
+    lines = []
+    # depth first without recursion, call paths can be deeper than the interpreter's recursion limit
+    pending = [(0, key, node) for key, node in call_tree.root.children.items()]
+    while pending:
+        depth, key, node = pending.pop()
+        if node.total < minimum:
+            continue
+        lines.append('{}{:.2f} ms  {}x  {}'.format('  ' * depth, node.total * 1000, node.calls, _label(key)))
+        children = sorted(node.children.items(), key=lambda child: (child[1].total, _label(child[0])))
+        pending.extend((depth + 1, child_key, child) for child_key, child in children)
+    return lines
+
+
+def _normalize_sql(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def report(request, response, profile, duration):
+    """ The text report of a profiled request """
+    lines = [
+        '{} {} -> {}'.format(request.method, request.get_full_path(), response.status_code),
+        'release: {}'.format(RELEASE),
+        'total: {:.2f} ms'.format(duration * 1000),
+        'queries: {} ({:.2f} ms)'.format(len(profile.queries), sum(elapsed for _, _, elapsed in profile.queries)),
+        '',
+        '== SQL',
+    ]
+    lines += ['{:.2f} ms  {}  {}'.format(elapsed, alias, _normalize_sql(sql)) for alias, sql, elapsed in profile.queries]
+    lines += ['', '== Call tree']
+    if profile.call_tree is None:
+        lines.append('not captured (ASGI)')
+    else:
+        lines += tree_lines(profile.call_tree)
+    return '\n'.join(lines) + '\n'
+
+
+def write(request, response, profile, duration, route):
+    """ Writes the report, returns its file name (also sent back as X-Profile-Id) """
+    directory = os.path.join(PROFILE_DIR, re.sub(r'[^\w.-]', '_', RELEASE))
+    os.makedirs(directory, exist_ok=True)
+    name = '{}.{}.{}.txt'.format(re.sub(r'[^\w.-]', '_', route.strip('/')) or 'root',
+                                 re.sub(r'[^\w.-]', '_', request.method),
+                                 datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f'))
+    with open(os.path.join(directory, name), 'w') as output:
+        output.write(report(request, response, profile, duration))
+    return name
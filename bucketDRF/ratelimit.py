@@ -0,0 +1,157 @@
+"""
+Token bucket rate limits per route, keyed by API key, user (requested_by) and client IP.
+ApiTokenCheckMiddleware calls check() once it knows who is calling and answers 429 with Retry-After.
+
+The memory backend keeps real token buckets in the worker process, so every gunicorn worker grants the
+full budget. The cache backend counts fixed windows in a shared cache (redis) with atomic incr.
+"""
+
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+
+# Misc. imports
+from collections import namedtuple
+import math
+import threading
+import time
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SCOPES = ('key', 'user', 'ip')
+
+
+class Rate(namedtuple('Rate', 'capacity per_second')):
+    """ capacity tokens, refilled at per_second tokens a second """
+
+    @property
+    def period(self):
+        return self.capacity / self.per_second
+
+
+def parse_rate(rate):
+    """ '<count>/<s|m|h|d>' -> Rate """
+    count, _, period = rate.partition('/')
+    if period not in PERIODS or not count.isdigit() or not int(count):
+        raise ValueError('Invalid rate {!r}, expected <count>/<s|m|h|d>'.format(rate))
+    return Rate(int(count), int(count) / PERIODS[period])
+
+
+def parse_limits(limits):
+    """ {route: {scope: rate}} -> {route: (route, ((scope, Rate), ...))} """
+    parsed = {}
+    for route, scopes in limits.items():
+        unknown = set(scopes) - set(SCOPES)
+        if unknown:
+            raise ValueError('Unknown rate limit scopes {} for {}'.format(', '.join(sorted(unknown)), route))
+        parsed[route] = (route, tuple((scope, parse_rate(rate)) for scope, rate in scopes.items()))
+    return parsed
+
+
+class MemoryBackend(object):
+    """ Token buckets of this process, (route, scope, identity) -> (tokens, last refill) """
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, hits):
+        """
+        Takes a token from each (key, rate) bucket when all of them have one,
+        returns 0 or the seconds until they do.
+        """
+        now = time.monotonic()
+        retry_after = 0
+        refilled = []
+        with self._lock:
+            buckets = self._buckets
+            for key, rate in hits:
+                bucket = buckets.get(key)
+                tokens = rate.capacity if bucket is None else min(
+                    rate.capacity, bucket[0] + (now - bucket[1]) * rate.per_second)
+                if tokens < 1.0:
+                    retry_after = max(retry_after, (1.0 - tokens) / rate.per_second)
+                refilled.append((key, tokens - 1.0))
+            if retry_after:
+                return retry_after
+            if len(buckets) + len(refilled) > self.max_buckets:
+                self._prune(now)
+            for key, tokens in refilled:
+                buckets[key] = (tokens, now)
+        return 0
+
+    def _prune(self, now):
+        # a bucket idle for its whole period is full again, dropping it changes nothing
+        longest = max(rate.period for _, limits in LIMITS.values() for _, rate in limits) if LIMITS else 0
+        for key in [key for key, (_, last) in self._buckets.items() if now - last >= longest]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_buckets:
+            # too many active clients (a flood from many addresses), forget the oldest half
+            for key in list(self._buckets)[:len(self._buckets) // 2]:
+                del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBackend(object):
+    """ Fixed window counters in a Django cache shared by all workers, every hit counts """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, hits):
+        cache = caches[self.alias]
+        now = time.time()
+        retry_after = 0
+        for key, rate in hits:
+            window = int(now // rate.period)
+            window_key = 'ratelimit:{}:{}:{}:{}'.format(key[0], key[1], key[2], window)
+            if cache.add(window_key, 1, timeout=math.ceil(rate.period) + 1):
+                continue
+            try:
+                count = cache.incr(window_key)
+            except ValueError:
+                # expired between add and incr
+                cache.set(window_key, 1, timeout=math.ceil(rate.period) + 1)
+                continue
+            if count > rate.capacity:
+                retry_after = max(retry_after, (window + 1) * rate.period - now)
+        return retry_after
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+LIMITS = parse_limits(getattr(settings, 'RATE_LIMITS', {}))
+TRUSTED_PROXIES = getattr(settings, 'RATE_LIMIT_PROXIES', 0)
+if getattr(settings, 'RATE_LIMIT_BACKEND', 'memory') == 'cache':
+    backend = CacheBackend(getattr(settings, 'RATE_LIMIT_CACHE', 'default'))
+else:
+    backend = MemoryBackend(getattr(settings, 'RATE_LIMIT_MAX_BUCKETS', 100000))
+
+
+def client_ip(request):
+    """ REMOTE_ADDR, or the address the last of RATE_LIMIT_PROXIES proxies (Heroku's router: 1) saw """
+    if TRUSTED_PROXIES:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+        if len(forwarded) >= TRUSTED_PROXIES:
+            return forwarded[-TRUSTED_PROXIES].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def check(request, api_key, user_id=None):
+    """ Seconds until the request would be allowed, 0 when it is and a token of each of its buckets is taken """
+    route, limits = LIMITS.get(request.path_info[1:]) or LIMITS.get('default', (None, ()))
+    hits = []
+    for scope, rate in limits:
+        if scope == 'user':
+            if user_id is None:
+                continue
+            hits.append(((route, scope, user_id), rate))
+        elif scope == 'ip':
+            hits.append(((route, scope, client_ip(request)), rate))
+        else:
+            hits.append(((route, scope, api_key), rate))
+    return backend.take(hits) if hits else 0
@@ -0,0 +1,142 @@
+# Django imports
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F
+
+# Models import
+from bucketDRF.models import Note
+
+# Cache imports
+from bucketDRF import notes_cache
+
+# Misc. imports
+from collections import OrderedDict, defaultdict
+import math
+import re
+import threading
+
+MAX_INDEXES = getattr(settings, 'NOTES_SEARCH_MAX_INDEXES', 100)
+SEARCH_FIELDS = ('id', 'title', 'details', 'archived', 'created_at', 'updated_at')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# (-)"a phrase" or (-)word
+QUERY_RE = re.compile(r'(-?)(?:"([^"]*)"?|([^\s"]+))')
+# a short list next to postgres' english config, enough for the fallback to rank the same way
+STOP_WORDS = frozenset('a an and are as at be but by for if in into is it no not of on or such that the their then '
+                       'there these they this to was will with'.split())
+
+
+def positions(text):
+    """ (position, term) of the words of <text>, stop words leave their position empty as in a tsvector """
+    return [(position, token) for position, token in enumerate(TOKEN_RE.findall((text or '').lower()))
+            if token not in STOP_WORDS]
+
+
+def parse_query(q):
+    """
+    websearch_to_tsquery's syntax for the fallback: words are ANDed, "quoted words" are a phrase,
+    a leading - excludes a word or phrase and 'or' separates alternatives. Returns the alternatives,
+    each a list of (excluded, phrase) clauses, a phrase being ((offset, term), ...) from its first term.
+    """
+    alternatives, clauses = [], []
+    for excluded, quoted, word in QUERY_RE.findall(q or ''):
+        if word.lower() == 'or' and not excluded:
+            if clauses:
+                alternatives.append(clauses)
+            clauses = []
+            continue
+        terms = positions(quoted or word)
+        if terms:
+            clauses.append((bool(excluded), tuple((position - terms[0][0], term) for position, term in terms)))
+    if clauses:
+        alternatives.append(clauses)
+    return alternatives
+
+
+def search_notes(user_id, q, limit, offset):
+    """ Ranked search over a user's notes, returns (rows, has_more) """
+    if connection.vendor == 'postgresql':
+        return _search_postgres(user_id, q, limit, offset)
+    return _search_inverted_index(user_id, q, limit, offset)
+
+
+def _search_postgres(user_id, q, limit, offset):
+    query = SearchQuery(q, config='english', search_type='websearch')
+    rows = list(Note.objects.filter(user_id=user_id, flag=True, search_vector=query)
+                .annotate(rank=SearchRank(F('search_vector'), query))
+                .order_by('-rank', '-updated_at', '-id')
+                .values(*SEARCH_FIELDS + ('rank',))[offset:offset + limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+class InvertedIndex(object):
+    """ term -> {note_id: [positions]} over one user's notes, the fallback where there is no tsvector """
+
+    def __init__(self, rows):
+        self.notes = {row['id']: row for row in rows}
+        self.postings = defaultdict(dict)
+        for row in rows:
+            # title and details as one text, as the search_vector trigger concatenates them
+            for position, term in positions('{} {}'.format(row['title'] or '', row['details'] or '')):
+                self.postings[term].setdefault(row['id'], []).append(position)
+
+    def _positions(self, term, note_id):
+        return self.postings.get(term, {}).get(note_id, ())
+
+    def _holds(self, phrase, note_id):
+        (_, first), rest = phrase[0], phrase[1:]
+        return any(all(start + offset in self._positions(term, note_id) for offset, term in rest)
+                   for start in self._positions(first, note_id))
+
+    def _candidates(self, clauses):
+        included = [term for excluded, phrase in clauses if not excluded for _, term in phrase]
+        if not included:
+            return set(self.notes)
+        return set.intersection(*(set(self.postings.get(term, ())) for term in included))
+
+    def _score(self, terms, note_id):
+        total = len(self.notes)
+        return sum((1 + math.log(len(self._positions(term, note_id)))) * math.log(1 + total / len(self.postings[term]))
+                   for term in terms if self._positions(term, note_id))
+
+    def search(self, q):
+        """ Notes matching the query (see parse_query), scored by tf-idf over its terms, best first """
+        alternatives = parse_query(q)
+        matches = set()
+        for clauses in alternatives:
+            matches.update(note_id for note_id in self._candidates(clauses)
+                           if all(self._holds(phrase, note_id) != excluded for excluded, phrase in clauses))
+        terms = {term for clauses in alternatives for excluded, phrase in clauses if not excluded for _, term in phrase}
+        scores = {note_id: self._score(terms, note_id) for note_id in matches}
+        ranked = sorted(matches, key=lambda note_id: (scores[note_id], self.notes[note_id]['updated_at'], note_id),
+                        reverse=True)
+        return [dict(self.notes[note_id], rank=round(scores[note_id], 6)) for note_id in ranked]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _user_index(user_id):
+    """
+    The user's InvertedIndex, kept in process (pickling it thru the cache costs more than the search)
+    and rebuilt only once notes_cache's version for the user moved on.
+    """
+    version = notes_cache.current_version(user_id)
+    with _indexes_lock:
+        cached = _indexes.get(user_id)
+        if cached and cached[0] == version:
+            _indexes.move_to_end(user_id)
+            return cached[1]
+    index = InvertedIndex(list(Note.objects.filter(user_id=user_id, flag=True).values(*SEARCH_FIELDS)))
+    with _indexes_lock:
+        _indexes[user_id] = (version, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _search_inverted_index(user_id, q, limit, offset):
+    rows = _user_index(user_id).search(q)
+    return rows[offset:offset + limit], len(rows) > offset + limit
@@ -1,3 +1,1393 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connections
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from rest_framework_jwt.utils import jwt_encode_handler
 
-# Create your tests here.
+# Middleware imports
+from bucketDRF.middleware import TokenHandler
+from bucketDRF.middleware.TokenHandler import jwt_payload_handler
+
+# Models import
+from bucketDRF.models import User, Note, NoteImport, NoteImportChunk, BackgroundJob
+
+# Cache imports
+from bucketDRF import notes_cache
+
+# DB stats imports
+from bucketDRF import db
+from bucketDRF.db import replicas
+from bucketDRF.db.postgresql.base import ConnectionPool
+
+# Hashers import
+from bucketDRF import hashers
+from bucketDRF.hashers import BCryptSHA256PasswordHasher
+
+# Metrics imports
+from bucketDRF import metrics
+
+# Renderers imports
+from bucketDRF import renderers
+
+# Export imports
+from bucketDRF.export import in_thread, in_thread_async
+
+# Import imports
+from bucketDRF.importer import ImportFailed, import_notes
+
+# Rate limit imports
+from bucketDRF import ratelimit
+
+# Compression imports
+from bucketDRF.middleware import Compression
+
+# Events imports
+from bucketDRF import events
+from bucketDRF.event_stream import EventStreamRouter
+
+# User cache imports
+from bucketDRF import user_cache
+
+# Jobs imports
+from bucketDRF import importer, jobs
+
+# Profiling imports
+from bucketDRF import profiling
+
+# Misc. imports
+from unittest import mock
+import datetime
+import csv
+import decimal
+import asyncio
+import gzip
+import io
+import json
+import os
+import runpy
+import tempfile
+import threading
+import time
+
+API_KEY = 'test-api-key'
+
+
+class ApiTestCase(TestCase):
+    """ Signs requests with the API key and a JWT for self.user """
+
+    def setUp(self):
+        patcher = mock.patch('bucketDRF.middleware.TokenHandler.API_KEY', API_KEY)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches_clear()
+        now = datetime.datetime.now()
+        self.user = User.objects.create(username='user', name='User', password='-', created_at=now, updated_at=now)
+        self.token = jwt_encode_handler(jwt_payload_handler(self.user))
+
+    def headers(self):
+        return {'HTTP_KEY': API_KEY, 'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.token)}
+
+    def api_get(self, path, data=None):
+        return self.client.get(path, data or {}, **self.headers())
+
+    def api_post(self, path, data=None):
+        return self.client.post(path, data or {}, **self.headers())
+
+    def create_notes(self, count, archived=False):
+        start = datetime.datetime(2019, 1, 1)
+        Note.objects.bulk_create([
+            Note(user=self.user, title='note {}'.format(i), details='details {}'.format(i), archived=archived,
+                 created_at=start, updated_at=start + datetime.timedelta(minutes=i // 2), flag=True)
+            for i in range(count)
+        ])
+
+
+def caches_clear():
+    TokenHandler.token_cache.clear()
+    notes_cache._cache().clear()
+    notes_cache.reset_stats()
+    metrics.reset()
+    ratelimit.backend.clear()
+    events.broker.clear()
+    user_cache.reset()
+    replicas.reset()
+
+
+class ExplainQueriesTest(TestCase):
+    def test_every_view_query_uses_an_index(self):
+        out = io.StringIO()
+        call_command('explain_queries', stdout=out)
+        output = out.getvalue()
+        self.assertNotIn('NO INDEX', output)
+        for label in ('GetNotes', 'ViewArchivedNotes', 'SyncNotes', 'ArchiveNote', 'EditNote', 'SignIn', 'SignUp'):
+            self.assertIn('{}: index'.format(label), output)
+
+    def test_active_notes_have_a_partial_index(self):
+        with connections['default'].cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'note_user_active_idx'")
+            definition = cursor.fetchone()[0]
+        self.assertTrue(definition.endswith('("user_id", "updated_at" DESC, "id" DESC) WHERE (NOT "archived" AND "flag")'))
+
+
+class PaginationTest(ApiTestCase):
+    def test_unpaginated_response_is_unchanged(self):
+        self.create_notes(3)
+        response = self.api_get('/notes/view')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['result']), 3)
+        self.assertNotIn('next_cursor', response.data)
+
+    def test_cursor_walks_every_note_once(self):
+        self.create_notes(7)
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3, 'fields': 'title'}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.api_get('/notes/view', params)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['title'] for row in response.data['result']]
+            self.assertTrue(all(list(row) == ['title'] for row in response.data['result']))
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted('note {}'.format(i) for i in range(7)))
+
+    def test_pages_are_newest_first_across_updated_at_ties(self):
+        # create_notes gives every two notes the same updated_at, the id breaks the tie
+        self.create_notes(6)
+        first = self.api_get('/notes/view', {'limit': 3, 'fields': 'id,updated_at'}).data
+        second = self.api_get('/notes/view', {'limit': 3, 'cursor': first['next_cursor'],
+                                              'fields': 'id,updated_at'}).data
+        self.assertIsNone(second['next_cursor'])
+        rows = first['result'] + second['result']
+        keys = [(row['updated_at'], row['id']) for row in rows]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        self.assertEqual(len(set(row['id'] for row in rows)), 6)
+
+    def test_archived_list_and_unpaginated_fields(self):
+        self.create_notes(3, archived=True)
+        response = self.api_get('/notes/getarchived', {'limit': 2, 'fields': 'id'})
+        self.assertEqual(len(response.data['result']), 2)
+        self.assertTrue(response.data['next_cursor'])
+        self.assertEqual(self.api_get('/notes/view', {'fields': 'id,title'}).data, {'message': 'No notes found.'})
+        # bulk_create skips the views' invalidation
+        self.create_notes(1)
+        notes_cache.invalidate(self.user.id)
+        self.assertEqual(list(self.api_get('/notes/view', {'fields': 'id,title'}).data['result'][0]), ['id', 'title'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.api_get('/notes/view', {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.api_get('/notes/view', {'limit': '0'}).status_code, 400)
+        self.assertEqual(self.api_get('/notes/getarchived', {'limit': 'x'}).status_code, 400)
+        self.assertEqual(self.api_get('/notes/view', {'fields': 'password'}).status_code, 400)
+
+
+class NotesCacheTest(ApiTestCase):
+    def test_second_read_is_served_from_cache(self):
+        self.create_notes(2)
+        self.api_get('/notes/view')
+        with self.assertNumQueries(0):
+            response = self.api_get('/notes/view')
+        self.assertEqual(len(response.data['result']), 2)
+        # the conditional GET validator and the list itself
+        self.assertEqual(notes_cache.stats()['hits'], 2)
+
+    def test_writes_invalidate_cached_lists(self):
+        self.api_get('/notes/view')
+        self.api_post('/notes/create/', {'title': 'new', 'details': 'note'})
+        response = self.api_get('/notes/view')
+        self.assertEqual([row['title'] for row in response.data['result']], ['new'])
+
+        note_id = response.data['result'][0]['id']
+        self.api_get('/notes/getarchived')
+        self.api_get('/notes/archive', {'note_id': note_id})
+        self.assertEqual(len(self.api_get('/notes/getarchived').data['result']), 1)
+        self.assertEqual(self.api_get('/notes/view').data, {'message': 'No notes found.'})
+
+
+class ConditionalGetTest(ApiTestCase):
+    def test_unchanged_list_answers_not_modified(self):
+        self.create_notes(2)
+        etag = self.api_get('/notes/view')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/notes/view', HTTP_IF_NONE_MATCH=etag, **self.headers())
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_list_is_sent_again(self):
+        self.create_notes(2)
+        etag = self.api_get('/notes/getarchived')['ETag']
+        self.assertEqual(self.client.get('/notes/view', HTTP_IF_NONE_MATCH=etag, **self.headers()).status_code, 200)
+        note_id = Note.objects.first().id
+        self.api_get('/notes/archive', {'note_id': note_id})
+        response = self.client.get('/notes/getarchived', HTTP_IF_NONE_MATCH=etag, **self.headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['result']), 1)
+
+    def test_note_leaving_the_list_moves_last_modified(self):
+        self.create_notes(3)
+        last_modified = self.api_get('/notes/view')['Last-Modified']
+        # the max(updated_at) of the notes left in the list goes back
+        newest = Note.objects.order_by('-updated_at', '-id').first()
+        self.api_get('/notes/archive', {'note_id': newest.id})
+        response = self.client.get('/notes/view', HTTP_IF_MODIFIED_SINCE=last_modified, **self.headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['result']), 2)
+
+
+class SyncNotesTest(ApiTestCase):
+    def test_sync_returns_changes_and_tombstones(self):
+        self.create_notes(3)
+        response = self.api_get('/notes/sync')
+        self.assertEqual(len(response.data['result']), 3)
+        self.assertFalse(response.data['has_more'])
+        since = response.data['next_since']
+
+        self.assertEqual(self.api_get('/notes/sync', {'since': since}).data['result'], [])
+
+        deleted, archived = Note.objects.order_by('id')[:2]
+        self.api_post('/notes/edit/', {'note_id': deleted.id, 'mode': 'delete'})
+        self.api_get('/notes/archive', {'note_id': archived.id})
+        changes = self.api_get('/notes/sync', {'since': since}).data['result']
+        self.assertEqual(changes[0], {'id': deleted.id, 'deleted': True, 'updated_at': changes[0]['updated_at']})
+        self.assertEqual((changes[1]['id'], changes[1]['archived'], changes[1]['deleted']), (archived.id, True, False))
+        self.assertEqual(self.api_get('/notes/view').data['result'][0]['title'], 'note 2')
+
+    def test_sync_pages_with_limit(self):
+        self.create_notes(5)
+        response = self.api_get('/notes/sync', {'limit': 2})
+        self.assertTrue(response.data['has_more'])
+        rest = self.api_get('/notes/sync', {'since': response.data['next_since']}).data['result']
+        self.assertEqual(len(response.data['result']) + len(rest), 5)
+
+    def test_sync_since_with_a_time_zone(self):
+        now = datetime.datetime(2019, 1, 1, 12)
+        for hour in (11, 13):
+            Note.objects.create(user=self.user, title=str(hour), created_at=now, updated_at=now.replace(hour=hour),
+                                flag=True)
+        for since in ('2019-01-01T12:00:00Z', '2019-01-01T14:00:00+02:00'):
+            response = self.api_get('/notes/sync', {'since': since})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([change['title'] for change in response.data['result']], ['13'])
+        self.assertEqual(self.api_get('/notes/sync', {'since': 'yesterday'}).status_code, 400)
+
+
+class BatchNotesTest(ApiTestCase):
+    def batch(self, operations):
+        return self.client.post('/notes/batch/', json.dumps(operations), content_type='application/json',
+                                **self.headers())
+
+    def test_batch_applies_every_operation(self):
+        self.create_notes(3)
+        first, second, third = Note.objects.order_by('id')
+        response = self.batch([
+            {'op': 'create', 'title': 'new', 'details': 'note'},
+            {'op': 'edit', 'note_id': first.id, 'title': 'edited', 'details': None},
+            {'op': 'archive', 'note_id': second.id},
+            {'op': 'delete', 'note_id': third.id},
+        ])
+        self.assertEqual([result['status'] for result in response.data['result']], [201, 200, 200, 200])
+        self.assertEqual(Note.objects.get(id=response.data['result'][0]['id']).title, 'new')
+        self.assertEqual(Note.objects.get(id=first.id).title, 'edited')
+        self.assertTrue(Note.objects.get(id=second.id).archived)
+        self.assertFalse(Note.objects.get(id=third.id).flag)
+        self.assertEqual(sorted(row['title'] for row in self.api_get('/notes/view').data['result']),
+                         ['edited', 'new'])
+
+    def test_batch_checks_ownership_per_item(self):
+        now = datetime.datetime.now()
+        other = User.objects.create(username='other', name='Other', password='-', created_at=now, updated_at=now)
+        foreign = Note.objects.create(user=other, title='theirs', created_at=now, updated_at=now, flag=True)
+        response = self.batch([
+            {'op': 'delete', 'note_id': foreign.id},
+            {'op': 'create', 'title': 'x' * 51},
+            {'op': 'create', 'title': 'mine'},
+        ])
+        self.assertEqual([result['status'] for result in response.data['result']], [400, 400, 201])
+        self.assertTrue(Note.objects.get(id=foreign.id).flag)
+
+    def test_created_ids_follow_the_operations(self):
+        self.create_notes(1)
+        response = self.batch([{'op': 'create', 'title': 'a'}, {'op': 'delete', 'note_id': 0},
+                               {'op': 'create', 'title': 'b'}, {'op': 'create', 'title': 'c'}])
+        created = [result['id'] for result in response.data['result'] if result['status'] == 201]
+        self.assertEqual([Note.objects.get(id=note_id, user=self.user).title for note_id in created], ['a', 'b', 'c'])
+
+    def test_created_ids_within_one_clock_tick(self):
+        now = datetime.datetime(2019, 1, 1)
+        Note.objects.create(user=self.user, title='older', created_at=now, updated_at=now, flag=True)
+        with mock.patch('bucketDRF.batch.datetime') as clock:
+            clock.datetime.now.return_value = now
+            first = self.batch([{'op': 'create', 'title': 'a'}, {'op': 'create', 'title': 'b'}])
+            second = self.batch([{'op': 'create', 'title': 'c'}])
+        created = [result['id'] for response in (first, second) for result in response.data['result']]
+        self.assertEqual([Note.objects.get(id=note_id).title for note_id in created], ['a', 'b', 'c'])
+
+    def test_edits_keep_the_last_one_per_note(self):
+        self.create_notes(2)
+        first, second = Note.objects.order_by('id').values_list('id', flat=True)
+        self.batch([{'op': 'edit', 'note_id': first, 'title': 'x'}, {'op': 'edit', 'note_id': second, 'title': 'y',
+                                                                     'details': 'd'},
+                    {'op': 'edit', 'note_id': first, 'title': 'z'}])
+        self.assertEqual(list(Note.objects.order_by('id').values_list('title', 'details')), [('z', None), ('y', 'd')])
+
+    def test_batch_rejects_non_array(self):
+        self.assertEqual(self.batch({'op': 'create'}).status_code, 400)
+
+
+class QueryCountTest(ApiTestCase):
+    """ Exact number of queries per endpoint, a failure here is a new round trip """
+
+    def setUp(self):
+        super().setUp()
+        self.create_notes(3)
+        self.note_id = Note.objects.order_by('id').first().id
+        user_cache.user_filter.rebuild()
+
+    @mock.patch.object(user_cache, '_shared', return_value=True)
+    def test_signup(self, shared):
+        # a free username is known to be free without asking the database (shared 'users' cache)
+        with self.assertNumQueries(1):
+            response = self.client.post('/auth/signup/', {'username': 'new', 'name': 'New', 'password': 'secret',
+                                                          'confirm_password': 'secret'}, HTTP_KEY=API_KEY)
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(1):
+            response = self.client.post('/auth/signup/', {'username': 'new', 'password': 'secret',
+                                                          'confirm_password': 'secret'}, HTTP_KEY=API_KEY)
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch.object(user_cache, '_shared', return_value=True)
+    def test_signin(self, shared):
+        with self.assertNumQueries(0):
+            response = self.client.post('/auth/signin/', {'username': 'nobody', 'password': 'secret'},
+                                        HTTP_KEY=API_KEY)
+        self.assertEqual(response.status_code, 400)
+        # a known username is looked up every time, its password hash is never cached
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                response = self.client.post('/auth/signin/', {'username': 'user', 'password': 'wrong'},
+                                            HTTP_KEY=API_KEY)
+            self.assertEqual(response.status_code, 400)
+
+    def test_view_and_getarchived(self):
+        # the conditional GET validator and the list, then both come from the cache
+        for path in ('/notes/view', '/notes/getarchived'):
+            with self.assertNumQueries(2):
+                self.api_get(path)
+            with self.assertNumQueries(0):
+                self.api_get(path)
+
+    def test_create(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api_post('/notes/create/', {'title': 'new'}).status_code, 201)
+
+    def test_edit_and_delete(self):
+        with self.assertNumQueries(1):
+            response = self.api_post('/notes/edit/', {'note_id': self.note_id, 'mode': 'edit', 'title': 'edited'})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.api_post('/notes/edit/', {'note_id': self.note_id, 'mode': 'delete'})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.api_post('/notes/edit/', {'note_id': self.note_id, 'mode': 'delete'})
+        self.assertEqual(response.data, {'message': 'Note not found'})
+
+    def test_archive(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api_get('/notes/archive', {'note_id': self.note_id}).status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.api_get('/notes/archive', {'note_id': self.note_id + 100})
+        self.assertEqual(response.data, {'message': 'Note not found.'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.api_get('/notes/archive', {'note_id': 'x'}).status_code, 400)
+
+    def test_sync(self):
+        with self.assertNumQueries(1):
+            self.api_get('/notes/sync')
+
+
+class TokenMiddlewareTest(ApiTestCase):
+    def test_missing_or_invalid_token_is_rejected(self):
+        self.assertEqual(self.client.get('/notes/view', HTTP_KEY=API_KEY).status_code, 401)
+        response = self.client.get('/notes/view', HTTP_KEY=API_KEY, HTTP_AUTHORIZATION='Bearer ' + self.token + 'x')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get('/notes/view', HTTP_KEY='', **{'HTTP_AUTHORIZATION': ''}).status_code, 400)
+
+    def test_repeated_token_skips_decode(self):
+        with mock.patch.object(TokenHandler, 'jwt_decode_handler', wraps=TokenHandler.jwt_decode_handler) as decode:
+            self.assertEqual(self.api_get('/notes/view').status_code, 200)
+            self.assertEqual(self.api_get('/notes/view').status_code, 200)
+        self.assertEqual(decode.call_count, 1)
+
+    def test_cached_token_expires(self):
+        digest = TokenHandler.hashlib.sha256(b'token').digest()
+        TokenHandler.token_cache.set(digest, 1, 100.0, 50.0)
+        self.assertEqual(TokenHandler.token_cache.get(digest, 99.0), 1)
+        self.assertIsNone(TokenHandler.token_cache.get(digest, 100.0))
+
+
+class PasswordHashingTest(TestCase):
+    def sign_up(self):
+        return self.client.post('/auth/signup/', {'username': 'hashed', 'name': 'Hashed', 'password': 'secret',
+                                                  'confirm_password': 'secret'}, HTTP_KEY=API_KEY)
+
+    def sign_in(self, password):
+        return self.client.post('/auth/signin/', {'username': 'hashed', 'password': password}, HTTP_KEY=API_KEY)
+
+    def setUp(self):
+        patcher = mock.patch('bucketDRF.middleware.TokenHandler.API_KEY', API_KEY)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4)
+    def test_wrong_password_is_rejected(self):
+        self.sign_up()
+        self.assertEqual(self.sign_in('wrong').data, {'message': 'User does not exist.'})
+        self.assertEqual(self.sign_in('secret').status_code, 200)
+
+    def test_changed_work_factor_rehashes_on_sign_in(self):
+        with mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4):
+            self.sign_up()
+        self.assertIn('$04$', User.objects.get(username='hashed').password)
+        with mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 5):
+            self.assertEqual(self.sign_in('secret').status_code, 200)
+        self.assertIn('$05$', User.objects.get(username='hashed').password)
+
+    @mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4)
+    def test_sign_in_without_a_free_slot_is_refused_at_once(self):
+        self.sign_up()
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(hashers, '_slots', slots):
+            response = self.sign_in('secret')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.sign_in('secret').status_code, 200)
+
+
+class ConnectionHealthTest(ApiTestCase):
+    def test_stale_connection_is_dropped_on_request_start(self):
+        db.reset_stats()
+        long_ago = time.monotonic() - db.HEALTH_CHECK_IDLE
+        stale = mock.Mock(alias='default', settings_dict={'HEALTH_CHECKS': True}, idle_since=long_ago,
+                          **{'is_usable.return_value': False})
+        healthy = mock.Mock(alias='replica', settings_dict={'HEALTH_CHECKS': True}, idle_since=None,
+                            **{'is_usable.return_value': True})
+        recent = mock.Mock(alias='default', settings_dict={'HEALTH_CHECKS': True}, idle_since=time.monotonic())
+        with mock.patch.object(db, 'connections', mock.Mock(**{'all.return_value': [stale, healthy, recent]})):
+            db.check_connections()
+        stale.close.assert_called_once_with()
+        healthy.is_usable.assert_called_once_with()
+        healthy.close.assert_not_called()
+        # used by the previous request, it goes to the view without a round trip
+        recent.is_usable.assert_not_called()
+        self.assertEqual(self.api_get('/db/stats').data['result']['default']['health_check_failures'], 1)
+
+    def test_pool_waits_then_times_out(self):
+        db.reset_stats()
+        with mock.patch('bucketDRF.db.postgresql.base.pool.ThreadedConnectionPool') as threaded_pool:
+            threaded_pool.return_value.getconn.return_value = mock.Mock(closed=0)
+            connection_pool = ConnectionPool('default', 1, 0.01, {})
+            connection = connection_pool.checkout(health_checks=False)
+            with self.assertRaises(OperationalError):
+                connection_pool.checkout(health_checks=False)
+            connection_pool.checkin(connection)
+            connection_pool.checkout(health_checks=False)
+        self.assertEqual((db.stats()['default']['checkouts'], db.stats()['default']['pool_timeouts']), (2, 1))
+
+    def test_pool_pings_only_idle_connections(self):
+        with mock.patch('bucketDRF.db.postgresql.base.pool.ThreadedConnectionPool') as threaded_pool:
+            pooled = mock.Mock(closed=0)
+            threaded_pool.return_value.getconn.return_value = pooled
+            connection_pool = ConnectionPool('default', 1, 0.01, {}, health_check_idle=30)
+            connection_pool.checkin(connection_pool.checkout(health_checks=True))
+            connection_pool.checkin(connection_pool.checkout(health_checks=True))
+            pooled.cursor.assert_not_called()
+            connection_pool._idle_since[id(pooled)] -= 30
+            connection_pool.checkout(health_checks=True)
+            pooled.cursor.assert_called_once_with()
+
+
+class SearchNotesTest(ApiTestCase):
+    def test_search_ranks_matching_notes(self):
+        now = datetime.datetime.now()
+        for title, details in (('Paris trip', 'book the flight to paris, then the hotel in paris'),
+                               ('Groceries', 'milk and bread'),
+                               ('Tokyo', 'flight booked, no paris this year')):
+            Note.objects.create(user=self.user, title=title, details=details, created_at=now, updated_at=now,
+                                flag=True)
+        response = self.api_get('/notes/search', {'q': 'paris flight'})
+        self.assertEqual([row['title'] for row in response.data['result']], ['Paris trip', 'Tokyo'])
+        self.assertIsNone(response.data['next_offset'])
+
+        page = self.api_get('/notes/search', {'q': 'paris', 'limit': 1})
+        self.assertEqual(page.data['next_offset'], 1)
+        self.assertEqual(self.api_get('/notes/search', {'q': 'paris', 'offset': 1}).data['result'][0]['title'],
+                         'Tokyo')
+
+    def test_search_operators_on_the_fallback(self):
+        now = datetime.datetime.now()
+        for title, details in (('Paris trip', 'book the flight'), ('Rome trip', 'train then flight'),
+                               ('Groceries', 'milk and bread'), ('Flight book', 'for the trip')):
+            Note.objects.create(user=self.user, title=title, details=details, created_at=now, updated_at=now,
+                                flag=True)
+
+        def titles(q):
+            return sorted(row['title'] for row in self.api_get('/notes/search', {'q': q}).data['result'])
+        self.assertEqual(titles('trip flight'), ['Flight book', 'Paris trip', 'Rome trip'])
+        self.assertEqual(titles('trip -rome'), ['Flight book', 'Paris trip'])
+        self.assertEqual(titles('milk or rome'), ['Groceries', 'Rome trip'])
+        self.assertEqual(titles('"book the flight"'), ['Paris trip'])
+        self.assertEqual(titles('"flight book"'), ['Flight book'])
+        self.assertEqual(titles('trip -"train then flight"'), ['Flight book', 'Paris trip'])
+        self.assertEqual(titles('OR'), [])
+
+    def test_search_index_follows_writes(self):
+        self.assertEqual(self.api_get('/notes/search', {'q': 'dentist'}).data['result'], [])
+        self.api_post('/notes/create/', {'title': 'Dentist', 'details': 'tuesday'})
+        self.assertEqual(len(self.api_get('/notes/search', {'q': 'dentist'}).data['result']), 1)
+        self.assertEqual(self.api_get('/notes/search').status_code, 400)
+
+    def test_benchmark_command_runs(self):
+        out = io.StringIO()
+        call_command('benchmark_search', notes=50, queries=5, stdout=out)
+        self.assertIn('icontains scan', out.getvalue())
+        self.assertFalse(User.objects.filter(name='Benchmark').exists())
+
+
+@override_settings(ROOT_URLCONF='bucket_list.urls_async')
+class AsyncViewsTest(ApiTestCase):
+    def test_async_views_match_sync_views(self):
+        self.create_notes(3)
+        response = self.api_get('/notes/view', {'limit': 2, 'fields': 'id,title'})
+        self.assertEqual(response.status_code, 200)
+        with self.settings(ROOT_URLCONF='bucket_list.urls'):
+            caches_clear()
+            expected = self.api_get('/notes/view', {'limit': 2, 'fields': 'id,title'})
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response['ETag'], expected['ETag'])
+        not_modified = self.client.get('/notes/view', {'limit': 2, 'fields': 'id,title'},
+                                       HTTP_IF_NONE_MATCH=response['ETag'], **self.headers())
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_async_writes(self):
+        self.assertEqual(self.api_post('/notes/create/', {'title': 'new'}).status_code, 201)
+        note_id = Note.objects.get(title='new').id
+        self.assertEqual(self.api_post('/notes/edit/', {'note_id': note_id, 'mode': 'edit', 'title': 'edited'}).json(),
+                         {'result': 'Note edited'})
+        self.assertEqual(self.api_get('/notes/archive', {'note_id': note_id}).json(), {'result': 'Note archived!'})
+        self.assertEqual(self.api_get('/notes/getarchived').json()['result'][0]['title'], 'edited')
+        self.assertEqual(self.api_post('/notes/edit/', {'note_id': note_id, 'mode': 'delete'}).status_code, 200)
+        self.assertEqual(self.api_get('/notes/archive', {'note_id': note_id}).status_code, 400)
+        self.assertEqual(self.api_get('/notes/create/').status_code, 405)
+
+    def test_head_and_options_match_sync_views(self):
+        self.create_notes(1)
+        for path in ('/notes/view', '/notes/create/'):
+            head = self.client.head(path, **self.headers())
+            options = self.client.options(path, **self.headers())
+            wrong = self.client.put(path, **self.headers())
+            with self.settings(ROOT_URLCONF='bucket_list.urls'):
+                caches_clear()
+                expected = (self.client.head(path, **self.headers()), self.client.options(path, **self.headers()),
+                            self.client.put(path, **self.headers()))
+            self.assertEqual([head.status_code, options.status_code, wrong.status_code],
+                             [response.status_code for response in expected])
+            self.assertEqual(options.json(), expected[1].json())
+            self.assertEqual(options['Allow'], expected[1]['Allow'])
+            self.assertEqual(wrong.json(), expected[2].json())
+        head = self.client.head('/notes/view', **self.headers())
+        self.assertEqual(head.status_code, 200)
+        self.assertTrue(head['ETag'])
+
+    async def test_served_thru_async_middleware(self):
+        client = AsyncClient()
+        response = await client.get('/notes/view', key=API_KEY, authorization='Bearer {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await client.get('/notes/view', key=API_KEY)).status_code, 401)
+
+
+class MetricsTest(ApiTestCase):
+    def test_requests_are_recorded_per_route(self):
+        self.create_notes(2)
+        response = self.api_get('/notes/view')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries", app;dur=[\d.]+$')
+        self.client.get('/notes/view', HTTP_KEY=API_KEY)
+        self.api_get('/notes/view')
+        body = self.api_get('/metrics').content.decode()
+        self.assertIn('bucket_requests_total{route="notes/view",method="GET",status="200"} 2', body)
+        self.assertIn('bucket_requests_total{route="notes/view",method="GET",status="401"} 1', body)
+        self.assertIn('bucket_request_duration_seconds_count{route="notes/view",method="GET"} 3', body)
+        self.assertIn('bucket_request_duration_seconds_bucket{route="notes/view",method="GET",le="+Inf"} 3', body)
+        self.assertIn('bucket_request_db_queries_sum{route="notes/view",method="GET"} 2', body)
+
+    def test_metrics_token_replaces_api_key(self):
+        with self.settings(METRICS_TOKEN='scrape-token'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 400)
+
+
+class BenchmarkApiTest(TestCase):
+    @mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4)
+    def test_benchmark_drives_every_route_and_compares_to_baseline(self):
+        report_path = os.path.join(tempfile.mkdtemp(), 'report.json')
+        call_command('benchmark_api', users=3, notes=4, requests=3, mode='client', output=report_path,
+                     stderr=io.StringIO())
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(list(report['client']), ['signup', 'signin', 'view', 'getarchived', 'create', 'edit',
+                                                  'archive', 'sync', 'search'])
+        self.assertTrue(all(route['errors'] == 0 and route['requests'] == 3 for route in report['client'].values()))
+        self.assertFalse(User.objects.exists())
+
+        tight = ratelimit.parse_limits({'auth/signin/': {'ip': '1/m'}, 'auth/signup/': {'ip': '1/m'}})
+        with mock.patch.object(ratelimit, 'LIMITS', tight):
+            call_command('benchmark_api', users=3, notes=4, requests=3, mode='client', routes='signup,signin',
+                         output=report_path, stderr=io.StringIO())
+            self.assertIs(ratelimit.LIMITS, tight)
+        with open(report_path) as f:
+            self.assertTrue(all(route['errors'] == 0 for route in json.load(f)['client'].values()))
+        call_command('benchmark_api', users=3, notes=4, requests=3, mode='client', output=report_path,
+                     stderr=io.StringIO())
+        with open(report_path) as f:
+            report = json.load(f)
+
+        for route in report['client'].values():
+            route['p95_ms'] = route['p95_ms'] / 1000
+        with open(report_path, 'w') as f:
+            json.dump(report, f)
+        with self.assertRaisesMessage(CommandError, 'client view'):
+            call_command('benchmark_api', users=3, notes=4, requests=3, mode='client', routes='view',
+                         baseline=report_path, stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class RenderersTest(ApiTestCase):
+    data = {'result': [{'id': 1, 'title': 'caf\u00e9', 'created_at': datetime.datetime(2019, 1, 1, 12, 0, 0, 1234),
+                        'updated_at': datetime.datetime(2019, 1, 2),
+                        'synced_at': datetime.datetime(2019, 1, 2, tzinfo=timezone.utc),
+                        'due': datetime.date(2019, 2, 1), 'amount': decimal.Decimal('1.5'),
+                        'label': gettext_lazy('Note created!'), 7: None,
+                        'details': 'line\u2028paragraph\u2029end', 'big': 2 ** 70}]}
+
+    def test_backends_render_what_drf_renders(self):
+        expected = DRFJSONRenderer().render(self.data)
+        for name in renderers.BACKENDS:
+            dumps, loads = renderers.get_backend(name)
+            self.assertEqual(dumps(self.data), expected, name)
+            self.assertEqual(loads(expected)['result'][0]['created_at'], '2019-01-01T12:00:00.001234')
+
+    def test_stdlib_fallback_without_orjson(self):
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.get_backend('orjson'), renderers.BACKENDS['json'])
+        with self.assertRaises(ValueError):
+            renderers.get_backend('simplejson')
+
+    def test_views_render_and_parse_with_the_fast_backend(self):
+        self.create_notes(1)
+        response = self.api_get('/notes/view')
+        self.assertEqual(response.content, renderers.dumps(response.data))
+        self.assertEqual(self.client.post('/notes/batch/', '[', content_type='application/json',
+                                          **self.headers()).status_code, 400)
+        rejected = self.client.get('/notes/view', HTTP_KEY=API_KEY)
+        self.assertEqual((rejected['Content-Type'], rejected.json()), ('application/json', {'message': 'Token invalid.'}))
+
+
+class ExportNotesTest(ApiTestCase):
+    def export(self, **extra):
+        response = self.client.get('/notes/export', extra.pop('data', {}), **dict(self.headers(), **extra))
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson_export_streams_every_note(self):
+        self.create_notes(5)
+        self.create_notes(1, archived=True)
+        Note.objects.filter(title='note 4').update(flag=False)
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        notes = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([note['title'] for note in notes], ['note 0', 'note 1', 'note 0', 'note 2', 'note 3'])
+        self.assertEqual(notes[0]['created_at'], '2019-01-01T00:00:00')
+
+    def test_gzipped_csv_export(self):
+        self.create_notes(3)
+        response, body = self.export(data={'type': 'csv'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode())))
+        self.assertEqual(rows[0], ['id', 'title', 'details', 'archived', 'created_at', 'updated_at'])
+        self.assertEqual([row[1] for row in rows[1:]], ['note 0', 'note 1', 'note 2'])
+        self.assertEqual(self.api_get('/notes/export', {'type': 'xml'}).status_code, 400)
+
+    def test_encoding_follows_accept_encoding_weights(self):
+        self.create_notes(2)
+        response, body = self.export(HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(body.splitlines()), 2)
+        response, body = self.export(HTTP_ACCEPT_ENCODING='gzip;q=0.5, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(len(Compression.brotli.decompress(body).splitlines()), 2)
+
+    def test_served_on_the_event_loop_under_asgi(self):
+        sent, inbox = [], asyncio.Queue()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/notes/export', 'query_string': b'type=csv',
+                 'headers': [(b'key', API_KEY.encode()), (b'authorization', 'Bearer {}'.format(self.token).encode())]}
+        rows = [(1, 'first', None, False, datetime.datetime(2019, 1, 1), datetime.datetime(2019, 1, 1))]
+
+        async def send(message):
+            sent.append(message)
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with mock.patch('bucketDRF.export.note_rows', return_value=iter(rows)):
+            loop.run_until_complete(EventStreamRouter(None)(scope, inbox.get, send))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/csv'), sent[0]['headers'])
+        body = b''.join(message['body'] for message in sent[1:])
+        self.assertEqual(body.decode().splitlines()[1], '1,first,,False,2019-01-01T00:00:00,2019-01-01T00:00:00')
+        self.assertFalse(sent[-1].get('more_body'))
+
+    def test_chunks_handed_over_from_a_thread(self):
+        self.assertEqual(list(in_thread(iter([b'a', b'b', b'c']), depth=1)), [b'a', b'b', b'c'])
+
+        def failing():
+            yield b'a'
+            raise OSError('lost')
+        with self.assertRaises(OSError):
+            list(in_thread(failing()))
+
+        async def consume(chunks):
+            return [chunk async for chunk in in_thread_async(chunks, depth=1)]
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertEqual(loop.run_until_complete(consume(iter([b'a', b'b', b'c']))), [b'a', b'b', b'c'])
+        with self.assertRaises(OSError):
+            loop.run_until_complete(consume(failing()))
+
+
+class ImportNotesTest(ApiTestCase):
+    lines = [b'{"title": "first", "details": "one"}', b'{"title": "' + b'x' * 51 + b'"}', b'not json',
+             b'', b'{"details": "no title"}', b'{"title": "archived", "archived": true}',
+             b'{"title": "third", "archived": "maybe"}', b'{"title": "last"}']
+
+    def test_ndjson_import_reports_row_errors(self):
+        response = self.client.post('/notes/import/?import_id=phone-app', b'\n'.join(self.lines),
+                                    content_type='application/x-ndjson', **self.headers())
+        self.assertEqual(response.json()['result'], {
+            'import_id': 'phone-app', 'rows_done': 8, 'imported': 3, 'failed': 4,
+            'errors': [{'row': 2, 'error': 'title is longer than 50 characters.'}, {'row': 3, 'error': 'Invalid JSON.'},
+                       {'row': 5, 'error': 'title is required.'}, {'row': 7, 'error': 'archived must be true or false.'}]})
+        self.assertEqual(list(Note.objects.order_by('id').values_list('title', 'archived')),
+                         [('first', False), ('archived', True), ('last', False)])
+        self.assertEqual(self.api_get('/notes/import/', {'import_id': 'phone-app'}).json()['result']['imported'], 3)
+        self.assertEqual(self.api_post('/notes/import/?import_id=bad/id').status_code, 400)
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        def interrupted():
+            yield from self.lines[:6]
+            raise OSError('connection reset')
+        with self.assertRaises(OSError):
+            import_notes(self.user.id, 'resume', interrupted(), batch_size=2)
+        self.assertEqual(NoteImport.objects.get(import_id='resume').rows_done, 5)
+
+        job, errors = import_notes(self.user.id, 'resume', iter(self.lines), batch_size=2)
+        self.assertEqual((job.rows_done, job.imported, job.failed), (8, 3, 4))
+        self.assertEqual([error['row'] for error in errors], [7])
+        self.assertEqual(Note.objects.count(), 3)
+
+    def test_committed_batches_tell_streams_to_resync(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe():
+            return events.broker.subscribe(self.user.id)
+        subscription = loop.run_until_complete(subscribe())
+        with self.captureOnCommitCallbacks(execute=True):
+            import_notes(self.user.id, 'streamed', iter(self.lines[:1] + self.lines[-1:]), batch_size=1)
+        received = loop.run_until_complete(asyncio.wait_for(subscription.get(), 1))
+        self.assertEqual(received, events.RESYNC)
+        self.assertEqual(subscription.queue.qsize(), 1)
+        events.broker.unsubscribe(subscription)
+
+    def test_concurrent_run_of_the_same_import_is_refused(self):
+        def race(job):
+            NoteImport.objects.filter(id=job.id).update(rows_done=job.rows_done + 1)
+        with self.assertRaisesMessage(ImportFailed, 'being imported by another request'):
+            import_notes(self.user.id, 'race', iter(self.lines), batch_size=1, progress=race)
+        self.assertEqual(Note.objects.count(), 1)
+
+    def test_csv_upload_and_command(self):
+        upload = SimpleUploadedFile('notes.csv', b'\xef\xbb\xbftitle,details,archived\r\nfirst,"multi\nline",0\r\n'
+                                                 b'second,,1\r\n')
+        response = self.client.post('/notes/import/?import_id=web&type=csv', {'file': upload}, **self.headers())
+        self.assertEqual(response.json()['result']['imported'], 2)
+        self.assertEqual(Note.objects.get(title='first').details, 'multi\nline')
+
+        path = os.path.join(tempfile.mkdtemp(), 'notes.csv')
+        with open(path, 'wb') as f:
+            f.write(b'details\r\nno title\r\n')
+        with self.assertRaisesMessage(CommandError, 'title column'):
+            call_command('import_notes', path, username='user', stdout=io.StringIO(), stderr=io.StringIO())
+        with open(path, 'wb') as f:
+            f.write(b'title\r\n' + b'\r\n'.join(b'note %d' % i for i in range(5)) + b'\r\n')
+        out = io.StringIO()
+        call_command('import_notes', path, username='user', import_id='cli', batch_size=2, stdout=out,
+                     stderr=io.StringIO())
+        self.assertEqual(out.getvalue().strip(), 'cli: 5 imported, 0 failed, checkpoint at row 5')
+
+
+class RateLimitTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        limits = ratelimit.parse_limits({'default': {'user': '3/m'}, 'auth/signin/': {'ip': '2/m', 'key': '100/m'}})
+        for target, value in (('LIMITS', limits), ('backend', ratelimit.MemoryBackend(100))):
+            patcher = mock.patch.object(ratelimit, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_user_budget_answers_429_with_retry_after(self):
+        self.assertEqual([self.api_get('/notes/view').status_code for _ in range(3)], [200] * 3)
+        limited = self.api_get('/notes/view')
+        self.assertEqual((limited.status_code, limited.json()), (429, {'message': 'Too many requests.'}))
+        self.assertEqual(limited['Retry-After'], '20')
+        other = User.objects.create(username='other', name='Other', password='-', created_at=self.user.created_at,
+                                    updated_at=self.user.updated_at)
+        token = jwt_encode_handler(jwt_payload_handler(other))
+        self.assertEqual(self.client.get('/notes/view', HTTP_KEY=API_KEY,
+                                         HTTP_AUTHORIZATION='Bearer ' + token).status_code, 200)
+
+    def test_signin_budget_is_per_ip(self):
+        def sign_in(ip):
+            return self.client.post('/auth/signin/', {'username': 'nobody', 'password': 'x'}, HTTP_KEY=API_KEY,
+                                    REMOTE_ADDR=ip).status_code
+        self.assertEqual([sign_in('10.0.0.1') for _ in range(3)], [400, 400, 429])
+        self.assertEqual(sign_in('10.0.0.2'), 400)
+        with mock.patch.object(ratelimit, 'TRUSTED_PROXIES', 1):
+            self.assertEqual(self.client.post('/auth/signin/', {}, HTTP_KEY=API_KEY, REMOTE_ADDR='10.0.0.1',
+                                              HTTP_X_FORWARDED_FOR='10.0.0.9, 10.0.0.3').status_code, 400)
+
+    @mock.patch.object(ratelimit, 'TRUSTED_PROXIES', 1)
+    def test_ip_budgets_behind_the_router_follow_x_forwarded_for(self):
+        from bucket_list import settings_production
+        self.assertEqual(settings_production.RATE_LIMIT_PROXIES, 1)
+
+        def sign_in(forwarded_for):
+            # every request reaches the dyno from the router's address
+            return self.client.post('/auth/signin/', {'username': 'nobody', 'password': 'x'}, HTTP_KEY=API_KEY,
+                                    REMOTE_ADDR='10.1.0.1', HTTP_X_FORWARDED_FOR=forwarded_for).status_code
+        self.assertEqual([sign_in('203.0.113.7') for _ in range(3)], [400, 400, 429])
+        self.assertEqual(sign_in('198.51.100.4'), 400)
+        # an address the client puts in front of the router's does not buy a new budget
+        self.assertEqual(sign_in('192.0.2.1, 203.0.113.7'), 429)
+
+    def test_buckets_refill(self):
+        rate = ratelimit.parse_rate('2/s')
+        with mock.patch('bucketDRF.ratelimit.time.monotonic', side_effect=[0.0, 0.1, 0.2, 0.75, 0.8]):
+            waits = [ratelimit.backend.take([('k', rate)]) for _ in range(4)]
+            # a bucket out of tokens keeps the others untouched
+            self.assertTrue(ratelimit.backend.take([('other', rate), ('k', rate)]))
+        # 2 tokens, the third hit waits for the 0.2 left plus 0.8 more at 2 a second
+        self.assertEqual(waits[:2] + waits[3:], [0, 0, 0])
+        self.assertAlmostEqual(waits[2], 0.3)
+        self.assertNotIn('other', ratelimit.backend._buckets)
+        with self.assertRaises(ValueError):
+            ratelimit.parse_rate('10/week')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'ratelimit-test'}})
+    def test_cache_backend_counts_windows(self):
+        backend, rate = ratelimit.CacheBackend('default'), ratelimit.parse_rate('2/m')
+        with mock.patch('bucketDRF.ratelimit.time.time', return_value=600.0):
+            self.assertEqual([backend.take([(('route', 'ip', 'k'), rate)]) for _ in range(3)], [0, 0, 60.0])
+        with mock.patch('bucketDRF.ratelimit.time.time', return_value=660.0):
+            self.assertEqual(backend.take([(('route', 'ip', 'k'), rate)]), 0)
+
+
+class CompressionTest(ApiTestCase):
+    def test_large_responses_are_compressed_as_negotiated(self):
+        self.create_notes(40)
+        plain = self.api_get('/notes/view')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        gzipped = self.client.get('/notes/view', HTTP_ACCEPT_ENCODING='gzip, deflate', **self.headers())
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+        self.assertEqual(gzipped['Content-Length'], str(len(gzipped.content)))
+        self.assertEqual(gzipped['ETag'], 'W/' + plain['ETag'])
+        refused = self.client.get('/notes/view', HTTP_ACCEPT_ENCODING='gzip;q=0, identity', **self.headers())
+        self.assertNotIn('Content-Encoding', refused)
+        # the weakened ETag still validates
+        self.assertEqual(self.client.get('/notes/view', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=gzipped['ETag'],
+                                         **self.headers()).status_code, 304)
+
+    def test_small_responses_are_sent_as_they_are(self):
+        self.create_notes(1)
+        response = self.client.get('/notes/view', HTTP_ACCEPT_ENCODING='gzip, br', **self.headers())
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(len(response.data['result']), 1)
+
+    def test_choose_encoding(self):
+        with mock.patch.object(Compression, 'brotli', object()):
+            self.assertEqual(Compression.choose_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(Compression.choose_encoding('br;q=0.5, gzip'), 'gzip')
+            self.assertEqual(Compression.choose_encoding('*'), 'br')
+            self.assertIsNone(Compression.choose_encoding('identity, *;q=0'))
+        with mock.patch.object(Compression, 'brotli', None):
+            self.assertEqual(Compression.choose_encoding('br, gzip;q=0.1'), 'gzip')
+        self.assertIsNone(Compression.choose_encoding(''))
+
+
+class ColumnsLayoutTest(ApiTestCase):
+    def test_columns_layout(self):
+        self.create_notes(3)
+        rows = self.api_get('/notes/view', {'fields': 'id,title'}).data['result']
+        columns = self.api_get('/notes/view', {'fields': 'id,title', 'layout': 'columns'}).data['result']
+        self.assertEqual(columns['keys'], ['id', 'title'])
+        self.assertEqual([dict(zip(columns['keys'], row)) for row in columns['rows']], rows)
+        page = self.api_get('/notes/view', {'limit': 2, 'layout': 'columns'}).data
+        self.assertEqual(len(page['result']['rows']), 2)
+        self.assertIsNotNone(page['next_cursor'])
+        # a single note keeps its object
+        self.assertEqual(self.api_get('/notes/view', {'note_id': rows[0]['id'], 'layout': 'columns'}).data['result']['id'],
+                         rows[0]['id'])
+
+    def test_archived_columns_and_bad_layout(self):
+        self.create_notes(2, archived=True)
+        columns = self.api_get('/notes/getarchived', {'layout': 'columns'}).data['result']
+        self.assertEqual(len(columns['rows']), 2)
+        self.assertEqual(len(columns['rows'][0]), len(columns['keys']))
+        response = self.api_get('/notes/view', {'layout': 'table'})
+        self.assertEqual((response.status_code, response.data), (400, {'message': 'layout must be one of rows, columns.'}))
+
+
+class NoteEventsTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self):
+        async def subscribe():
+            return events.broker.subscribe(self.user.id)
+        return self.loop.run_until_complete(subscribe())
+
+    def next_event(self, subscription):
+        return self.loop.run_until_complete(asyncio.wait_for(subscription.get(), 1))
+
+    def test_writes_publish_once_committed(self):
+        subscription = self.subscribe()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_post('/notes/create/', {'title': 't', 'details': 'd'})
+        note_id = Note.objects.get().id
+        self.assertEqual(subscription.queue.qsize(), 0)
+        created = self.next_event(subscription)
+        self.assertEqual((created['type'], created['note_id']), ('created', note_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_post('/notes/edit/', {'note_id': note_id, 'mode': 'edit', 'title': 'u', 'details': 'd'})
+            self.api_get('/notes/archive', {'note_id': note_id})
+            self.api_post('/notes/edit/', {'note_id': 999, 'mode': 'delete'})
+        self.assertEqual([self.next_event(subscription)['type'] for _ in range(2)], ['edited', 'archived'])
+        self.assertTrue(subscription.queue.empty())
+        events.broker.unsubscribe(subscription)
+        self.assertEqual(events.broker.count(), 0)
+
+    def test_overflow_asks_for_resync(self):
+        subscription = self.subscribe()
+        with mock.patch.object(subscription, 'queue', asyncio.Queue(1)):
+            subscription.put({'type': 'edited'})
+            subscription.put({'type': 'archived'})
+            self.assertEqual(self.next_event(subscription), events.RESYNC)
+
+    def test_server_sent_events(self):
+        app = EventStreamRouter(None)
+        sent, inbox = [], asyncio.Queue()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/notes/events', 'query_string': b'',
+                 'headers': [(b'key', API_KEY.encode()), (b'authorization', 'Bearer {}'.format(self.token).encode())]}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            stream = asyncio.ensure_future(app(scope, inbox.get, send))
+            while events.broker.count(self.user.id) == 0:
+                await asyncio.sleep(0)
+            events.broker.deliver(self.user.id, {'type': 'deleted', 'note_id': 3})
+            while len(sent) < 3:
+                await asyncio.sleep(0)
+            await inbox.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(stream, 1)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(sent[2]['body'], b'event: deleted\ndata: {"type":"deleted","note_id":3}\n\n')
+        self.assertEqual(events.broker.count(), 0)
+
+    def test_websocket_needs_a_token(self):
+        app = EventStreamRouter(None)
+        sent = []
+        scope = {'type': 'websocket', 'path': '/notes/events', 'query_string': b'', 'headers': [(b'key', API_KEY.encode())]}
+
+        async def receive():
+            return {'type': 'websocket.connect'}
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(app(scope, receive, send))
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4401}])
+
+
+class UserCacheTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('bucketDRF.middleware.TokenHandler.API_KEY', API_KEY)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches_clear()
+
+    def sign_up(self, username):
+        return self.client.post('/auth/signup/', {'username': username, 'name': 'N', 'password': 'secret',
+                                                  'confirm_password': 'secret'}, HTTP_KEY=API_KEY)
+
+    @mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4)
+    def test_signed_up_users_sign_in_right_away(self):
+        self.assertEqual(self.client.post('/auth/signin/', {'username': 'fresh', 'password': 'secret'},
+                                          HTTP_KEY=API_KEY).status_code, 400)
+        self.assertEqual(self.sign_up('fresh').status_code, 201)
+        self.assertEqual(self.sign_up('fresh').data, {'message': 'Please choose another username.'})
+        response = self.client.post('/auth/signin/', {'username': 'fresh', 'password': 'secret'}, HTTP_KEY=API_KEY)
+        self.assertEqual(response.data['user_details']['id'], User.objects.get(username='fresh').id)
+
+    def test_other_processes_catch_up(self):
+        self.assertFalse(user_cache.user_filter.may_exist('elsewhere'))
+        # a sign-up in another process: the row and the version bump, not this process' filter
+        now = datetime.datetime.now()
+        User.objects.create(username='elsewhere', name='E', password='-', created_at=now, updated_at=now)
+        user_cache._bump_version()
+        with self.assertNumQueries(1):
+            self.assertTrue(user_cache.user_filter.may_exist('elsewhere'))
+        # rebuilt by the command, picked up from the cache instead of the table
+        out = io.StringIO()
+        call_command('rebuild_user_filter', stdout=out)
+        self.assertTrue(out.getvalue().startswith('1 usernames'))
+        user_cache.user_filter.reset()
+        with self.assertNumQueries(1):
+            self.assertTrue(user_cache.user_filter.may_exist('elsewhere'))
+
+    @mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4)
+    def test_process_local_cache_leaves_the_filter_out(self):
+        # a sign-up in another worker: the row only, its version bump went to that worker's memory
+        now = datetime.datetime.now()
+        User.objects.create(username='elsewhere', name='E', password='-', created_at=now, updated_at=now)
+        self.assertEqual(self.sign_up('elsewhere').data, {'message': 'Please choose another username.'})
+        with self.assertNumQueries(1):
+            self.assertIsNone(user_cache.get_active_user('nobody'))
+        self.assertEqual(user_cache.get_active_user('elsewhere').name, 'E')
+        self.assertIsNone(user_cache.user_filter.bloom)
+
+    @mock.patch.object(user_cache, '_shared', return_value=True)
+    def test_shared_cache_holds_absences_only(self, shared):
+        self.assertIsNone(user_cache.get_active_user('nobody'))
+        now = datetime.datetime.now()
+        User.objects.create(username='inactive', name='I', password='-', created_at=now, updated_at=now, flag=False)
+        User.objects.create(username='active', name='A', password='secret-hash', created_at=now, updated_at=now)
+        user_cache._bump_version()
+        self.assertIsNone(user_cache.get_active_user('inactive'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(user_cache.get_active_user('inactive'))
+        self.assertEqual(user_cache.get_active_user('active').password, 'secret-hash')
+        cached = [user_cache._cache().get(user_cache._record_key(name)) for name in ('inactive', 'active')]
+        self.assertEqual(cached, [user_cache.MISSING, None])
+
+    def test_bloom_filter(self):
+        bloom = user_cache.BloomFilter(1000, 0.01)
+        names = ['user{}'.format(i) for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum('other{}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertEqual(user_cache.BloomFilter(1000, 0.01, bits=bloom.bits).bits, bloom.bits)
+
+
+@mock.patch.dict(jobs.TASKS)
+class BackgroundJobsTest(ApiTestCase):
+    def test_jobs_run_once_and_are_deleted(self):
+        calls = []
+        jobs.task('test.record')(lambda job, data: calls.append((job.attempts, data)))
+        jobs.enqueue('test.record', {'n': 1})
+        jobs.enqueue('test.record', {'n': 2}, delay=60)
+        self.assertEqual(jobs.work('w1', once=True), 1)
+        self.assertEqual(calls, [(1, {'n': 1})])
+        self.assertEqual(BackgroundJob.objects.get().status, 'queued')
+        with self.assertRaises(jobs.UnknownTask):
+            jobs.enqueue('test.unknown')
+
+    def test_failures_are_retried_then_kept(self):
+        def flaky(job, data):
+            raise ValueError('attempt {}'.format(job.attempts))
+
+        jobs.task('test.flaky', max_attempts=2)(flaky)
+        job = jobs.enqueue('test.flaky')
+        with self.assertLogs('bucketDRF.jobs', 'WARNING'):
+            self.assertFalse(jobs.run(jobs.claim('w1')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('queued', 1, 'ValueError: attempt 1'))
+        self.assertGreater(job.run_at, datetime.datetime.now() + datetime.timedelta(seconds=jobs.RETRY_DELAY - 1))
+        self.assertIsNone(jobs.claim('w1'))
+        BackgroundJob.objects.update(run_at=datetime.datetime.now())
+        with self.assertLogs('bucketDRF.jobs', 'WARNING'):
+            self.assertFalse(jobs.run(jobs.claim('w1')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('failed', 2, 'ValueError: attempt 2'))
+        self.assertIsNone(jobs.claim('w1'))
+
+    def test_visibility_timeout_hands_a_job_over(self):
+        jobs.task('test.noop', max_attempts=2)(lambda job, data: None)
+        jobs.enqueue('test.noop')
+        lost = jobs.claim('dead worker')
+        self.assertIsNone(jobs.claim('w2'))
+        BackgroundJob.objects.update(locked_until=datetime.datetime.now() - datetime.timedelta(seconds=1))
+        taken = jobs.claim('w2')
+        self.assertEqual((taken.id, taken.locked_by, taken.attempts), (lost.id, 'w2', 2))
+        self.assertFalse(jobs.extend(lost))
+        # the last attempt expiring too fails the job instead of running it a third time
+        BackgroundJob.objects.update(locked_until=datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertIsNone(jobs.claim('w3'))
+        self.assertEqual(BackgroundJob.objects.get().status, 'failed')
+
+    @mock.patch.object(importer, 'UPLOAD_CHUNK_SIZE', 8)
+    def test_background_import(self):
+        # stored in pieces which cut thru the lines, read back on the worker's side
+        response = self.client.post('/notes/import/?import_id=later&background=1',
+                                    b'{"title": "a"}\n{"title": "b"}\n', content_type='application/x-ndjson',
+                                    **self.headers())
+        self.assertEqual((response.status_code, response.json()['result']['rows_done']), (202, 0))
+        self.assertFalse(Note.objects.exists())
+        self.assertEqual(NoteImportChunk.objects.count(), 4)
+        call_command('run_jobs', '--once', stderr=io.StringIO())
+        self.assertFalse(NoteImportChunk.objects.exists())
+        self.assertEqual(sorted(Note.objects.values_list('title', flat=True)), ['a', 'b'])
+        self.assertEqual(self.api_get('/notes/import/', {'import_id': 'later'}).json()['result']['imported'], 2)
+        self.assertFalse(BackgroundJob.objects.exists())
+        # a second job for the same upload finds it imported
+        jobs.enqueue('notes.import', {'user_id': self.user.id, 'import_id': 'later', 'type': 'ndjson'})
+        call_command('run_jobs', '--once', stderr=io.StringIO())
+        self.assertFalse(BackgroundJob.objects.exists())
+        self.assertEqual(Note.objects.count(), 2)
+
+    def test_worker_runs_on_the_settings_of_the_web_processes(self):
+        # gunicorn.conf.py serves bucket_list.settings_production, the worker has to share its caches and events
+        with open(os.path.join(settings.BASE_DIR, 'Procfile')) as f:
+            processes = dict(line.split(': ', 1) for line in f.read().splitlines() if line.strip())
+        self.assertTrue(processes['worker'].startswith('DJANGO_SETTINGS_MODULE=bucket_list.settings_production '))
+
+    def test_worker_writes_reach_other_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+            with override_settings(CACHES=dict(settings.CACHES, notes=shared)):
+                # a web process' view of the shared cache and of the events
+                web_cache = FileBasedCache(directory, {})
+                published = []
+                self.assertEqual(self.api_get('/notes/view').data, {'message': 'No notes found.'})
+                version = web_cache.get('notes:version:{}'.format(self.user.id))
+                self.client.post('/notes/import/?import_id=shared&background=1', b'{"title": "a"}\n',
+                                 content_type='application/x-ndjson', **self.headers())
+                with mock.patch.object(events, 'backend', mock.Mock(publish=lambda *event: published.append(event))):
+                    call_command('run_jobs', '--once', stderr=io.StringIO())
+                self.assertNotEqual(web_cache.get('notes:version:{}'.format(self.user.id)), version)
+                self.assertEqual(published, [(self.user.id, events.RESYNC)])
+                self.assertEqual([note['title'] for note in self.api_get('/notes/view').data['result']], ['a'])
+
+    def test_background_import_without_its_upload_fails(self):
+        self.client.post('/notes/import/?import_id=lost&background=1', b'{"title": "a"}\n',
+                         content_type='application/x-ndjson', **self.headers())
+        NoteImportChunk.objects.all().delete()
+        job = jobs.claim('w1')
+        with self.assertLogs('bucketDRF.jobs', 'WARNING'):
+            self.assertFalse(jobs.run(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error),
+                         ('queued', 'bucketDRF.importer.ImportFailed: The upload of import_id lost is missing.'))
+        self.assertIsNone(NoteImport.objects.get(import_id='lost').finished_at)
+
+
+@mock.patch.object(replicas, 'REPLICAS', ['replica'])
+class ReplicaRoutingTest(ApiTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        User.objects.using('replica').create(id=self.user.id, username='user', name='User', password='-',
+                                             created_at=self.user.created_at, updated_at=self.user.updated_at)
+        now = datetime.datetime.now()
+        Note.objects.create(user=self.user, title='primary', created_at=now, updated_at=now, flag=True)
+        Note.objects.using('replica').create(user_id=self.user.id, title='replica', created_at=now, updated_at=now,
+                                             flag=True)
+
+    def titles(self, path='/notes/view'):
+        return [note['title'] for note in self.api_get(path).data['result']]
+
+    def test_reads_go_to_the_replica_until_the_user_writes(self):
+        self.assertEqual(self.titles(), ['replica'])
+        with self.assertNumQueries(0, using='replica'):
+            self.assertEqual(self.api_post('/notes/create/', {'title': 'new'}).status_code, 201)
+        self.assertEqual(sorted(self.titles()), ['new', 'primary'])
+        self.assertFalse(Note.objects.using('replica').filter(title='new').exists())
+        # another user has not written and still reads from the replica
+        other = User.objects.create(username='other', name='Other', password='-', created_at=self.user.created_at,
+                                    updated_at=self.user.updated_at)
+        token = jwt_encode_handler(jwt_payload_handler(other))
+        with self.assertNumQueries(0):
+            self.client.get('/notes/view', HTTP_KEY=API_KEY, HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(replicas, '_check', return_value=False):
+            self.assertEqual(self.titles('/notes/view'), ['primary'])
+        self.assertEqual(db.stats()['replica']['health_check_failures'], 1)
+        # checked again once REPLICA_CHECK_INTERVAL passed (the list cached from the primary dropped)
+        notes_cache._cache().clear()
+        with mock.patch.object(replicas, 'CHECK_INTERVAL', 0):
+            self.assertEqual(self.titles('/notes/view'), ['replica'])
+
+    def test_replica_error_mid_request_is_retried_on_the_primary(self):
+        calls = []
+
+        @replicas.use_replicas('user')
+        def view(request):
+            calls.append(replicas._read_alias.get())
+            if len(calls) == 1:
+                raise OperationalError('server closed the connection unexpectedly')
+            return calls[-1]
+
+        request = mock.Mock(requested_by=self.user.id)
+        self.assertIsNone(view(request))
+        self.assertEqual(calls, ['replica', None])
+        self.assertFalse(replicas.healthy('replica'))
+
+    @mock.patch.object(BCryptSHA256PasswordHasher, 'rounds', 4)
+    def test_sign_in_right_after_sign_up(self):
+        response = self.client.post('/auth/signup/', {'username': 'fresh', 'name': 'F', 'password': 'secret',
+                                                      'confirm_password': 'secret'}, HTTP_KEY=API_KEY)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/auth/signin/', {'username': 'fresh', 'password': 'secret'}, HTTP_KEY=API_KEY)
+        self.assertEqual(response.status_code, 200)
+        # without a sign-up the replica is health checked and the lookup goes there
+        with self.assertNumQueries(2, using='replica'):
+            self.client.post('/auth/signin/', {'username': 'user', 'password': 'secret'}, HTTP_KEY=API_KEY)
+
+
+class ProfilingTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        for name, value in (('PROFILE_DIR', directory), ('PROFILE_TOKEN', 'profile-token'), ('RELEASE', 'v42')):
+            patcher = mock.patch.object(profiling, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.directory = os.path.join(directory, 'v42')
+
+    def reports(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.listdir(self.directory))
+
+    def test_header_writes_call_tree_and_queries(self):
+        self.create_notes(3)
+        response = self.client.get('/notes/view', HTTP_X_PROFILE='profile-token', **self.headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.reports(), [response['X-Profile-Id']])
+        self.assertTrue(response['X-Profile-Id'].startswith('notes_view.GET.'))
+        with open(os.path.join(self.directory, response['X-Profile-Id'])) as f:
+            report = f.read()
+        self.assertTrue(report.startswith('GET /notes/view -> 200\nrelease: v42\n'))
+        sql = report.split('== SQL\n')[1].split('\n\n== Call tree\n')[0].splitlines()
+        self.assertTrue(sql and all(line.split('  ')[1] == 'default' for line in sql))
+        self.assertTrue(any('"note"' in line for line in sql))
+        tree = report.split('== Call tree\n')[1]
+        self.assertIn('bucketDRF/views.py:', tree)
+        self.assertNotIn(settings.BASE_DIR, tree)
+
+    def test_wrong_or_missing_token_is_not_profiled(self):
+        self.client.get('/notes/view', HTTP_X_PROFILE='guess', **self.headers())
+        self.api_get('/notes/view')
+        with mock.patch.object(profiling, 'PROFILE_TOKEN', None):
+            self.client.get('/notes/view', HTTP_X_PROFILE='', **self.headers())
+        self.assertEqual(self.reports(), [])
+
+    def test_sample_rate(self):
+        with mock.patch.object(profiling, 'SAMPLE_RATE', 1.0):
+            self.assertIn('X-Profile-Id', self.api_get('/notes/view'))
+        self.assertEqual(len(self.reports()), 1)
+
+    @override_settings(ROOT_URLCONF='bucket_list.urls_async')
+    async def test_async_requests_record_queries_only(self):
+        response = await AsyncClient().get('/notes/view', key=API_KEY, authorization='Bearer {}'.format(self.token),
+                                           x_profile='profile-token')
+        self.assertEqual(response.status_code, 200)
+        with open(os.path.join(self.directory, response['X-Profile-Id'])) as f:
+            report = f.read()
+        self.assertIn('"note"', report)
+        self.assertIn('== Call tree\nnot captured (ASGI)\n', report)
+
+    def test_slow_queries_are_logged_with_their_plan(self):
+        self.create_notes(1)
+        with mock.patch.object(profiling, 'SLOW_QUERY_MS', 1e-9), \
+                self.assertLogs('bucketDRF.profiling', 'WARNING') as logs:
+            self.api_get('/notes/view')
+        note_queries = [line for line in logs.output if 'FROM "note"' in line]
+        self.assertTrue(note_queries)
+        # sqlite's EXPLAIN QUERY PLAN rows, SCAN / SEARCH
+        self.assertRegex(note_queries[0], r'\n.*(SCAN|SEARCH)')
+        with mock.patch.object(profiling, 'SLOW_QUERY_MS', 0), self.assertNoLogs('bucketDRF.profiling'):
+            self.api_get('/notes/view')
+
+    def test_failed_queries_are_not_explained(self):
+        self.assertEqual(profiling.SLOW_QUERY_MS, 0)
+        with mock.patch.object(profiling, 'SLOW_QUERY_MS', 1e-9), self.assertNoLogs('bucketDRF.profiling'), \
+                mock.patch.object(profiling, '_explain') as explain, self.assertRaises(OperationalError):
+            with connections['default'].cursor() as cursor:
+                cursor.execute('SELECT missing FROM note')
+        explain.assert_not_called()
+
+    def test_slow_query_log_leaves_parameter_values_out(self):
+        with mock.patch.object(profiling, 'SLOW_QUERY_MS', 1e-9), \
+                self.assertLogs('bucketDRF.profiling', 'WARNING') as logs:
+            User.objects.filter(id=self.user.id).update(password='bcrypt_sha256$secret-hash')
+        self.assertIn('params=[str, int]', logs.output[0])
+        self.assertNotIn('secret-hash', '\n'.join(logs.output))
+
+    def test_report_names_stay_in_the_release_directory(self):
+        request = RequestFactory().get('/notes/view')
+        request.method = '../../GET'
+        name = profiling.write(request, HttpResponse(), profiling.Profile(), 0.0, '/notes/view')
+        self.assertTrue(name.startswith('notes_view..._.._GET.'))
+        self.assertEqual(self.reports(), [name])
+
+
+class GunicornConfTest(TestCase):
+    def load(self, **environ):
+        """ The names gunicorn.conf.py defines, run in an environment with only <environ> of its variables """
+        with mock.patch.dict(os.environ):
+            for name in ('NOTES_CACHE_URL', 'REDIS_URL', 'WEB_CONCURRENCY'):
+                os.environ.pop(name, None)
+            os.environ.update(environ)
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+
+    def test_one_worker_without_a_shared_cache(self):
+        self.assertEqual(self.load()['workers'], 1)
+        self.assertGreater(self.load(REDIS_URL='redis://cache')['workers'], 1)
+        self.assertEqual(self.load(WEB_CONCURRENCY='3')['workers'], 3)
+
+    def test_workers_on_process_memory_start_with_a_warning(self):
+        server = mock.Mock()
+        server.cfg.workers, server.cfg.worker_class_str = 3, 'gthread'
+        self.load()['on_starting'](server)
+        self.assertIn('notes, users', server.log.warning.call_args[0][2])
+        server.cfg.worker_class_str = 'uvicorn.workers.UvicornWorker'
+        with self.assertRaises(SystemExit):
+            self.load()['on_starting'](server)
@@ -0,0 +1,205 @@
+"""
+Username lookups for SignIn and SignUp without a query per attempt.
+
+A Bloom filter of every username (active or not) answers 'certainly not taken' for unknown names,
+so failed sign-ins and free usernames at sign-up never reach the database. The names it may contain
+are looked up in the User table, their absence (a false positive, an inactive user) is cached for a
+short while. Only that absence is cached, never a user's row and its password hash.
+
+The filter is stored in the 'users' cache with a version which SignUp bumps. Each process keeps its
+own copy and, when the version moved or USER_FILTER_TTL ran out, adds the users created since its copy
+(one query per sign-up anywhere, not per attempt). manage.py rebuild_user_filter rebuilds it.
+
+The filter is only trusted on a cache shared by the workers (NOTES_CACHE_URL, settings_production's
+REDIS_URL). On the default local memory cache the version would miss the sign-ups of other workers,
+SignIn and SignUp then query the User table on every attempt, as without this module.
+"""
+
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+
+# Models import
+from bucketDRF.models import User
+
+# Misc. imports
+import hashlib
+import math
+import threading
+import time
+
+CACHE_ALIAS = getattr(settings, 'USER_CACHE_ALIAS', 'users')
+CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 30)
+FILTER_CAPACITY = getattr(settings, 'USER_FILTER_CAPACITY', 100000)
+FILTER_ERROR_RATE = getattr(settings, 'USER_FILTER_ERROR_RATE', 0.01)
+# seconds a copy is trusted without a version change, bounds how long it misses writes the version did not see
+FILTER_TTL = getattr(settings, 'USER_FILTER_TTL', 60)
+FILTER_KEY = 'users:filter'
+VERSION_KEY = 'users:version'
+# cached absence of an active user, a false positive of the filter or an inactive one, for CACHE_TIMEOUT
+MISSING = ()
+# ids are handed out before the insert commits, a sign-up can become visible after a higher id,
+# catching up starts this many ids before the highest one seen
+LATE_COMMIT_MARGIN = 100
+
+
+class BloomFilter(object):
+    """ No false negatives, about <error_rate> false positives while it holds at most <capacity> names """
+
+    def __init__(self, capacity, error_rate=FILTER_ERROR_RATE, bits=None):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, name):
+        digest = hashlib.blake2b(name.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, name):
+        for position in self._positions(name):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, name):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(name))
+
+
+class _UserFilter(object):
+    """ This process' copy of the filter, the highest user id it covers and the version and time it was synced at """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.bloom = None
+            self.generation = None
+            self.count = 0
+            self.last_id = 0
+            self.version = None
+            self.synced_at = 0.0
+
+    def _load_new_users(self):
+        seen = self.last_id
+        # from the primary, a lagging replica would leave users out of the filter for good
+        for user_id, username in (User.objects.using(DEFAULT_DB_ALIAS).filter(id__gt=seen - LATE_COMMIT_MARGIN)
+                                  .values_list('id', 'username').iterator()):
+            self.bloom.add(username)
+            if user_id > seen:
+                self.count += 1
+                self.last_id = max(self.last_id, user_id)
+
+    def rebuild(self):
+        """ A new filter of every username, sized for twice as many, stored for the other processes """
+        with self._lock:
+            self.bloom = BloomFilter(max(FILTER_CAPACITY, 2 * User.objects.using(DEFAULT_DB_ALIAS).count()))
+            self.count = self.last_id = 0
+            self._load_new_users()
+            self.version = self.generation = _bump_version()
+            self.synced_at = time.monotonic()
+            _cache().set(FILTER_KEY, (self.generation, self.bloom.capacity, bytes(self.bloom.bits), self.count,
+                                      self.last_id), None)
+            return self.count
+
+    def _sync(self):
+        """ False when the filter has to be rebuilt: none stored, the cache lost its version or it is full """
+        # read before catching up, a sign-up in between bumps it again and is picked up next time
+        version = _cache().get(VERSION_KEY)
+        if version is None:
+            return False
+        if self.bloom is not None and version == self.version and time.monotonic() - self.synced_at < FILTER_TTL:
+            return True
+        with self._lock:
+            stored = _cache().get(FILTER_KEY)
+            if stored is None:
+                return False
+            if stored[0] != self.generation:
+                # rebuilt elsewhere (rebuild_user_filter), drop this copy for the new one
+                self.generation, capacity, bits, self.count, self.last_id = stored
+                self.bloom = BloomFilter(capacity, bits=bits)
+            self._load_new_users()
+            self.version = version
+            self.synced_at = time.monotonic()
+            return self.count <= self.bloom.capacity
+
+    def may_exist(self, username):
+        if not self._sync():
+            self.rebuild()
+        return username in self.bloom
+
+    def added(self, user):
+        version = _bump_version()
+        with self._lock:
+            if self.bloom is None:
+                return
+            # counted when a catch up gets to it
+            self.bloom.add(user.username)
+            if self.version is not None and version == self.version + 1:
+                # nobody else signed up in between, nothing to catch up with
+                self.version = version
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _shared():
+    """ False for a cache in process memory, its version only moves on this process' sign-ups """
+    return not isinstance(_cache(), LocMemCache)
+
+
+def _bump_version():
+    try:
+        return _cache().incr(VERSION_KEY)
+    except ValueError:
+        # seeded from the clock as notes_cache's versions, an evicted version never comes back
+        version = int(time.time() * 1000000)
+        _cache().add(VERSION_KEY, version, None)
+        return _cache().get(VERSION_KEY, version)
+
+
+def _record_key(username):
+    # usernames come straight from the request, keep them out of the key
+    return 'users:record:' + hashlib.sha256(username.encode()).hexdigest()
+
+
+user_filter = _UserFilter()
+
+
+def get_active_user(username):
+    """ The active User of <username> (id, username, name and password loaded) or None """
+    if not isinstance(username, str):
+        return None
+    if not _shared():
+        return User.objects.filter(username=username, flag=1).only('id', 'name', 'password').first()
+    if not user_filter.may_exist(username):
+        return None
+    key = _record_key(username)
+    if _cache().get(key) == MISSING:
+        return None
+    user = User.objects.filter(username=username, flag=1).only('id', 'name', 'password').first()
+    if user is None:
+        _cache().set(key, MISSING, CACHE_TIMEOUT)
+    return user
+
+
+def username_taken(username):
+    """ SignUp's availability check, the database is only asked about names the filter may contain """
+    if isinstance(username, str) and _shared() and not user_filter.may_exist(username):
+        return False
+    return User.objects.filter(username=username).exists()
+
+
+def user_added(user):
+    """ Called by SignUp once the user is saved """
+    user_filter.added(user)
+    _cache().delete(_record_key(user.username))
+
+
+def reset():
+    user_filter.reset()
+    _cache().clear()
@@ -1,18 +1,56 @@
 #  Django imports
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_jwt.utils import jwt_encode_handler
-from rest_framework.status import (HTTP_201_CREATED, HTTP_200_OK, HTTP_400_BAD_REQUEST)
-from django.contrib.auth.hashers import check_password, make_password
+from rest_framework.status import (HTTP_201_CREATED, HTTP_200_OK, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST,
+                                   HTTP_503_SERVICE_UNAVAILABLE)
+
+# Hashers import
+from bucketDRF.hashers import HasherBusy, hash_password, verify_password
 
 # Middleware imports
 from bucketDRF.middleware.TokenHandler import jwt_payload_handler
 
 # Models import
-from bucketDRF.models import User, Note
+from bucketDRF.models import User, Note, NoteImport
+
+# Pagination imports
+from bucketDRF.pagination import (PaginationError, as_columns, is_paginated, paginate_changes, paginate_notes,
+                                  parse_fields, parse_layout, parse_limit, parse_offset)
+
+# Search imports
+from bucketDRF.search import search_notes
+
+# Export imports
+from bucketDRF.export import ExportError, export_response
+
+# Import imports
+from bucketDRF.importer import ImportFailed, import_in_background, import_notes, import_progress
+
+# Batch imports
+from bucketDRF.batch import BatchError, apply_batch
+
+# Cache imports
+from bucketDRF import notes_cache
+from bucketDRF.conditional import notes_condition
+
+# DB stats imports
+from bucketDRF import db
+from bucketDRF.db.replicas import mark_written, use_replicas
+
+# Metrics imports
+from bucketDRF import metrics
+
+# Events imports
+from bucketDRF import events
+
+# User cache imports
+from bucketDRF import user_cache
 
 # Misc. imports
 import datetime
+import io
 
 
 class SignUp(APIView):
@@ -38,25 +76,35 @@ class SignUp(APIView):
 
         2. {'message': 'Passwords do not match.'}
         When password != confirm_password
+
+        <Service unavailable 503>:
+        1. {'message': 'Server busy, please retry.'}
+        When every password hashing slot of the process (PASSWORD_HASH_SLOTS) is taken, refused without waiting.
         """
 
         username = request.POST.get('username')
         name = request.POST.get('name')
         password = request.POST.get('password')
         confirm_password = request.POST.get('confirm_password')
-        user_check = User.objects.filter(username=username)
-        if user_check:
-            return Response({'message': 'Please choose another username.'}, HTTP_400_BAD_REQUEST)
         if password != confirm_password:
             return Response({'message': 'Passwords do not match.'}, HTTP_400_BAD_REQUEST)
-        password_hash = make_password(password)
+        if user_cache.username_taken(username):
+            return Response({'message': 'Please choose another username.'}, HTTP_400_BAD_REQUEST)
+        try:
+            password_hash = hash_password(password)
+        except HasherBusy:
+            return Response({'message': 'Server busy, please retry.'}, HTTP_503_SERVICE_UNAVAILABLE)
         now = datetime.datetime.now()
-        User.objects.create(username=username, password=password_hash, name=name, created_at=now, updated_at=now)
+        user = User.objects.create(username=username, password=password_hash, name=name, created_at=now,
+                                   updated_at=now)
+        user_cache.user_added(user)
+        mark_written('username', username)
         return Response({'result': 'Signed up successfully.'}, HTTP_201_CREATED)
 
 
 class SignIn(APIView):
     @staticmethod
+    @use_replicas('username')
     def post(request):
         """
         SignIn requires the following post parameters in body(x-www-form-urlencoded):
@@ -81,31 +129,48 @@ class SignIn(APIView):
         <Bad request 400>:
         1. {'message': 'User does not exist.'}
         User credentials are invalid / user does not exist.
+
+        <Service unavailable 503>:
+        1. {'message': 'Server busy, please retry.'}
+        When every password hashing slot of the process (PASSWORD_HASH_SLOTS) is taken, refused without waiting.
         """
 
         username = request.POST.get('username')
         password = request.POST.get('password')
-        user_obj = User.objects.filter(username=username, flag=1).first()
+        user_obj = user_cache.get_active_user(username)
         if user_obj:
-            if check_password(password, user_obj.password):
+            try:
+                is_correct, new_hash = verify_password(password, user_obj.password)
+            except HasherBusy:
+                return Response({'message': 'Server busy, please retry.'}, HTTP_503_SERVICE_UNAVAILABLE)
+            if is_correct:
+                if new_hash:
+                    # hasher or work factor changed since this password was stored
+                    User.objects.filter(id=user_obj.id).update(password=new_hash)
+                    mark_written('username', username)
                 payload = jwt_payload_handler(user_obj)
                 token = jwt_encode_handler(payload)
                 return Response({'message': 'Signed in successfully.',
                                  'user_details': {'id': user_obj.id,
                                                   'name': user_obj.name},
                                  'token': token}, HTTP_200_OK)
-        else:
-            return Response({'message': 'User does not exist.'}, HTTP_400_BAD_REQUEST)
+        return Response({'message': 'User does not exist.'}, HTTP_400_BAD_REQUEST)
 
 
 class GetNotes(APIView):
     @staticmethod
+    @use_replicas('user')
+    @notes_condition('active')
     def get(request):
         """
         GetNotes extract <user_id> from the token.
         Method: GET
         user_id from JWT thru middleware
         note_id (optional, to load a particular note)
+        fields (optional, comma separated subset of id,title,details,created_at,updated_at)
+        limit (optional, page size, enables cursor pagination, newest first)
+        cursor (optional, <next_cursor> from the previous page)
+        layout (optional, rows (default) or columns)
 
         url pattern -> notes/view
 
@@ -127,8 +192,19 @@ class GetNotes(APIView):
         ]
         }
         All notes associated to the user.
+        When <limit> or <cursor> is given, the response also carries
+        'next_cursor': <cursor for the next page, null on the last page>
+
+        3. {'result': {'keys': ['id', 'title', ...], 'rows': [[<note_id>, <note_title>, ...], [. . .]]}}
+        With layout=columns, the same notes with their keys sent once. A single note_id keeps layout 2.
+
+        <Not modified 304>
+        When If-None-Match / If-Modified-Since still match the ETag / Last-Modified of the list.
+
+        <Bad request 400>:
+        1. {'message': 'Invalid cursor.'}
+        When cursor, limit, fields or layout cannot be parsed.
         """
-        print(request.user.id)
         user_id = request.requested_by
         note_id = request.GET.get('note_id', None)
         if not note_id:
@@ -136,11 +212,27 @@ class GetNotes(APIView):
         else:
             dynamic_filter = {'user_id': user_id, 'archived': False, 'flag': True, 'id': note_id}
 
-        notes_data = Note.objects.filter(**dynamic_filter).values('id', 'title', 'details', 'created_at', 'updated_at')
+        queryset = Note.objects.filter(**dynamic_filter)
+        try:
+            fields = parse_fields(request)
+            columns = parse_layout(request)
+            if not note_id and is_paginated(request):
+                params = (request.GET.get('limit'), request.GET.get('cursor')) + fields
+                notes_data, next_cursor = notes_cache.get_or_load(user_id, 'active', params,
+                                                                  lambda: paginate_notes(queryset, request, fields))
+                return Response({'result': as_columns(notes_data, fields) if columns else notes_data,
+                                 'next_cursor': next_cursor}, HTTP_200_OK)
+        except PaginationError as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+
         if note_id:
-            notes_data = notes_data.first()
+            notes_data = queryset.values(*fields).first()
+        else:
+            notes_data = notes_cache.get_or_load(user_id, 'active', fields, lambda: list(queryset.values(*fields)))
         if not notes_data:
             return Response({'message': 'No notes found.'}, HTTP_200_OK)
+        if columns and not note_id:
+            notes_data = as_columns(notes_data, fields)
         return Response({'result': notes_data}, HTTP_200_OK)
 
 
@@ -166,7 +258,10 @@ class CreateNote(APIView):
         details = request.POST.get('details', None)
         title = request.POST.get('title', None)
         now = datetime.datetime.now()
-        Note.objects.create(user_id=user_id, title=title, details=details, created_at=now, updated_at=now, flag=True)
+        note = Note.objects.create(user_id=user_id, title=title, details=details, created_at=now, updated_at=now,
+                                   flag=True)
+        notes_cache.invalidate(user_id)
+        events.publish(user_id, 'created', note.id, now)
         return Response({'result': 'Note created!'}, HTTP_201_CREATED)
 
 
@@ -188,6 +283,7 @@ class EditNote(APIView):
                 deleting requires just <note_id>
                 -> DO USE CONFIRMATION ON FRONTEND BEFORE EXECUTING THIS, This operation
                 cannot be reverted.
+                -> The note is soft deleted (flag off) so notes/sync can hand out a tombstone.
 
          url pattern -> notes/edit/
 
@@ -218,26 +314,23 @@ class EditNote(APIView):
         now = datetime.datetime.now()
         if not note_id:
             return Response({'message': 'No note_id'}, HTTP_400_BAD_REQUEST)
-        note_obj = Note.objects.get(id=note_id, user_id=user_id)
         if mode == 'edit':
-            if note_obj:
-                note_obj.details = details
-                note_obj.title = title
-                note_obj.updated_at = now
-                note_obj.save()
-
-                return Response({'result': 'Note edited'}, HTTP_200_OK)
-            else:
-                return Response({'message': 'Note not found'}, HTTP_400_BAD_REQUEST)
+            changes = {'details': details, 'title': title, 'updated_at': now}
+            result, event_type = 'Note edited', 'edited'
         elif mode == 'delete':
-            if note_obj:
-                note_obj.delete()
-                return Response({'result': 'Note deleted.'}, HTTP_200_OK)
-            else:
-                return Response({'message': 'Note not found'}, HTTP_400_BAD_REQUEST)
+            changes = {'flag': False, 'updated_at': now}
+            result, event_type = 'Note deleted.', 'deleted'
         else:
             return Response({'message': 'Please provide a mode, edit or delete'}, HTTP_400_BAD_REQUEST)
 
+        # a single conditional UPDATE, ownership and existence checked by its WHERE clause
+        updated = note_id.isdigit() and Note.objects.filter(id=note_id, user_id=user_id, flag=True).update(**changes)
+        if not updated:
+            return Response({'message': 'Note not found'}, HTTP_400_BAD_REQUEST)
+        notes_cache.invalidate(user_id)
+        events.publish(user_id, event_type, int(note_id), now)
+        return Response({'result': result}, HTTP_200_OK)
+
 
 class ArchiveNote(APIView):
     @staticmethod
@@ -259,22 +352,27 @@ class ArchiveNote(APIView):
 
         """
         user_id = request.requested_by
-        note_id = request.GET.get('note_id')
-        note_obj = Note.objects.filter(id=note_id, user_id=user_id).first()
-        if not note_obj:
-            return  Response({'message': 'Note not found.'}, HTTP_400_BAD_REQUEST)
-        note_obj.archived = True
-        note_obj.save()
+        note_id = request.GET.get('note_id', '')
+        now = datetime.datetime.now()
+        updated = note_id.isdigit() and Note.objects.filter(id=note_id, user_id=user_id, flag=True).update(
+            archived=True, updated_at=now)
+        if not updated:
+            return Response({'message': 'Note not found.'}, HTTP_400_BAD_REQUEST)
+        notes_cache.invalidate(user_id)
+        events.publish(user_id, 'archived', int(note_id), now)
         return Response({'result': 'Note archived!'}, HTTP_200_OK)
 
 
 class ViewArchivedNotes(APIView):
     @staticmethod
+    @use_replicas('user')
+    @notes_condition('archived')
     def get(request):
         """
                 ViewArchivedNotes extract <user_id> from the token.
                 Method: GET
                 user_id from JWT thru middleware
+                fields, limit, cursor, layout (optional, same as notes/view)
 
                 url pattern -> notes/getarchived
 
@@ -296,10 +394,349 @@ class ViewArchivedNotes(APIView):
                 ]
                 }
                 All notes associated to the user.
+                When <limit> or <cursor> is given, the response also carries 'next_cursor'.
+                With layout=columns: {'result': {'keys': [...], 'rows': [[...], ...]}}, as with notes/view.
+
+                <Not modified 304>
+                When If-None-Match / If-Modified-Since still match the ETag / Last-Modified of the list.
                 """
         user_id = request.requested_by
-        notes_data = Note.objects.filter(user_id=user_id, archived=True, flag=True).values('id', 'title', 'details',
-                                                                                           'created_at', 'updated_at')
+        queryset = Note.objects.filter(user_id=user_id, archived=True, flag=True)
+        try:
+            fields = parse_fields(request)
+            columns = parse_layout(request)
+            if is_paginated(request):
+                params = (request.GET.get('limit'), request.GET.get('cursor')) + fields
+                notes_data, next_cursor = notes_cache.get_or_load(user_id, 'archived', params,
+                                                                  lambda: paginate_notes(queryset, request, fields))
+                return Response({'result': as_columns(notes_data, fields) if columns else notes_data,
+                                 'next_cursor': next_cursor}, HTTP_200_OK)
+        except PaginationError as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+
+        notes_data = notes_cache.get_or_load(user_id, 'archived', fields, lambda: list(queryset.values(*fields)))
         if not notes_data:
             return Response({'message': 'No notes found.'}, HTTP_200_OK)
-        return Response({'result': notes_data}, HTTP_200_OK)
+        return Response({'result': as_columns(notes_data, fields) if columns else notes_data}, HTTP_200_OK)
+
+
+class BatchNotes(APIView):
+    @staticmethod
+    def post(request):
+        """
+        BatchNotes applies many note operations in one request and one transaction.
+        Method: POST
+        user_id is however extracted from JWT
+        body (application/json), an array of operations:
+        [
+            {'op': 'create', 'title': <note_title>, 'details': <note_data/details>},
+            {'op': 'edit', 'note_id': <note_id>, 'title': <note_title>, 'details': <note_data/details>},
+            {'op': 'archive', 'note_id': <note_id>},
+            {'op': 'delete', 'note_id': <note_id>},
+            {. . .}
+        ]
+        Creates are applied first, then edits, archives and deletes.
+
+        url pattern -> notes/batch/
+
+        return:
+        <OK 200>:
+        1. {
+        'result': [
+            {'status': 201, 'id': <note_id, null when the database does not return it>},
+            {'status': 200, 'id': <note_id>},
+            {'status': 400, 'message': 'Note not found', 'id': <note_id>},
+            {. . .}
+        ]
+        }
+        One result per operation, in order.
+
+        <Bad request 400>:
+        1. {'message': 'Expected a JSON array of operations.'}
+        When the body is not an array or carries too many operations.
+        """
+        user_id = request.requested_by
+        try:
+            results = apply_batch(user_id, request.data)
+        except BatchError as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+        return Response({'result': results}, HTTP_200_OK)
+
+
+class ImportNotes(APIView):
+    @staticmethod
+    def post(request):
+        """
+        ImportNotes creates notes in bulk from an NDJSON or CSV upload, read and inserted batch by batch.
+        Method: POST
+        user_id is however extracted from JWT
+        import_id (query parameter, names the import, send the same upload again with it to resume)
+        type (query parameter, optional, ndjson (default) or csv)
+        background (query parameter, optional, 1 to queue the import for a run_jobs worker and answer right away)
+        body, the upload itself or a multipart form with a <file>:
+            ndjson, one note per line: {"title": <note_title>, "details": <note_details>, "archived": <bool>}
+            csv, a header row with title and optionally details and archived, then one note per row
+
+        url pattern -> notes/import/
+
+        return:
+        <OK 200>:
+        1. {
+        'result': {
+            'import_id': <import_id>,
+            'rows_done': <rows read so far, the checkpoint>,
+            'imported': <notes created so far>,
+            'failed': <rows rejected so far>,
+            'errors': [{'row': <row number>, 'error': <reason>}, {. . .}]
+            }
+        }
+        errors lists the first 100 rejected rows of this request.
+
+        <Accepted 202>:
+        1. {'result': {'import_id': <import_id>, 'rows_done': <count>, 'imported': <count>, 'failed': <count>}}
+        With background=1, the progress so far, follow it with GET notes/import/.
+
+        <Bad request 400>:
+        1. {'message': 'import_id must be 1 to 64 letters, digits or ._:- characters.'}
+        When import_id or type is missing or invalid, or the CSV header has no title.
+
+        2. {'message': 'import_id <import_id> is being imported by another request.'}
+        """
+        upload = request.FILES.get('file') if request.content_type.startswith('multipart/') else request.stream
+        if request.GET.get('background') == '1':
+            try:
+                job = import_in_background(request.requested_by, request.GET.get('import_id', ''),
+                                           upload or io.BytesIO(), request.GET.get('type', 'ndjson'))
+            except ImportFailed as e:
+                return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+            return Response({'result': import_progress(job)}, HTTP_202_ACCEPTED)
+        try:
+            job, errors = import_notes(request.requested_by, request.GET.get('import_id', ''), upload or [],
+                                       request.GET.get('type', 'ndjson'))
+        except ImportFailed as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+        return Response({'result': dict(import_progress(job), errors=errors)}, HTTP_200_OK)
+
+    @staticmethod
+    def get(request):
+        """
+        Progress of an import, also while it is running.
+        Method: GET
+        import_id
+
+        url pattern -> notes/import/
+
+        return:
+        <OK 200>:
+        1. {'result': {'import_id': <import_id>, 'rows_done': <count>, 'imported': <count>, 'failed': <count>}}
+
+        <Bad request 400>:
+        1. {'message': 'Import not found.'}
+        """
+        job = NoteImport.objects.filter(user_id=request.requested_by, import_id=request.GET.get('import_id', '')).first()
+        if job is None:
+            return Response({'message': 'Import not found.'}, HTTP_400_BAD_REQUEST)
+        return Response({'result': import_progress(job)}, HTTP_200_OK)
+
+
+class SyncNotes(APIView):
+    @staticmethod
+    def get(request):
+        """
+        SyncNotes returns the notes changed after <since>, deleted notes included as tombstones.
+        Method: GET
+        user_id from JWT thru middleware
+        since (optional, ISO timestamp or <next_since> of the previous call, omit for a full sync)
+        limit (optional, page size)
+
+        url pattern -> notes/sync
+
+        return:
+        <OK 200>
+        1. {
+        'result': [
+            {
+            'id': <note_id>,
+            'title': <note_title>,
+            'details': <note_data/details>,
+            'archived': <true/false>,
+            'created_at': <note_created_at>,
+            'updated_at': <note_updated_at>,
+            'deleted': false
+            },
+            {
+            'id': <note_id>,
+            'updated_at': <note_deleted_at>,
+            'deleted': true
+            },
+            {. . .}
+        ],
+        'next_since': <pass as since on the next call>,
+        'has_more': <true when another page is waiting>
+        }
+        Changes oldest first.
+
+        <Bad request 400>:
+        1. {'message': 'Invalid cursor.'}
+        When since or limit cannot be parsed.
+        """
+        user_id = request.requested_by
+        try:
+            changes, next_since, has_more = paginate_changes(Note.objects.filter(user_id=user_id), request)
+        except PaginationError as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+        return Response({'result': changes, 'next_since': next_since, 'has_more': has_more}, HTTP_200_OK)
+
+
+class ExportNotes(APIView):
+    @staticmethod
+    def get(request):
+        """
+        ExportNotes streams every note of the user (archived ones included, deleted ones not), oldest change first.
+        Method: GET
+        user_id from JWT thru middleware
+        type (optional, ndjson (default) or csv)
+        Accept-Encoding: br or gzip (optional header, the export is then compressed on the fly)
+
+        url pattern -> notes/export
+
+        return:
+        <OK 200>
+        1. ndjson, one note per line
+        {"id": <note_id>, "title": <note_title>, "details": <note_details>, "archived": <bool>,
+         "created_at": <note_created_at>, "updated_at": <note_updated_at>}
+
+        2. csv, a header row id,title,details,archived,created_at,updated_at and one row per note
+
+        <Bad request 400>:
+        1. {'message': 'type must be one of ndjson, csv.'}
+
+        Under bucket_list.asgi this route is served by bucketDRF.event_stream, not by this view.
+        """
+        try:
+            return export_response(request, request.requested_by)
+        except ExportError as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+
+
+class SearchNotes(APIView):
+    @staticmethod
+    def get(request):
+        """
+        SearchNotes runs a full text search over the title and details of the user's notes.
+        Method: GET
+        user_id from JWT thru middleware
+        q (search text, quoted "phrases", or and -excluded words are understood)
+        limit (optional, page size)
+        offset (optional, <next_offset> of the previous page)
+
+        url pattern -> notes/search
+
+        return:
+        <OK 200>
+        1. {
+        'result': [
+            {
+            'id': <note_id>,
+            'title': <note_title>,
+            'details': <note_data/details>,
+            'archived': <true/false>,
+            'created_at': <note_created_at>,
+            'updated_at': <note_updated_at>,
+            'rank': <relevance, higher is better>
+            },
+            {. . .}
+        ],
+        'next_offset': <offset of the next page, null on the last page>
+        }
+        Best matches first.
+
+        <Bad request 400>:
+        1. {'message': 'No search query'}
+        When q is missing.
+
+        2. {'message': 'Invalid limit.'} / {'message': 'Invalid offset.'}
+        When limit or offset cannot be parsed.
+        """
+        user_id = request.requested_by
+        q = request.GET.get('q', '').strip()
+        if not q:
+            return Response({'message': 'No search query'}, HTTP_400_BAD_REQUEST)
+        try:
+            limit = parse_limit(request)
+            offset = parse_offset(request)
+        except PaginationError as e:
+            return Response({'message': str(e)}, HTTP_400_BAD_REQUEST)
+        notes_data, has_more = search_notes(user_id, q, limit, offset)
+        return Response({'result': notes_data, 'next_offset': offset + limit if has_more else None}, HTTP_200_OK)
+
+
+class NotesCacheStats(APIView):
+    @staticmethod
+    def get(request):
+        """
+        NotesCacheStats reports the notes cache counters of the serving process.
+        Method: GET
+
+        url pattern -> notes/cachestats
+
+        return:
+        <OK 200>
+        1. {
+        'result': {
+            'hits': <count>,
+            'misses': <count>,
+            'invalidations': <count>,
+            'evictions': <count>,
+            'hit_ratio': <hits / (hits + misses)>
+            }
+        }
+        """
+        return Response({'result': notes_cache.stats()}, HTTP_200_OK)
+
+
+class DatabaseStats(APIView):
+    @staticmethod
+    def get(request):
+        """
+        DatabaseStats reports the connection counters of the serving process, per database alias.
+        Method: GET
+
+        url pattern -> db/stats
+
+        return:
+        <OK 200>
+        1. {
+        'result': {
+            'default': {
+                'connects': <new connections opened>,
+                'connect_seconds': <time spent opening them>,
+                'checkouts': <connections taken from the pool>,
+                'checkout_wait_seconds': <time spent waiting on the pool>,
+                'checkout_wait_max_seconds': <longest wait>,
+                'pool_timeouts': <requests which got no connection>,
+                'health_check_failures': <stale connections dropped>
+                }
+            }
+        }
+        """
+        return Response({'result': db.stats()}, HTTP_200_OK)
+
+
+class Metrics(APIView):
+    @staticmethod
+    def get(request):
+        """
+        Metrics exposes the request metrics of the serving process in the Prometheus text format.
+        Method: GET
+        With METRICS_TOKEN set, a scraper sends 'Authorization: Bearer <METRICS_TOKEN>' instead of the API key and JWT.
+
+        url pattern -> metrics
+
+        return:
+        <OK 200>
+        1. bucket_request_duration_seconds, bucket_request_db_queries, bucket_request_db_duration_seconds and
+        bucket_response_size_bytes histograms and the bucket_requests_total counter, labelled by route and method,
+        then the db/stats and notes/cachestats counters.
+        """
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
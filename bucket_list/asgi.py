@@ -0,0 +1,21 @@
+"""
+ASGI config for bucket_list project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bucket_list.settings_asgi')
+
+django_application = get_asgi_application()
+
+# notes/events (SSE and WebSocket) and notes/export are served next to Django, see bucketDRF.event_stream
+from bucketDRF.event_stream import EventStreamRouter  # noqa: E402
+
+application = EventStreamRouter(django_application)
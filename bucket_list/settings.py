@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import sys
 from corsheaders.defaults import default_headers
 import datetime
+import dj_database_url
 import django_heroku
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -48,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bucketDRF.middleware.Metrics.MetricsMiddleware',
+    'bucketDRF.middleware.Profiling.ProfilingMiddleware',
+    'bucketDRF.middleware.Compression.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'bucketDRF.middleware.TokenHandler.ApiTokenCheckMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -86,6 +91,8 @@ WSGI_APPLICATION = 'bucket_list.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -98,6 +105,69 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# notes lists are cached per user in process memory (LRU), set NOTES_CACHE_URL (redis://...) to share
+# them between workers, which needs django-redis installed. Every worker has to see the same versions,
+# settings_production uses $REDIS_URL, without it gunicorn.conf.py starts one worker (and warns about more).
+
+NOTES_CACHE_TIMEOUT = int(os.environ.get('NOTES_CACHE_TIMEOUT', 300))
+
+# rows fetched per round trip of the server side cursor behind notes/export
+NOTES_EXPORT_CHUNK_SIZE = int(os.environ.get('NOTES_EXPORT_CHUNK_SIZE', 2000))
+# rows inserted (and checkpointed) per transaction by notes/import/ and import_notes
+NOTES_IMPORT_BATCH_SIZE = int(os.environ.get('NOTES_IMPORT_BATCH_SIZE', 1000))
+# notes/import/?background=1 uploads wait in the database for a run_jobs worker, in pieces of this many bytes
+NOTES_IMPORT_UPLOAD_CHUNK_SIZE = int(os.environ.get('NOTES_IMPORT_UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# background jobs (bucketDRF.jobs) run by manage.py run_jobs: attempts per job, seconds a claimed job
+# is held before another worker may take it over, first retry delay (doubled on every attempt)
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+JOBS_TIMEOUT = int(os.environ.get('JOBS_TIMEOUT', 300))
+JOBS_RETRY_DELAY = int(os.environ.get('JOBS_RETRY_DELAY', 10))
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1.0))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'notes': {
+        'BACKEND': 'bucketDRF.notes_cache.CountingLocMemCache',
+        'LOCATION': 'notes',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('NOTES_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+
+def redis_cache(url, **options):
+    return dict({'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': url}, **options)
+
+
+NOTES_CACHE_URL = os.environ.get('NOTES_CACHE_URL')
+if NOTES_CACHE_URL:
+    CACHES['notes'] = redis_cache(NOTES_CACHE_URL)
+
+# SignIn / SignUp lookups (bucketDRF.user_cache): absent users for USER_CACHE_TIMEOUT seconds and the
+# Bloom filter of usernames, sized for USER_FILTER_CAPACITY names (or twice the users) at
+# USER_FILTER_ERROR_RATE false positives, caught up with the table at least every USER_FILTER_TTL
+# seconds. Only used when shared thru NOTES_CACHE_URL, in process memory SignIn and SignUp query the table.
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 30))
+USER_FILTER_CAPACITY = int(os.environ.get('USER_FILTER_CAPACITY', 100000))
+USER_FILTER_ERROR_RATE = float(os.environ.get('USER_FILTER_ERROR_RATE', 0.01))
+USER_FILTER_TTL = int(os.environ.get('USER_FILTER_TTL', 60))
+CACHES['users'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'users',
+    'OPTIONS': {
+        'MAX_ENTRIES': int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000)),
+    },
+}
+if NOTES_CACHE_URL:
+    CACHES['users'] = redis_cache(NOTES_CACHE_URL, KEY_PREFIX='users')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -167,11 +237,145 @@ JWT_AUTH = {
     'JWT_AUTH_HEADER_PREFIX': 'Bearer',
 }
 
+# responses are rendered and JSON bodies parsed by the JSON_BACKEND of bucketDRF.renderers,
+# 'orjson' (falls back to the stdlib json when orjson is not installed) or 'json'
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson')
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'bucketDRF.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'bucketDRF.renderers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# verified tokens kept by ApiTokenCheckMiddleware, entries never outlive the token's exp
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', 10000))
+JWT_CACHE_TTL = int(os.environ.get('JWT_CACHE_TTL', 300))
+
+
+# PASSWORD_HASHER picks the hasher for new and rehashed passwords (bcrypt or argon2, argon2 needs argon2-cffi),
+# the other one stays listed so stored hashes keep verifying and get upgraded on the next sign in
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'bcrypt')
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12))
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 512))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 2))
 
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'bucketDRF.hashers.BCryptSHA256PasswordHasher',
+    'bucketDRF.hashers.Argon2PasswordHasher',
 ]
+if PASSWORD_HASHER == 'argon2':
+    PASSWORD_HASHERS.reverse()
+
+# hashing runs on a thread pool per process, at most PASSWORD_HASH_WORKERS cores of each gunicorn worker go
+# to sign up / sign in (times WEB_CONCURRENCY for the dyno). At most PASSWORD_HASH_SLOTS request threads of
+# a worker wait for a hash, kept below GUNICORN_THREADS so note reads always have a thread, the next
+# sign in is answered 503 at once.
+PASSWORD_HASH_OFFLOAD = os.environ.get('PASSWORD_HASH_OFFLOAD', '1') == '1'
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+PASSWORD_HASH_SLOTS = int(os.environ.get('PASSWORD_HASH_SLOTS', max(1, min(
+    PASSWORD_HASH_WORKERS + 1, int(os.environ.get('GUNICORN_THREADS', 4)) - 1))))
+
+# token bucket budgets per route ('default' for the others), per scope: 'key' (API key), 'user' (requested_by)
+# and 'ip', as '<count>/<s|m|h|d>'. The memory backend counts in each worker, RATE_LIMIT_BACKEND=cache
+# counts in the RATE_LIMIT_CACHE alias shared by the workers (point it at a redis cache).
+# RATE_LIMIT_PROXIES=1 behind Heroku's router (settings_production's default) takes the client address from
+# X-Forwarded-For.
+RATE_LIMITS = {
+    'default': {'user': '600/m', 'ip': '1200/m'},
+    'auth/signin/': {'ip': '20/m'},
+    'auth/signup/': {'ip': '10/m'},
+    'notes/create/': {'user': '120/m'},
+    'notes/batch/': {'user': '60/m'},
+    'notes/import/': {'user': '10/m'},
+    'notes/export': {'user': '10/m'},
+}
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_CACHE = os.environ.get('RATE_LIMIT_CACHE', 'default')
+RATE_LIMIT_PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 0))
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get('RATE_LIMIT_MAX_BUCKETS', 100000))
+
+# request metrics served on /metrics, scrapers send 'Authorization: Bearer $METRICS_TOKEN' instead of
+# the API key and a JWT, without METRICS_TOKEN the endpoint takes the usual API key and JWT
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '1') == '1'
+
+# responses of at least COMPRESS_MIN_SIZE bytes are sent brotli (when the brotli package is installed) or
+# gzip compressed, whichever the client accepts, smaller ones are not worth the CPU nor the extra headers
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+
+# notes/events change stream (bucket_list.asgi only), 'local' delivers events in the process making the
+# change, 'postgres' thru LISTEN/NOTIFY so streams on every worker and process see every change
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local')
+EVENTS_HEARTBEAT = int(os.environ.get('EVENTS_HEARTBEAT', 25))
+EVENTS_MAX_STREAMS_PER_USER = int(os.environ.get('EVENTS_MAX_STREAMS_PER_USER', 5))
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 100))
+
+# opt-in profiling (bucketDRF.profiling): requests sent with 'X-Profile: $PROFILE_TOKEN', and a
+# PROFILE_SAMPLE_RATE share of all requests, get their call tree and queries written to
+# PROFILE_DIR/<release>/. SLOW_QUERY_MS > 0 logs the queries slower than that with their EXPLAIN plan, which
+# costs a second run of the query's planning, off by default.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+RELEASE = os.environ.get('HEROKU_RELEASE_VERSION') or os.environ.get('SOURCE_VERSION')
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
 
 # enable heroku
 django_heroku.settings(locals())
 
+# Database connections, applied after django_heroku so they also cover $DATABASE_URL
+# DB_POOL=1 checks connections out of an in-process pool (one per thread of a gunicorn worker),
+# otherwise connections persist for DB_CONN_MAX_AGE seconds. DB_PGBOUNCER=1 when HOST is a
+# pgbouncer in transaction mode, which cannot keep server side cursors open. Connections which sat
+# unused for DB_CONN_HEALTH_CHECK_IDLE seconds are pinged before a request gets them.
+if 'postgresql' in DATABASES['default']['ENGINE']:
+    DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+    DATABASES['default'].update({
+        'ENGINE': 'bucketDRF.db.postgresql',
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'POOL_SIZE': int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 4))) if DB_POOL else 0,
+        'POOL_TIMEOUT': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'HEALTH_CHECK_IDLE': int(os.environ.get('DB_CONN_HEALTH_CHECK_IDLE', 30)),
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_PGBOUNCER', '0') == '1',
+    })
+
+# read replicas, DB_REPLICA_URLS=postgres://...,postgres://... adds the aliases replica1, replica2...
+# with the connection options of 'default'. GetNotes, ViewArchivedNotes and SignIn read from them
+# (bucketDRF.db.replicas), a user's reads stay on the primary for REPLICA_STICKY_SECONDS after a write,
+# keep REPLICA_MAX_LAG (seconds behind the primary before a replica is left out) below it.
+DB_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DB_REPLICA_URLS', '').split(',')), 1):
+    replica = dict(DATABASES['default'])
+    replica.update({key: value for key, value in dj_database_url.parse(url).items()
+                    if key in ('NAME', 'USER', 'PASSWORD', 'HOST', 'PORT')})
+    DATABASES['replica{}'.format(number)] = replica
+    DB_REPLICAS.append('replica{}'.format(number))
+DATABASE_ROUTERS = ['bucketDRF.db.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = int(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+
+# run the test suite against sqlite, no postgres needed, 'replica' is a second database for the
+# replica tests, which switch DB_REPLICAS on themselves
+if 'test' in sys.argv:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+        },
+    }
+    DB_REPLICAS = []
@@ -0,0 +1,9 @@
+"""
+ASGI settings for bucket_list, used by bucket_list/asgi.py.
+
+Production settings with the async note views routed in (bucket_list.urls_async).
+"""
+
+from bucket_list.settings_production import *  # noqa: F401,F403
+
+ROOT_URLCONF = 'bucket_list.urls_async'
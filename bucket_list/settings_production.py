@@ -0,0 +1,34 @@
+"""
+Production settings for bucket_list, used by gunicorn.conf.py, bucket_list/asgi.py and the Procfile worker.
+
+Same as bucket_list.settings with DEBUG off, so queries are no longer recorded in
+memory and errors do not leak tracebacks, with JSON as the only renderer and with the state
+every worker has to share (note list versions, sticky reads, note events) out of process memory.
+"""
+
+from bucket_list.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+# JSON only, the browsable API is for local development
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=['bucketDRF.renderers.JSONRenderer'])
+
+# whitenoise (inserted first in MIDDLEWARE by django_heroku) answers '/' with the fallback page
+# straight from memory, before the API key check and without rendering a template
+WHITENOISE_ROOT = os.path.join(BASE_DIR, 'bucketDRF', 'templates')
+WHITENOISE_INDEX_FILE = 'fallback.html'
+WHITENOISE_MAX_AGE = 60 * 60 * 24
+
+# gunicorn runs several workers, a write has to reach the cached lists of all of them: the caches go
+# to Heroku Redis ($REDIS_URL) unless NOTES_CACHE_URL points elsewhere. gunicorn.conf.py starts one
+# worker when neither is set, and warns when WEB_CONCURRENCY asks for more.
+if not NOTES_CACHE_URL and os.environ.get('REDIS_URL'):
+    NOTES_CACHE_URL = os.environ.get('REDIS_URL')
+    CACHES = dict(CACHES, notes=redis_cache(NOTES_CACHE_URL), users=redis_cache(NOTES_CACHE_URL, KEY_PREFIX='users'))
+
+# note events reach the streams of every worker thru LISTEN/NOTIFY
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'postgres')
+
+# Heroku's router is the one proxy in front of the dynos, REMOTE_ADDR is its address: the ip budgets
+# (sign in, sign up) are kept per client address it appends to X-Forwarded-For
+RATE_LIMIT_PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 1))
@@ -24,4 +24,12 @@ urlpatterns = [
     path('notes/edit/', bucket.EditNote.as_view()),
     path('notes/archive', bucket.ArchiveNote.as_view()),
     path('notes/getarchived', bucket.ViewArchivedNotes.as_view()),
+    path('notes/batch/', bucket.BatchNotes.as_view()),
+    path('notes/sync', bucket.SyncNotes.as_view()),
+    path('notes/search', bucket.SearchNotes.as_view()),
+    path('notes/export', bucket.ExportNotes.as_view()),
+    path('notes/import/', bucket.ImportNotes.as_view()),
+    path('notes/cachestats', bucket.NotesCacheStats.as_view()),
+    path('db/stats', bucket.DatabaseStats.as_view()),
+    path('metrics', bucket.Metrics.as_view()),
 ]
@@ -0,0 +1,20 @@
+"""bucket_list URL Configuration for ASGI
+
+Same routes as bucket_list.urls, with the note views swapped for their async variants.
+bucket_list.settings_asgi points ROOT_URLCONF here.
+"""
+from django.urls import path
+from bucketDRF import async_views
+from bucket_list.urls import urlpatterns as sync_urlpatterns
+
+async_routes = {
+    'notes/view': async_views.get_notes,
+    'notes/create/': async_views.create_note,
+    'notes/edit/': async_views.edit_note,
+    'notes/archive': async_views.archive_note,
+    'notes/getarchived': async_views.view_archived_notes,
+}
+
+urlpatterns = [path(route, view) for route, view in async_routes.items()] + [
+    pattern for pattern in sync_urlpatterns if str(pattern.pattern) not in async_routes
+]
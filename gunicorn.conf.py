@@ -0,0 +1,60 @@
+"""
+Gunicorn config for bucket_list, read by `gunicorn -c gunicorn.conf.py bucket_list.wsgi`,
+or for the async note views:
+`GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py bucket_list.asgi:application`
+
+Every value can be overridden thru the environment, see
+https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8000'))
+
+# requests mostly wait on postgres, threads overlap that wait inside each process. Without a shared
+# cache (REDIS_URL or NOTES_CACHE_URL) each worker would cache note lists on its own, one worker then.
+SHARED_CACHE_URL = os.environ.get('NOTES_CACHE_URL') or os.environ.get('REDIS_URL')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1 if SHARED_CACHE_URL else 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')  # 'gevent' needs gevent installed
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# keep-alive covers the mobile clients polling notes/view, the router in front closes idle connections itself
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# recycle workers so slow leaks never pile up, jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# uvicorn workers serve the ASGI app, which routes the async note views
+default_settings = 'bucket_list.settings_asgi' if 'uvicorn' in worker_class else 'bucket_list.settings_production'
+raw_env = ['DJANGO_SETTINGS_MODULE={}'.format(os.environ.get('DJANGO_SETTINGS_MODULE', default_settings))]
+accesslog = '-'
+errorlog = '-'
+
+# caches and event backends which live in one process, each worker would see only its own writes
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'bucketDRF.notes_cache.CountingLocMemCache')
+SHARED_CACHE_ALIASES = ('notes', 'users')
+
+
+def on_starting(server):
+    """
+    Warns when several workers keep caches in process memory (bucket_list.settings_production): they
+    start, but a worker serves its own cached lists until NOTES_CACHE_TIMEOUT after another one's write.
+    Several uvicorn workers on EVENTS_BACKEND=local are refused, their streams would miss most events.
+    """
+    if server.cfg.workers <= 1:
+        return
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', raw_env[0].split('=', 1)[1])
+    from django.conf import settings
+    local = [alias for alias in SHARED_CACHE_ALIASES
+             if settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHES]
+    if local:
+        server.log.warning('%s workers do not share the %s cache in process memory, writes reach the other workers '
+                           'after NOTES_CACHE_TIMEOUT. Set REDIS_URL or NOTES_CACHE_URL (or WEB_CONCURRENCY=1).',
+                           server.cfg.workers, ', '.join(local))
+    if 'uvicorn' in server.cfg.worker_class_str and getattr(settings, 'EVENTS_BACKEND', 'local') == 'local':
+        raise SystemExit('{} workers cannot share EVENTS_BACKEND=local, use postgres.'.format(server.cfg.workers))